@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, redirect
+from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, Response
 from datetime import datetime
 import json
 import re
@@ -12,6 +12,7 @@ from firebase_admin import credentials, firestore, storage
 import os
 import logging
 import requests
+import threading
 from typing import List, Dict, Optional, Any
 import openai
 import random
@@ -52,6 +53,14 @@ from knowledge_engine import KnowledgeEngine
 from formats_generation_engine import FormatsGenerationEngine
 from format_types import FormatType
 from prompts_engine import PromptsEngine, PromptType, AIProviderManager
+from text_analysis import analyze
+from conversation_session_store import ConversationSessionStore, SQLiteSessionBackend
+from generation_jobs import GenerationJobStore
+# Local vector index for story/insight similarity (requires numpy)
+try:
+    from vector_index import SemanticIndex
+except ImportError:
+    SemanticIndex = None
 
 # The logger isn't configured until now, replicate the earlier messages
 if not openai.api_key:
@@ -167,35 +176,38 @@ def is_demo_user(user_id):
     """Check if user is demo user"""
     return user_id and user_id.startswith('demo_')
 
-def analyze_text(text):
-    """Analyzes text and finds themes, emotions and connections"""
-    # Tokenize text
-    try:
-        tokens = word_tokenize(text.lower())
-    except LookupError:
-        # Attempt to download punkt on the fly once, then retry
+_STOP_WORDS = None
+
+def _stop_words():
+    """Stopword set, loaded once - use English as fallback if Estonian not available"""
+    global _STOP_WORDS
+    if _STOP_WORDS is None:
         try:
-            nltk.download('punkt', quiet=True)
-            tokens = word_tokenize(text.lower())
-        except Exception:
-            # Fallback to simple split if tokenizer still unavailable
-            tokens = text.lower().split()
+            _STOP_WORDS = set(stopwords.words('estonian'))
+        except OSError:
+            logger.warning("Estonian stopwords not available, using English stopwords")
+            try:
+                _STOP_WORDS = set(stopwords.words('english'))
+            except (OSError, LookupError):
+                _STOP_WORDS = set()
+        except LookupError:
+            _STOP_WORDS = set()
+    return _STOP_WORDS
+
+def analyze_text(text):
+    """Analyzes text (str or AnalyzedText) and finds themes, emotions and connections"""
+    analyzed = analyze(text)
     
-    # Remove stopwords - use English as fallback if Estonian not available
-    try:
-        stop_words = set(stopwords.words('estonian'))
-    except OSError:
-        logger.warning("Estonian stopwords not available, using English stopwords")
-        stop_words = set(stopwords.words('english'))
-    tokens = [word for word in tokens if word not in stop_words and len(word) > 2]
+    # Remove stopwords from the shared token list
+    stop_words = _stop_words()
+    tokens = [word for word in analyzed.tokens if word not in stop_words and len(word) > 2]
     
     # Find most frequent words (themes)
     word_freq = Counter(tokens)
     themes = [word for word, freq in word_freq.most_common(5)]
     
     # Analyze emotions
-    sia = SentimentIntensityAnalyzer()
-    sentiment = sia.polarity_scores(text)
+    sentiment = analyzed.sentiment
     
     emotions = []
     if sentiment['pos'] > 0.5:
@@ -211,9 +223,46 @@ def analyze_text(text):
         'sentiment_score': sentiment['compound']
     }
 
-def find_connections(story_id):
-    """Finds connections between stories"""
-    if db is None:
+def _story_index_metadata(story_id, story_data):
+    """Metadata kept next to a story vector: id, title and its most frequent content terms"""
+    terms = [t for t in semantic_index.embedder.terms(story_data.get('content', '')) if ' ' not in t]
+    return {
+        'id': story_data.get('id', story_id),
+        'title': story_data.get('title', ''),
+        'terms': [term for term, _ in Counter(terms).most_common(12)]
+    }
+
+def index_story(story_id, story_data):
+    """Add or refresh a story in the global vector index"""
+    if semantic_index is None or not story_data.get('content'):
+        return
+    try:
+        semantic_index.add(str(story_id), story_data['content'], _story_index_metadata(story_id, story_data))
+    except Exception as e:
+        logger.warning(f"Failed to index story {story_id}: {e}")
+
+def _load_all_stories_for_index():
+    for doc in db.collection('stories').stream():
+        data = doc.to_dict() or {}
+        if data.get('content'):
+            yield doc.id, data['content'], _story_index_metadata(doc.id, data)
+
+def bootstrap_story_vector_index():
+    """Populate the global story index from Firestore when no snapshot exists (startup, background)"""
+    try:
+        count = semantic_index.bootstrap(_load_all_stories_for_index)
+        if count:
+            logger.info(f"Story vector index bootstrapped with {count} stories")
+    except Exception as e:
+        logger.warning(f"Story vector index bootstrap failed: {e}")
+
+def _story_vector_index():
+    """Global story index (filled at startup by bootstrap_story_vector_index)"""
+    return semantic_index.global_index
+
+def find_connections(story_id, k=10):
+    """Finds connections between stories (top-k cosine similarity in the local vector index)"""
+    if db is None or semantic_index is None:
         return []
         
     story_ref = db.collection('stories').document(str(story_id))
@@ -225,33 +274,30 @@ def find_connections(story_id):
     story_data = story.to_dict()
     connections = []
     
-    # Search for all other stories
-    other_stories = db.collection('stories').where('id', '!=', story_id).stream()
+    index = _story_vector_index()
+    if str(story_id) not in index:
+        index_story(story_id, story_data)
+    story_terms = set((index.metadata(str(story_id)) or {}).get('terms', []))
     
-    for other_story in other_stories:
-        other_data = other_story.to_dict()
-        # Simple connection finding based on similar words
-        story_words = set(word_tokenize(story_data['content'].lower()))
-        other_words = set(word_tokenize(other_data['content'].lower()))
-        common_words = story_words.intersection(other_words)
-        
-        if len(common_words) > 3:  # If there are more than 3 common words
-            connection = {
-                'id': other_data['id'],
-                'title': other_data['title'],
-                'description': f"Similar themes: {', '.join(list(common_words)[:3])}",
-                'strength': len(common_words) / 10  # Normalize strength to 0-1 range
-            }
-            connections.append(connection)
-            
-            # Save connection to database
-            db.collection('connections').add({
-                'story_id': story_id,
-                'connected_story_id': other_data['id'],
-                'common_words': list(common_words),
-                'strength': connection['strength'],
-                'created_at': firestore.SERVER_TIMESTAMP
-            })
+    for match in index.similar_to(str(story_id), k=k, min_score=0.1):
+        other = match['metadata']
+        common_words = [term for term in other.get('terms', []) if term in story_terms]
+        connection = {
+            'id': other.get('id', match['id']),
+            'title': other.get('title', ''),
+            'description': f"Similar themes: {', '.join(common_words[:3])}" if common_words else "Similar themes",
+            'strength': round(match['score'], 3)
+        }
+        connections.append(connection)
+        
+        # Save connection to database
+        db.collection('connections').add({
+            'story_id': story_id,
+            'connected_story_id': connection['id'],
+            'common_words': common_words,
+            'strength': connection['strength'],
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
     
     return connections
 
@@ -261,7 +307,7 @@ class IntelligentConversationEngine:
     Handles general knowledge, world topics, and personal conversations
     """
     
-    def __init__(self):
+    def __init__(self, session_store: ConversationSessionStore = None):
         self.client = None
         # Prefer an already configured key (e.g. MENTALOS_OPENAI_API_KEY was set at module load).
         # Only fall back to OPENAI_API_KEY if it looks valid **and** no key is currently active.
@@ -276,7 +322,8 @@ class IntelligentConversationEngine:
         else:
             logger.warning("Valid OpenAI API key not found – using fallback responses")
         
-        self.conversation_history = {}
+        # Bounded per-user history (LRU / idle / memory-cap eviction, optional SQLite spill)
+        self.sessions = session_store or ConversationSessionStore()
     
     def generate_response(self, message: str, user_id: str, context: Dict = None) -> str:
         """
@@ -284,18 +331,18 @@ class IntelligentConversationEngine:
         Full conversational AI mode with story detection in background
         """
         try:
-            # Get user's preferred AI provider
+            # Resolve the user's preferred AI provider once for this turn
             preferred_provider = ai_provider_manager.get_user_provider(user_id)
             
             # Build comprehensive system prompt
             system_prompt = self._build_system_prompt(preferred_provider, context)
             
             # Get conversation history
-            history = self.conversation_history.get(user_id, [])
+            history = self.sessions.get(user_id)
             
             if self.client:
                 # Use OpenAI for full ChatGPT-like experience
-                response = self._openai_chat_completion(message, user_id, system_prompt, history)
+                response = self._openai_chat_completion(message, preferred_provider, system_prompt, history)
             else:
                 # Use enhanced fallback with full capabilities
                 response = self._intelligent_fallback(message, context)
@@ -335,7 +382,7 @@ class IntelligentConversationEngine:
             logger.warning(f"Error building system prompt: {e}")
             return prompts_engine.get_conversation_prompt('system_base')
     
-    def _openai_chat_completion(self, message: str, user_id: str, system_prompt: str, history: List) -> str:
+    def _openai_chat_completion(self, message: str, provider: str, system_prompt: str, history: List) -> str:
         """Generate response using OpenAI with user's selected GPT model"""
         messages = [{"role": "system", "content": system_prompt}]
         
@@ -346,9 +393,8 @@ class IntelligentConversationEngine:
         
         messages.append({"role": "user", "content": message})
         
-        # Get user's preferred model
-        user_provider = ai_provider_manager.get_user_provider(user_id)
-        model = ai_provider_manager.get_provider_model(user_provider)
+        # User's preferred model
+        model = ai_provider_manager.get_provider_model(provider)
         
         response = self.client.ChatCompletion.create(
             model=model,
@@ -367,29 +413,55 @@ class IntelligentConversationEngine:
         return prompts_engine.get_fallback_response(message, context)
     
     def _update_conversation_history(self, user_id: str, user_message: str, response: str):
-        """Update conversation history for context continuity"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
+        """Update conversation history for context continuity (store keeps the last 20 exchanges)"""
+        self.sessions.append(user_id, {
             "user": user_message,
             "assistant": response,
             "timestamp": datetime.utcnow().isoformat()
         })
-        
-        # Keep only last 20 exchanges per user
-        if len(self.conversation_history[user_id]) > 20:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-20:]
+
+# Conversation sessions: bounded in-memory LRU in this process. CONVERSATION_SESSION_BACKEND=sqlite
+# spills them to a SQLite file - only worth it when several processes share that file (one process
+# per container on Cloud Run has nothing to share, and its disk is memory). The file is capped too.
+_session_backend = None
+if os.getenv('CONVERSATION_SESSION_BACKEND', 'memory') == 'sqlite':
+    _session_db_path = os.getenv('CONVERSATION_SESSION_DB', os.path.join('instance', 'conversation_sessions.sqlite3'))
+    try:
+        os.makedirs(os.path.dirname(_session_db_path) or '.', exist_ok=True)
+        _session_backend = SQLiteSessionBackend(
+            _session_db_path,
+            max_rows=int(os.getenv('CONVERSATION_SESSION_DB_MAX_ROWS', '10000')),
+            max_bytes=int(os.getenv('CONVERSATION_SESSION_DB_MAX_MB', '64')) * 1024 * 1024
+        )
+    except Exception as e:
+        logger.warning(f"Conversation session spill disabled ({e}) - keeping sessions in memory only")
+conversation_session_store = ConversationSessionStore(
+    backend=_session_backend,
+    max_sessions=int(os.getenv('CONVERSATION_SESSION_MAX', '1000')),
+    max_bytes=int(os.getenv('CONVERSATION_SESSION_MAX_MB', '32')) * 1024 * 1024,
+    idle_seconds=float(os.getenv('CONVERSATION_SESSION_IDLE_MINUTES', '60')) * 60
+)
 
 # Initialize the intelligent conversation engine
-intelligent_conversation_engine = IntelligentConversationEngine()
+intelligent_conversation_engine = IntelligentConversationEngine(session_store=conversation_session_store)
 
 # Initialize all intelligent engines with database integration
 prompts_engine = PromptsEngine()
-ai_provider_manager = AIProviderManager()
+ai_provider_manager = AIProviderManager(db=db)
 personal_context_mapper = PersonalContextMapper(db=db)
-knowledge_engine = KnowledgeEngine(db=db)
+semantic_index = SemanticIndex(
+    os.getenv('VECTOR_INDEX_DIR', os.path.join('instance', 'vector_index')),
+    max_loaded=int(os.getenv('VECTOR_INDEX_MAX_LOADED_USERS', '256'))
+) if SemanticIndex else None
+if semantic_index is None:
+    logger.warning("numpy not available - semantic story connections disabled")
+elif db is not None:
+    # Streaming every story is too slow for a request; one process per node does it at startup
+    threading.Thread(target=bootstrap_story_vector_index, name='story-index-bootstrap', daemon=True).start()
+knowledge_engine = KnowledgeEngine(db=db, semantic_index=semantic_index)
 formats_generation_engine = FormatsGenerationEngine(db=db)
+# Streamed long-form generations run as background jobs so they survive client disconnects
+generation_jobs = GenerationJobStore(db=db)
 
 # Connect the prompts engine to the formats generation engine
 formats_generation_engine.prompts_engine = prompts_engine
@@ -619,6 +691,9 @@ def delete_story(story_id):
         
         # Delete the story
         story_ref.delete()
+        if semantic_index is not None:
+            semantic_index.remove(story_id)
+        formats_generation_engine.forget_story_summaries(story_id, story_data.get('user_id'))
         
         # Also delete any connections related to this story
         connections_query = db.collection('connections').where('story_id', '==', story_id)
@@ -736,6 +811,8 @@ def update_story(story_id):
         
         # Build response (merge existing data with updates for the client)
         updated_story = {**story_data, **update_fields, 'id': story_id}
+        if 'content' in update_fields or 'title' in update_fields:
+            index_story(story_id, updated_story)
         
         logger.info(f"Story {story_id} updated successfully by {user_id or 'unknown user'}")
         return jsonify(updated_story), 200
@@ -1294,6 +1371,75 @@ def update_story_format(story_id, format_type):
         logger.error(f"Error updating format: {e}")
         return jsonify({'error': 'Failed to update format'}), 500
 
+def save_generated_format(story_ref, story_data: Dict, format_type_str: str, result: Dict):
+    """Store a generated format on its story and keep createdFormats ordered (therapeutic formats first)"""
+    # Save the format to the story
+    formats = story_data.get('formats', {})
+    
+    # For song format, preserve existing audio_url if it exists
+    if format_type_str == 'song' and format_type_str in formats:
+        existing_format = formats[format_type_str]
+        if isinstance(existing_format, dict) and 'audio_url' in existing_format:
+            # Preserve the uploaded audio when regenerating song content
+            song_title = result.get('title')
+            if not song_title:
+                # Generate a fallback title if none was extracted
+                song_title = "Finding Purpose in Work"  # Better fallback for now
+            
+            formats[format_type_str] = {
+                'content': result['content'],
+                'audio_url': existing_format['audio_url'],
+                'created_at': existing_format.get('created_at', datetime.now().isoformat()),
+                'title': song_title
+            }
+        else:
+            # No existing audio, but still add title for song format
+            song_title = result.get('title', 'Generated Song')
+            formats[format_type_str] = {
+                'content': result['content'],
+                'title': song_title,
+                'created_at': datetime.now().isoformat()
+            }
+    else:
+        formats[format_type_str] = result['content']
+    
+    # Update createdFormats list - ensure it's always a list
+    created_formats = story_data.get('createdFormats', [])
+    if isinstance(created_formats, dict):
+        # Convert dict to list if needed
+        created_formats = list(created_formats.keys()) if created_formats else []
+    elif not isinstance(created_formats, list):
+        created_formats = []
+        
+    if format_type_str not in created_formats:
+        # All therapeutic formats go at the very top of the list
+        therapeutic_formats = ['reflection', 'insights', 'growth_summary', 'journal_entry']
+        
+        if format_type_str in therapeutic_formats:
+            # Find the position where this therapeutic format should be inserted
+            # We want to maintain order within therapeutic formats but keep them all at the top
+            insert_position = 0
+            
+            # Count existing therapeutic formats to maintain their relative order
+            for i, existing_format in enumerate(created_formats):
+                if existing_format in therapeutic_formats:
+                    insert_position = i + 1
+                else:
+                    # Hit first non-therapeutic format, stop counting
+                    break
+            
+            created_formats.insert(insert_position, format_type_str)
+        else:
+            # Regular formats go after all therapeutic formats
+            created_formats.append(format_type_str)
+    
+    # Update the story in database
+    story_ref.update({
+        'formats': formats,
+        'createdFormats': created_formats,
+        'updated_at': datetime.now().isoformat()
+    })
+
 @app.route('/api/stories/<string:story_id>/generate-format', methods=['POST'])
 def generate_format_for_story(story_id):
     """Generate a new format for an existing story using the FormatsGenerationEngine"""
@@ -1370,13 +1516,14 @@ def generate_format_for_story(story_id):
         # Get user context for better generation
         user_context = None
         domain_insights = None
+        analyzed_story = analyze(story_content)
         
         try:
             # Try to get enhanced context if engines are available
             if 'personal_context_mapper' in globals():
                 user_context = personal_context_mapper.get_user_context_profile(user_id)
             if 'knowledge_engine' in globals():
-                domain_insights = knowledge_engine.analyze_story_for_insights(story_content, user_id)
+                domain_insights = knowledge_engine.analyze_story_for_insights(analyzed_story, user_id)
         except Exception as e:
             logger.warning(f"Could not get enhanced context: {e}")
         
@@ -1389,72 +1536,7 @@ def generate_format_for_story(story_id):
         )
         
         if result.get('success'):
-            # Save the format to the story
-            formats = story_data.get('formats', {})
-            
-            # For song format, preserve existing audio_url if it exists
-            if format_type_str == 'song' and format_type_str in formats:
-                existing_format = formats[format_type_str]
-                if isinstance(existing_format, dict) and 'audio_url' in existing_format:
-                    # Preserve the uploaded audio when regenerating song content
-                    song_title = result.get('title')
-                    if not song_title:
-                        # Generate a fallback title if none was extracted
-                        song_title = "Finding Purpose in Work"  # Better fallback for now
-                    
-                    formats[format_type_str] = {
-                        'content': result['content'],
-                        'audio_url': existing_format['audio_url'],
-                        'created_at': existing_format.get('created_at', datetime.now().isoformat()),
-                        'title': song_title
-                    }
-                else:
-                    # No existing audio, but still add title for song format
-                    song_title = result.get('title', 'Generated Song')
-                    formats[format_type_str] = {
-                        'content': result['content'],
-                        'title': song_title,
-                        'created_at': datetime.now().isoformat()
-                    }
-            else:
-                formats[format_type_str] = result['content']
-            
-            # Update createdFormats list - ensure it's always a list
-            created_formats = story_data.get('createdFormats', [])
-            if isinstance(created_formats, dict):
-                # Convert dict to list if needed
-                created_formats = list(created_formats.keys()) if created_formats else []
-            elif not isinstance(created_formats, list):
-                created_formats = []
-                
-            if format_type_str not in created_formats:
-                # All therapeutic formats go at the very top of the list
-                therapeutic_formats = ['reflection', 'insights', 'growth_summary', 'journal_entry']
-                
-                if format_type_str in therapeutic_formats:
-                    # Find the position where this therapeutic format should be inserted
-                    # We want to maintain order within therapeutic formats but keep them all at the top
-                    insert_position = 0
-                    
-                    # Count existing therapeutic formats to maintain their relative order
-                    for i, existing_format in enumerate(created_formats):
-                        if existing_format in therapeutic_formats:
-                            insert_position = i + 1
-                        else:
-                            # Hit first non-therapeutic format, stop counting
-                            break
-                    
-                    created_formats.insert(insert_position, format_type_str)
-                else:
-                    # Regular formats go after all therapeutic formats
-                    created_formats.append(format_type_str)
-            
-            # Update the story in database
-            story_ref.update({
-                'formats': formats,
-                'createdFormats': created_formats,
-                'updated_at': datetime.now().isoformat()
-            })
+            save_generated_format(story_ref, story_data, format_type_str, result)
             
             logger.info(f"Successfully generated {format_type_str} format for story {story_id}")
             
@@ -1480,6 +1562,112 @@ def generate_format_for_story(story_id):
         logger.error(f"Error in format generation endpoint: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def sse_response(events):
+    """Server-Sent Events response (unbuffered)"""
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stories/<string:story_id>/generate-format/stream', methods=['POST'])
+def stream_format_for_story(story_id):
+    """
+    Generate a format as a Server-Sent Events stream. The generation runs as a background job:
+    it is saved to the story when complete even if the client disconnects, and the client can
+    resume with GET /api/generation-jobs/<job_id>/stream?offset=<chars received>.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        format_type_str = data.get('format_type', 'article')
+        user_id = request.headers.get('X-User-ID')
+        user_email = request.headers.get('X-User-Email', '')
+        
+        if is_anonymous_user(user_id):
+            return jsonify({
+                'error': 'Authentication required',
+                'message': 'Please sign in to generate story formats.'
+            }), 401
+        
+        try:
+            format_type = FormatType(format_type_str)
+        except ValueError:
+            return jsonify({'error': f'Invalid format type: {format_type_str}'}), 400
+        
+        if db is None:
+            return jsonify({'error': 'Database not available'}), 500
+        
+        story_ref = db.collection('stories').document(story_id)
+        story = story_ref.get()
+        if not story.exists:
+            return jsonify({'error': 'Story not found'}), 404
+        
+        story_data = story.to_dict()
+        story_content = story_data.get('content', '')
+        if story_data.get('user_id') != user_id and not is_super_user(user_id, user_email):
+            return jsonify({
+                'error': 'Access denied',
+                'message': 'Only the story author can generate additional formats.'
+            }), 403
+        if not story_content:
+            return jsonify({'error': 'Story has no content to format'}), 400
+        
+        user_context = None
+        domain_insights = None
+        try:
+            user_context = personal_context_mapper.get_user_context_profile(user_id)
+            domain_insights = knowledge_engine.analyze_story_for_insights(analyze(story_content), user_id)
+        except Exception as e:
+            logger.warning(f"Could not get enhanced context: {e}")
+        
+        generation = {}
+        
+        def produce():
+            chunks, generation['model'], generation['prompt'] = formats_generation_engine.stream_format(
+                story_content, format_type, user_context, domain_insights)
+            return chunks
+        
+        def on_complete(text):
+            # Same result (title, model) as the non-streamed endpoint
+            result = formats_generation_engine.format_result(text, format_type, generation.get('model'),
+                                                             generation.get('prompt', ''))
+            # Re-read the story: it may have changed while the format was generating
+            current = story_ref.get()
+            save_generated_format(story_ref, current.to_dict() if current.exists else story_data,
+                                  format_type_str, result)
+            logger.info(f"Successfully generated {format_type_str} format for story {story_id} (streamed)")
+            return {'story_id': story_id, 'format_type': format_type_str, 'content': result['content'],
+                    'title': result['title'], 'model_used': result['model_used']}
+        
+        job = generation_jobs.start(user_id, f'format:{format_type_str}', produce, on_complete,
+                                    meta={'story_id': story_id, 'format_type': format_type_str})
+        return sse_response(generation_jobs.events(job))
+        
+    except Exception as e:
+        logger.error(f"Error in streaming format generation endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/generation-jobs/<string:job_id>/stream', methods=['GET'])
+def resume_generation_stream(job_id):
+    """Resume a streamed generation from a character offset (works after the job finished, too)"""
+    try:
+        # EventSource cannot send headers, so the user id may also come as a query parameter
+        user_id = request.headers.get('X-User-ID') or request.args.get('user_id')
+        user_email = request.headers.get('X-User-Email', '')
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        
+        if is_anonymous_user(user_id):
+            return jsonify({'error': 'Authentication required'}), 401
+        
+        job = generation_jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Generation job not found'}), 404
+        if job.owner != user_id and not is_super_user(user_id, user_email):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        return sse_response(generation_jobs.events(job, offset))
+        
+    except Exception as e:
+        logger.error(f"Error resuming generation job {job_id}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/chat/message', methods=['POST'])
 def process_chat_message():
     """Process a chat message with intelligent conversation summarization"""
@@ -1615,9 +1803,10 @@ Keep the summary conversational and preserve the user's voice. Focus on continui
                 # Add current message
                 messages.append({"role": "user", "content": message})
                 
-                # Generate response with enhanced context
+                # Generate response with enhanced context (user's chosen model, GPT-3.5 Turbo by default)
+                chat_provider = ai_provider_manager.get_user_provider(user_id)
                 response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
+                    model=ai_provider_manager.get_provider_model(chat_provider),
                     messages=messages,
                     max_tokens=300,
                     temperature=0.7
@@ -1798,8 +1987,9 @@ def generate_story_from_conversation(user_id, conversation, title_suggestion=Non
         if len(story_content_messages) < len(user_messages) * 0.3:  # Keep at least 30% of messages
             story_content_messages = user_messages
         
-        # Prepare conversation data for sophisticated analysis
+        # Prepare conversation data for sophisticated analysis (analyzed once, shared by all engines)
         conversation_text = "\n".join([f"User: {msg.get('content', '')}" for msg in story_content_messages])
+        analyzed_conversation = analyze(conversation_text)
         
         # Get user context using PersonalContextMapper
         user_context = {}
@@ -1816,7 +2006,7 @@ def generate_story_from_conversation(user_id, conversation, title_suggestion=Non
         # Get domain insights using KnowledgeEngine
         domain_insights = {}
         try:
-            domain_insights = knowledge_engine.analyze_story_for_insights(conversation_text, user_id)
+            domain_insights = knowledge_engine.analyze_story_for_insights(analyzed_conversation, user_id)
         except Exception as e:
             logger.warning(f"Could not get domain insights: {e}")
             domain_insights = {
@@ -1975,8 +2165,9 @@ Make it conversational and authentic. Generate just the title:"""
         }
         
         # Add AI analysis using SmartStoryEngine conversation analysis
+        # (rules tier only - the story is already written; a cached LLM verdict is reused if present)
         try:
-            analysis = smart_story_engine.analyze_conversation_for_story_potential(conversation, user_id)
+            analysis = smart_story_engine.analyze_conversation_for_story_potential(conversation, user_id, allow_llm=False)
             if analysis:
                 story_data['analysis'] = {
                     'story_readiness_score': analysis.get('story_readiness_score', 0.5),
@@ -2002,6 +2193,7 @@ Make it conversational and authentic. Generate just the title:"""
         
         # Update the document with its ID
         story_ref[1].update({'id': story_id})
+        index_story(story_id, dict(story_data, id=story_id))
         
         # Update user statistics in test environment
         if IS_TEST:
@@ -2081,6 +2273,21 @@ def debug_stories():
             'database_status': 'error'
         }), 500
 
+@app.route('/api/debug/conversation-sessions', methods=['GET'])
+def debug_conversation_sessions():
+    """Debug endpoint with conversation session store size and eviction metrics"""
+    return jsonify({'success': True, 'stats': conversation_session_store.stats()})
+
+@app.route('/api/debug/model-routing', methods=['GET'])
+def debug_model_routing():
+    """Debug endpoint with per-route/model latency percentiles, error rates, SLO fallbacks and probes"""
+    return jsonify({
+        'success': True,
+        'routes': formats_generation_engine.model_router.routes,
+        'stats': formats_generation_engine.model_router.stats(),
+        'book_chapter_compilation': formats_generation_engine.compilation_stats
+    })
+
 @app.route('/api/debug/collections', methods=['GET'])
 def debug_collections():
     """Debug endpoint to check all Firebase collections"""
@@ -2436,6 +2643,35 @@ def get_ai_providers():
             'default': 'openai'
         }), 500
 
+@app.route('/api/ai/preference', methods=['GET', 'POST'])
+def ai_provider_preference():
+    """Get or set the user's preferred GPT model"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = data.get('user_id') or request.args.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'user_id is required'}), 400
+        
+        if request.method == 'POST':
+            provider = data.get('provider')
+            if not ai_provider_manager.set_user_preference(user_id, provider):
+                return jsonify({
+                    'error': f'Unsupported provider: {provider}',
+                    'supported': list(ai_provider_manager.get_available_providers())
+                }), 400
+        
+        provider = ai_provider_manager.get_user_provider(user_id)
+        return jsonify({
+            'success': True,
+            'provider': provider,
+            'model': ai_provider_manager.get_provider_model(provider),
+            'available': ai_provider_manager.get_available_providers()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error handling AI provider preference: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/formats/supported', methods=['GET'])
 def get_supported_formats():
     """Get formats that are actually supported by the prompts engine"""
@@ -2903,55 +3139,90 @@ def is_super_user(user_id: str, user_email: str | None = None) -> bool:
         return True
     return False
 
-@app.route('/api/users/<string:user_id>/generate-book-chapter', methods=['POST'])
-def generate_book_chapter(user_id):
-    """Generate a book chapter once user has at least 5 stories."""
-    try:
-        requester_id = request.headers.get('X-User-ID')
-        requester_email = request.headers.get('X-User-Email', '')
+def prepare_book_chapter(user_id: str):
+    """
+    Check access and collect the chapter's source stories: (stories, error response).
+    All of the user's stories are compiled unless the request body sets max_stories (most recent N).
+    """
+    requester_id = request.headers.get('X-User-ID')
+    requester_email = request.headers.get('X-User-Email', '')
 
-        if is_anonymous_user(requester_id):
-            return jsonify({'error': 'Authentication required'}), 401
+    if is_anonymous_user(requester_id):
+        return None, (jsonify({'error': 'Authentication required'}), 401)
 
-        # Only the user themselves or super user can trigger
-        if requester_id != user_id and not is_super_user(requester_id, requester_email):
-            return jsonify({'error': 'Access denied'}), 403
+    # Only the user themselves or super user can trigger
+    if requester_id != user_id and not is_super_user(requester_id, requester_email):
+        return None, (jsonify({'error': 'Access denied'}), 403)
 
-        if db is None:
-            return jsonify({'error': 'Database unavailable'}), 500
+    if db is None:
+        return None, (jsonify({'error': 'Database unavailable'}), 500)
 
-        # Fetch user stories
-        stories_query = db.collection('stories').where('user_id', '==', user_id).order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-        stories_list = [doc.to_dict() for doc in stories_query]
+    # Fetch user stories
+    stories_query = db.collection('stories').where('user_id', '==', user_id).order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
+    stories_list = [{**doc.to_dict(), 'id': doc.id} for doc in stories_query]
 
-        if len(stories_list) < 5:
-            return jsonify({'error': 'Need at least 5 stories to unlock'}), 403
+    if len(stories_list) < 5:
+        return None, (jsonify({'error': 'Need at least 5 stories to unlock'}), 403)
 
-        top_stories = stories_list[:5]
-        stories_markdown = "\n\n".join([f"### {s.get('title','Story')}\n{s.get('content','')}" for s in top_stories])
+    max_stories = (request.get_json(silent=True) or {}).get('max_stories')
+    if isinstance(max_stories, int) and max_stories > 0:
+        stories_list = stories_list[:max_stories]
+    return stories_list, None
 
-        from format_types import FormatType
-        result = formats_generation_engine.generate_format(
-            story_content='',
-            format_type=FormatType.BOOK_CHAPTER,
-            stories_markdown=stories_markdown
-        )
+def save_book_chapter(user_id: str, content: str):
+    """Save into user_compilations collection"""
+    db.collection('user_compilations').document(user_id).set({
+        'book_chapter': content,
+        'updated_at': datetime.now().isoformat()
+    }, merge=True)
+
+@app.route('/api/users/<string:user_id>/generate-book-chapter', methods=['POST'])
+def generate_book_chapter(user_id):
+    """Generate a book chapter once user has at least 5 stories."""
+    try:
+        stories, error_response = prepare_book_chapter(user_id)
+        if error_response:
+            return error_response
+
+        result = formats_generation_engine.compile_book_chapter(stories, user_id)
 
         if not result.get('success'):
             return jsonify(result), 500
 
-        # Save into user_compilations collection
-        db.collection('user_compilations').document(user_id).set({
-            'book_chapter': result['content'],
-            'updated_at': datetime.now().isoformat()
-        }, merge=True)
+        save_book_chapter(user_id, result['content'])
 
-        return jsonify({'success': True, 'content': result['content']}), 200
+        return jsonify({'success': True, 'content': result['content'], 'stories_compiled': len(stories)}), 200
 
     except Exception as e:
         logger.error(f"Error generating book chapter: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/users/<string:user_id>/generate-book-chapter/stream', methods=['POST'])
+def stream_book_chapter(user_id):
+    """Stream a book chapter (Server-Sent Events); saved when complete, resumable via its job_id."""
+    try:
+        stories, error_response = prepare_book_chapter(user_id)
+        if error_response:
+            return error_response
+
+        def produce():
+            # Story summaries (map/reduce) are built on the job's worker, then the chapter streams
+            source = formats_generation_engine.build_chapter_source(stories, user_id)
+            return formats_generation_engine.stream_book_chapter(source)
+
+        def on_complete(text):
+            content = text.strip()
+            save_book_chapter(user_id, content)
+            return {'user_id': user_id, 'content': content}
+
+        job = generation_jobs.start(request.headers.get('X-User-ID'), 'book_chapter',
+                                    produce, on_complete, meta={'user_id': user_id, 'stories': len(stories)})
+        return sse_response(generation_jobs.events(job))
+
+    except Exception as e:
+        logger.error(f"Error streaming book chapter: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # -------------------------------------------------------
 # Public share short-links (redirect to SPA with query params)
 # e.g.  /s/123           → /app?story=123
@@ -3055,6 +3326,12 @@ def upload_image():
 # MentalOS – File helper utilities
 # =============================================================================
 
+from mentalos_storage import create_storage
+from mentalos_search import MentalOSSearch
+from placeholder_matcher import PlaceholderMatcher, CompletenessTracker
+from mentalos_history import MentalOSHistory
+from patch_engine import replace_placeholder, replace_section, structure_cache
+
 BASE_MENTALOS_DIR = os.path.join('MentalOS', 'user_data')
 os.makedirs(BASE_MENTALOS_DIR, exist_ok=True)
 
@@ -3079,35 +3356,65 @@ def _get_user_dir(user_id: str) -> str:
     return user_dir
 
 
+def _user_key_prefix(user_id: str) -> str:
+    """Storage key prefix for a user's MentalOS files."""
+    return (secure_filename(str(user_id)) or 'anonymous') + '/'
+
+
+def _storage_key(user_id: str, path: str) -> str:
+    """Map (user, relative path) to a storage key like 'user_123/voices/anna.md'."""
+    rel = _sanitize_subpath(path)
+    return _user_key_prefix(user_id) + rel.replace(os.sep, '/')
+
+
+# Local disk by default; MENTALOS_STORAGE_BACKEND=gcs keeps files in the Firebase
+# bucket with BASE_MENTALOS_DIR acting as the local write-through cache.
+mentalos_storage = create_storage(BASE_MENTALOS_DIR, bucket=bucket)
+
+# Per-file revision logs (compressed deltas + periodic snapshots)
+mentalos_history = MentalOSHistory(
+    create_storage(os.path.join('MentalOS', 'history'), bucket=bucket, namespace='history')
+)
+
+
+def _record_revision(user_id: str, path: str, content: str | None = None) -> None:
+    """Append the file's current content to its revision log (never fails the write)."""
+    try:
+        if content is None:
+            content = open_file_fs(user_id, path)
+        mentalos_history.record(_user_key_prefix(user_id), _sanitize_subpath(path).replace(os.sep, '/'), content)
+    except Exception as e:
+        logger.warning(f"Could not record MentalOS revision for {path}: {e}")
+
+
 def open_file_fs(user_id: str, path: str) -> str:
     """Open and return the contents of a MentalOS file. Returns empty string if not found."""
-    rel = _sanitize_subpath(path)
-    abs_path = os.path.join(_get_user_dir(user_id), rel)
-    if not os.path.exists(abs_path):
-        return ""
-    with open(abs_path, 'r', encoding='utf-8') as f:
-        return f.read()
+    content = mentalos_storage.read_text(_storage_key(user_id, path))
+    return content if content is not None else ""
 
 
 def append_file_fs(user_id: str, path: str, text: str) -> str:
-    """Append text to a MentalOS file (creates it and parent dirs if needed)."""
-    rel = _sanitize_subpath(path)
-    abs_path = os.path.join(_get_user_dir(user_id), rel)
-    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-    with open(abs_path, 'a', encoding='utf-8') as f:
-        f.write(text)
-        if not text.endswith('\n'):
-            f.write('\n')
+    """Append text to a MentalOS file (creates it if needed)."""
+    key = _storage_key(user_id, path)
+    if not text.endswith('\n'):
+        text += '\n'
+    mentalos_storage.append_text(key, text)
+    mentalos_folder_index.invalidate(user_id)
+    mentalos_completeness.invalidate(user_id, _sanitize_subpath(path))
+    # The full content is needed for the revision log anyway; reindex from it right away
+    content = open_file_fs(user_id, path)
+    mentalos_search.on_write(user_id, _sanitize_subpath(path), content)
+    _record_revision(user_id, path, content)
     return "OK"
 
 
 def overwrite_file_fs(user_id: str, path: str, text: str) -> str:
     """Overwrite (or create) a MentalOS file with provided text."""
-    rel = _sanitize_subpath(path)
-    abs_path = os.path.join(_get_user_dir(user_id), rel)
-    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-    with open(abs_path, 'w', encoding='utf-8') as f:
-        f.write(text)
+    mentalos_storage.write_text(_storage_key(user_id, path), text)
+    mentalos_folder_index.invalidate(user_id)
+    mentalos_completeness.invalidate(user_id, _sanitize_subpath(path))
+    mentalos_search.on_write(user_id, _sanitize_subpath(path), text)
+    _record_revision(user_id, path, text)
     return "OK"
 
 
@@ -3128,19 +3435,114 @@ def get_mental_os_file(filename):
 
 def build_user_knowledge_model(user_id: str) -> dict:
     """Aggregate all user files into a unified knowledge model: {filename: content}"""
-    user_dir = _get_user_dir(user_id)
+    prefix = _user_key_prefix(user_id)
     knowledge = {}
-    for root, _, files in os.walk(user_dir):
-        for f in files:
-            rel_path = os.path.relpath(os.path.join(root, f), user_dir)
-            try:
-                with open(os.path.join(root, f), 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    knowledge[rel_path] = content
-            except Exception as e:
-                knowledge[rel_path] = f"ERROR: {e}"
+    for key in mentalos_storage.list_keys(prefix):
+        rel_path = key[len(prefix):]
+        try:
+            knowledge[rel_path] = mentalos_storage.read_text(key) or ''
+        except Exception as e:
+            knowledge[rel_path] = f"ERROR: {e}"
     return knowledge
 
+# Per-user BM25 index, kept up to date by the write helpers above and stored next to the notes
+# (shared bucket on GCS), so every instance searches the same, current index
+mentalos_search = MentalOSSearch(
+    create_storage(os.path.join('MentalOS', 'search_index'), bucket=bucket, namespace='search'),
+    read_file=open_file_fs,
+    list_files=build_user_knowledge_model
+)
+
+@app.route('/api/mental-os/search', methods=['GET'])
+def search_mental_os_files():
+    """Full-text search over a user's MentalOS files, ranked by BM25."""
+    try:
+        user_id = request.headers.get('X-User-ID') or request.args.get('user_id') or 'anonymous'
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({'error': 'q parameter required'}), 400
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, 50)
+        results = mentalos_search.search(user_id, query, limit=limit)
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        logger.error(f"Error searching MentalOS files: {e}")
+        return jsonify({'error': str(e), 'results': []}), 500
+
+# ------------------------------------------------------------------
+# MentalOS file history (revision list, revision fetch, delta sync)
+# ------------------------------------------------------------------
+def _history_request_args():
+    user_id = request.headers.get('X-User-ID') or request.args.get('user_id') or 'anonymous'
+    path = request.args.get('path')
+    if not path:
+        raise ValueError('path parameter required')
+    return _user_key_prefix(user_id), _sanitize_subpath(path).replace(os.sep, '/')
+
+
+@app.route('/api/mental-os/history', methods=['GET'])
+def list_mental_os_revisions():
+    """List revisions of a MentalOS file (oldest first)."""
+    try:
+        user_key, path = _history_request_args()
+        return jsonify({'path': path, 'revisions': mentalos_history.list_revisions(user_key, path)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error listing MentalOS revisions: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/mental-os/history/revision', methods=['GET'])
+def get_mental_os_revision():
+    """Return the full content of one revision (?path=&rev=)."""
+    try:
+        user_key, path = _history_request_args()
+        rev = int(request.args.get('rev', 0))
+        content = mentalos_history.get_revision(user_key, path, rev)
+        if content is None:
+            return jsonify({'error': 'revision not found'}), 404
+        return jsonify({'path': path, 'rev': rev, 'content': content})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error fetching MentalOS revision: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/mental-os/history/changes', methods=['GET'])
+def get_mental_os_changes():
+    """Return a line delta from revision `since` to the latest one (or full content if `since` is unknown)."""
+    try:
+        user_key, path = _history_request_args()
+        since = int(request.args.get('since', 0))
+        return jsonify(dict(mentalos_history.changes_since(user_key, path, since), path=path))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error computing MentalOS changes: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/mental-os/history/compact', methods=['POST'])
+def compact_mental_os_history():
+    """Drop old revisions of a file, keeping the newest `keep` (default 50)."""
+    try:
+        user_key, path = _history_request_args()
+        keep = max(1, int((request.get_json(silent=True) or {}).get('keep', request.args.get('keep', 50))))
+        removed = mentalos_history.compact(user_key, path, keep=keep)
+        return jsonify({'path': path, 'removed': removed})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error compacting MentalOS history: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # Add a utility to generate a patch prompt and apply a minimal patch
 
 def propose_patch_with_llm(user_message, file_content):
@@ -3197,15 +3599,6 @@ def process_mental_chat_message():
         active_file = data.get('active_file')
         open_files_ctx = data.get('open_files') or []
         missing_fields = data.get('missing_fields') or []
-        # Compute missing fields here if front-end did not supply them
-        if (not missing_fields) and active_file:
-            current_content = file_contents.get(active_file, '')
-            if not current_content:
-                try:
-                    current_content = open_file_fs(user_id, active_file)
-                except Exception:
-                    pass
-            missing_fields = compute_missing_fields(active_file, current_content)
 
         user_id = data.get('user_id') or request.headers.get('X-User-ID') or 'anonymous'
         if 'messages' in data:
@@ -3229,21 +3622,20 @@ def process_mental_chat_message():
                 'setup_required': True
             }), 200
 
-        user_dir = _get_user_dir(user_id)
-        logger.info(f"MentalOS: User directory for {user_id}: {user_dir}")
-        existing_files = []
-        file_contents = {}
-        for root, _, files in os.walk(user_dir):
-            for f in files:
-                rel_path = os.path.relpath(os.path.join(root, f), user_dir)
-                existing_files.append(rel_path)
-                try:
-                    with open(os.path.join(root, f), 'r', encoding='utf-8') as file:
-                        content = file.read()
-                        file_contents[rel_path] = content
-                except:
-                    file_contents[rel_path] = ''
-        logger.info(f"MentalOS: Found files for user {user_id}: {existing_files}")
+        knowledge = build_user_knowledge_model(user_id)
+        file_contents = {
+            rel_path: ('' if content.startswith('ERROR: ') else content)
+            for rel_path, content in knowledge.items()
+        }
+        logger.info(f"MentalOS: Found files for user {user_id}: {list(file_contents)}")
+
+        # Compute missing fields here if front-end did not supply them (cached until the file is written)
+        if (not missing_fields) and active_file:
+            # Missing or unreadable files are passed as None so the tracker reads storage itself
+            active_content = knowledge.get(active_file)
+            if active_content is not None and active_content.startswith('ERROR: '):
+                active_content = None
+            missing_fields = mentalos_completeness.missing_fields(user_id, active_file, active_content)
 
         user_message = ''
         for m in reversed(messages):
@@ -3264,7 +3656,6 @@ def process_mental_chat_message():
                 if active_file not in file_contents:
                     continue
 
-                from patch_engine import replace_placeholder
                 import re as _re
 
                 value: str | None = None
@@ -3326,14 +3717,16 @@ def process_mental_chat_message():
                         })
                         direct_patch_done = True
                         # Recompute missing fields so the follow-up question targets the next empty placeholder
-                        missing_fields = compute_missing_fields(active_file, new_content_active)
+                        missing_fields = mentalos_completeness.missing_fields(user_id, active_file, new_content_active)
                         break
 
-        # Decide which files to patch – prioritise active_file if provided (LLM diff)
+        # Decide which files to patch – prioritise active_file if provided (LLM diff),
+        # otherwise only the files most relevant to the message
         if active_file and active_file in file_contents and not direct_patch_done:
             files_iter = [(active_file, file_contents[active_file])]
         else:
-            files_iter = file_contents.items()
+            relevant = [p for p in mentalos_search.relevant_paths(user_id, user_message) if p in file_contents]
+            files_iter = [(p, file_contents[p]) for p in relevant] if relevant else file_contents.items()
 
         for file_path, file_content in files_iter:
             diff = propose_unified_diff_with_llm(user_message, file_content)
@@ -3510,18 +3903,30 @@ except Exception as _e:
     KNOWLEDGE_MAP = {}
 
 
+# Every KNOWLEDGE_MAP placeholder compiled once into a single matcher
+placeholder_matcher = PlaceholderMatcher(KNOWLEDGE_MAP)
+# Per-user, per-file completeness results, keyed on the file's storage version
+mentalos_completeness = CompletenessTracker(
+    placeholder_matcher,
+    read_file=lambda user_id, path: mentalos_storage.read_text(_storage_key(user_id, path)),
+    version=lambda user_id, path: mentalos_storage.version(_storage_key(user_id, path))
+)
+
+
 def compute_missing_fields(file_name: str, content: str):
     """Return list of field names whose placeholder is still present in content, according to KNOWLEDGE_MAP."""
-    entry = KNOWLEDGE_MAP.get(file_name) or {}
-    fields = entry.get('fields', {})
-    missing = []
-    def _strip(s: str):
-        return s.replace('*', '').replace('_', '').strip()
-    norm_content = _strip(content)
-    for field, placeholder in fields.items():
-        if _strip(placeholder) in norm_content:
-            missing.append(field)
-    return missing
+    return placeholder_matcher.missing_fields(file_name, content)
+
+
+@app.route('/api/mental-os/completeness', methods=['GET'])
+def get_mental_os_completeness():
+    """Return missing placeholder fields and completeness ratios for all of a user's mapped files."""
+    try:
+        user_id = request.headers.get('X-User-ID') or request.args.get('user_id') or 'anonymous'
+        return jsonify(mentalos_completeness.summary(user_id))
+    except Exception as e:
+        logger.error(f"Error computing MentalOS completeness: {e}")
+        return jsonify({'error': str(e)}), 500
 
 # ------------------------------------------------------------------
 # PUT /api/mental-os/files/<filename>
@@ -3663,27 +4068,9 @@ def _apply_knowledge_objects(user_id: str, objects: list[dict]):
                 content = open_file_fs(user_id, file)
             except Exception:
                 content = ""
-            lines = content.split('\n') if content else []
-            heading_idx = None
-            heading_level = 0
-            import re as _re
-            for i, l in enumerate(lines):
-                if l.lstrip().startswith('#'):
-                    stripped = l.lstrip('#').strip()
-                    if stripped.lower() == section.lower():
-                        heading_idx = i
-                        heading_level = len(l) - len(l.lstrip('#'))
-                        break
-            if heading_idx is not None:
-                end_idx = len(lines)
-                for j in range(heading_idx + 1, len(lines)):
-                    if lines[j].startswith('#') and (len(lines[j]) - len(lines[j].lstrip('#'))) <= heading_level:
-                        end_idx = j
-                        break
-                new_lines = lines[:heading_idx + 1] + markdown_body.split('\n') + lines[end_idx:]
-            else:
-                new_lines = lines + [f"## {section}"] + markdown_body.split('\n')
-            new_content = '\n'.join(new_lines)
+            # Parsed once per file version; the edit touches only the target section
+            structure = structure_cache.get(file, content)
+            new_content = replace_section(content, section, markdown_body, structure=structure)
             overwrite_file_fs(user_id, file, new_content)
             diffs.append({"operation": "overwrite_file", "path": file, "snippet": new_content})
 
@@ -3720,46 +4107,54 @@ def _apply_knowledge_objects(user_id: str, objects: list[dict]):
                 new_content = (content.rstrip() + '\n' if content else '') + link_line + '\n'
                 overwrite_file_fs(user_id, from_file, new_content)
                 diffs.append({"operation": "append", "path": from_file, "snippet": link_line})
+    return diffs
 
 # --------------------------------------------------------------------
 # === MentalOS Share-link & Folder Index helpers ===
 
-from pathlib import Path
 import uuid
-from functools import lru_cache
-
-# In-memory token store – fine for dev; can be swapped for Firestore later
-SHARE_TOKEN_MAP: dict[str, dict] = {}
+from datetime import timedelta
+from mentalos_folder_index import FolderIndex
+from share_token_store import ShareTokenStore, SQLiteShareTokenBackend, FirestoreShareTokenBackend
+
+# Persistent share-token store shared by all workers.
+# Firestore when available (multi-instance), otherwise a local SQLite file.
+_share_backend_name = os.getenv('MENTALOS_SHARE_TOKEN_BACKEND') or ('firestore' if db is not None else 'sqlite')
+if _share_backend_name == 'firestore' and db is not None:
+    _share_backend = FirestoreShareTokenBackend(db)
+else:
+    _share_backend = SQLiteShareTokenBackend(
+        os.getenv('MENTALOS_SHARE_TOKEN_DB', os.path.join('MentalOS', 'share_tokens.sqlite3'))
+    )
+_share_ttl_days = int(os.getenv('MENTALOS_SHARE_TOKEN_TTL_DAYS', '90'))
+share_token_store = ShareTokenStore(
+    _share_backend,
+    ttl=timedelta(days=_share_ttl_days) if _share_ttl_days > 0 else None
+)
+logger.info(f"MentalOS share tokens stored in {type(_share_backend).__name__}")
 
 VOICES_DIR_NAME = "voices"
 
-@lru_cache(maxsize=1024)
-def _scan_user_folders(user_id: str) -> list[dict]:
-    """Ensure the ⚡ VOICES folder exists and return all folder metadata (even empty ones)."""
-    user_dir = Path(BASE_MENTALOS_DIR) / user_id
-    # Guarantee base user directory and an (initially empty) voices/ folder exist
-    voices_path = user_dir / VOICES_DIR_NAME
-    voices_path.mkdir(parents=True, exist_ok=True)
-    # Ensure an instruction file exists so users immediately understand this folder
-    info_path = voices_path / "ABOUT_THIS_FOLDER.md"
-    if not info_path.exists():
-        info_path.write_text(
-            """# 🗣️ Voices – how it works\n\nInvite trusted people to share how they see you.\n\n1. Click the ➕ icon or the Share button to create a *voice* file.\n2. A unique link is copied to your clipboard – send it to your friend.\n3. They can write directly in that file; you'll see it update live.\n\nCreate as many voices as you like. Each file is private between you and the person you invited.\n""",
-            encoding="utf-8")
-
-    if not user_dir.exists():
-        return []
-
-    folders = []
-    for folder_path in user_dir.iterdir():
-        if not folder_path.is_dir():
-            continue
-        # Collect .md files (may be empty)
-        files = [
-            {"name": f.name, "label": f.stem.replace('-', ' ').replace('_', ' ').title()} for f in folder_path.glob("*.md")
-        ]
-        folders.append({"name": folder_path.name, "files": files})
-    return folders
+def _ensure_voices_folder(user_id: str) -> None:
+    """Ensure the ⚡ VOICES folder and its instruction file exist for a user."""
+    # Written through storage (not the local cache dir) so every instance sees it;
+    # an instruction file also makes the folder exist on object storage
+    info_key = _storage_key(user_id, f"{VOICES_DIR_NAME}/ABOUT_THIS_FOLDER.md")
+    if mentalos_storage.version(info_key) is None:
+        mentalos_storage.create_text(
+            info_key,
+            """# 🗣️ Voices – how it works\n\nInvite trusted people to share how they see you.\n\n1. Click the ➕ icon or the Share button to create a *voice* file.\n2. A unique link is copied to your clipboard – send it to your friend.\n3. They can write directly in that file; you'll see it update live.\n\nCreate as many voices as you like. Each file is private between you and the person you invited.\n""")
+
+# Per-user folder listings built from storage keys; write helpers invalidate only the
+# user they touch. On shared object storage entries also expire, so files written by
+# other instances appear. Set MENTALOS_FOLDER_WATCH=1 to catch local out-of-band changes.
+mentalos_folder_index = FolderIndex(
+    BASE_MENTALOS_DIR,
+    prepare=_ensure_voices_folder,
+    watch=os.getenv('MENTALOS_FOLDER_WATCH', '').lower() in ('1', 'true', 'yes'),
+    list_keys=mentalos_storage.list_keys,
+    ttl=float(os.getenv('MENTALOS_FOLDER_INDEX_TTL_SECONDS', '15')) if mentalos_storage.shared else None
+)
 
 @app.route('/api/mental-os/folders', methods=['GET'])
 def list_mental_folders():
@@ -3767,7 +4162,7 @@ def list_mental_folders():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({"error": "user_id required"}), 400
-    folders = _scan_user_folders(user_id)
+    folders = mentalos_folder_index.get(user_id)
     return jsonify({"folders": folders})
 
 # ---------------- Share token flow ----------------
@@ -3781,21 +4176,18 @@ def create_share_link():
     if not user_id or not label:
         return jsonify({"error": "user_id and label required"}), 400
 
-    # Create voices folder
-    user_dir = Path(BASE_MENTALOS_DIR) / user_id / VOICES_DIR_NAME
-    user_dir.mkdir(parents=True, exist_ok=True)
-
-    # Build filename
+    # Build filename inside the voices folder
     slug = re.sub(r'[^a-zA-Z0-9]+', '_', label.lower()).strip("_")
     filename = f"{slug}.md"
-    file_path = user_dir / filename
+    voice_path = f"{VOICES_DIR_NAME}/{filename}"
+    voice_key = _storage_key(user_id, voice_path)
 
     # Generate token and share URL first so we can embed it
     token = uuid.uuid4().hex
     relative_url = f"/share/{token}"
     full_url = request.host_url.rstrip('/') + relative_url  # e.g. http://localhost:8080/share/<token>
 
-    if not file_path.exists():
+    if mentalos_storage.read_text(voice_key) is None:
         questions_by_role = {
             'partner': [
                 f"How would you describe {label}'s love language?",
@@ -3831,33 +4223,30 @@ def create_share_link():
             f"> **Share link**: {full_url}\n\n"
             "*Write freely; bullet points are welcome.*\n"
         )
-        file_path.write_text(template, encoding='utf-8')
+        overwrite_file_fs(user_id, voice_path, template)
 
     # Store mapping after file is ensured
-    SHARE_TOKEN_MAP[token] = {
-        "owner": user_id,
-        "file": str(file_path.relative_to(BASE_MENTALOS_DIR)),
-    }
+    share_token_store.create(token, owner=user_id, file=voice_key)
 
     return jsonify({"token": token, "url": relative_url, "full_url": full_url, "file": filename})
 
 @app.route('/api/mental-os/share/<string:token>', methods=['GET', 'PUT'])
 def handle_share_token(token):
-    info = SHARE_TOKEN_MAP.get(token)
+    info = share_token_store.get(token)
     if not info:
         return jsonify({"error": "invalid token"}), 404
     owner = info['owner']
-    rel_path = info['file']
-    abs_path = Path(BASE_MENTALOS_DIR) / rel_path
+    # Stored as a storage key relative to BASE_MENTALOS_DIR, e.g. "<owner>/voices/anna.md"
+    file_key = info['file'].replace(os.sep, '/')
     if request.method == 'GET':
-        if not abs_path.exists():
+        content = mentalos_storage.read_text(file_key)
+        if content is None:
             return jsonify({"error": "file missing"}), 404
-        return abs_path.read_text(encoding='utf-8')
+        return content
     else:  # PUT
         content = request.get_data(as_text=True)
-        abs_path.write_text(content, encoding='utf-8')
-        # Invalidate folder scan cache so owner sees new file updated counters
-        _scan_user_folders.cache_clear()
+        # Same write path as the owner's own edits (completeness, search, history, folder index)
+        overwrite_file_fs(owner, file_key.split('/', 1)[1], content)
         return jsonify({"status": "saved"})
 
 if __name__ == '__main__':
@@ -0,0 +1,293 @@
+"""
+Conversation Session Store
+==========================
+
+Bounded store for the recent chat exchanges IntelligentConversationEngine
+replays as context.
+
+The in-process part is an LRU of per-user sessions with three limits:
+- max_sessions: number of users held in memory
+- max_bytes: approximate total size of the held exchanges
+- idle_seconds: sessions untouched for longer are dropped first
+
+Evicted sessions are not lost when a backend is configured:
+SQLiteSessionBackend keeps sessions in a SQLite file (written through on each
+exchange), so another worker sharing the file - or this one after eviction -
+picks the history up again. The file is bounded too: a background timer
+purges sessions idle past the retention period and then the oldest ones
+until the file holds at most max_rows sessions / max_bytes of history.
+Without a backend (the default) the store is memory-only and eviction
+forgets the session.
+
+stats() reports sizes, hit rates and eviction counts per reason.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteSessionBackend:
+    """Session backend stored in a SQLite file (shared by the processes that can see the file)."""
+
+    def __init__(self, path: str, max_rows: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS conversation_sessions (
+                   user_id TEXT PRIMARY KEY,
+                   history TEXT NOT NULL,
+                   updated_at REAL NOT NULL,
+                   size INTEGER NOT NULL DEFAULT 0
+               )"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(conversation_sessions)")}
+        if 'size' not in columns:
+            self._conn.execute("ALTER TABLE conversation_sessions ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE conversation_sessions SET size = LENGTH(history)")
+        self._conn.commit()
+
+    def put(self, user_id: str, history: List[Dict], updated_at: float) -> None:
+        data = json.dumps(history)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_sessions (user_id, history, updated_at, size) VALUES (?, ?, ?, ?)",
+                (user_id, data, updated_at, len(data))
+            )
+            self._conn.commit()
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history, updated_at FROM conversation_sessions WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {'history': json.loads(row[0]), 'updated_at': row[1]}
+
+    def updated_at(self, user_id: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM conversation_sessions WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM conversation_sessions WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+    def purge_idle(self, cutoff: float) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM conversation_sessions WHERE updated_at < ?", (cutoff,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def enforce_limits(self) -> int:
+        """Delete the least recently updated sessions beyond max_rows / max_bytes."""
+        with self._lock:
+            cur = self._conn.execute(
+                """DELETE FROM conversation_sessions WHERE user_id IN (
+                       SELECT user_id FROM (
+                           SELECT user_id,
+                                  ROW_NUMBER() OVER (ORDER BY updated_at DESC) AS position,
+                                  SUM(size) OVER (ORDER BY updated_at DESC ROWS UNBOUNDED PRECEDING) AS total
+                           FROM conversation_sessions
+                       ) WHERE position > ? OR total > ?
+                   )""",
+                (self.max_rows, self.max_bytes)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+
+class _Session:
+    __slots__ = ('history', 'size', 'updated_at', 'last_access')
+
+    def __init__(self, history: List[Dict], updated_at: float):
+        self.history = history
+        self.size = sum(_exchange_size(exchange) for exchange in history)
+        self.updated_at = updated_at
+        self.last_access = time.monotonic()
+
+
+def _exchange_size(exchange: Dict) -> int:
+    """Approximate in-memory footprint of one exchange in bytes."""
+    return 200 + sum(len(str(value)) for value in exchange.values())
+
+
+class ConversationSessionStore:
+    """
+    Per-user conversation history with LRU / idle / memory-cap eviction in front of
+    an optional persistent backend.
+    """
+
+    def __init__(self, backend=None, max_sessions: int = 1000, max_bytes: int = 32 * 1024 * 1024,
+                 idle_seconds: float = 3600, max_exchanges: int = 20,
+                 backend_retention_seconds: float = 7 * 24 * 3600, purge_interval_seconds: float = 300):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.max_exchanges = max_exchanges
+        self.backend_retention_seconds = backend_retention_seconds
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'backend_loads': 0,
+            'evicted_lru': 0, 'evicted_idle': 0, 'evicted_memory': 0,
+            'backend_errors': 0, 'backend_purged': 0
+        }
+        if backend is not None and purge_interval_seconds > 0:
+            threading.Thread(target=self._purge_loop, args=(purge_interval_seconds,),
+                             name='session-backend-purge', daemon=True).start()
+
+    def get(self, user_id: str) -> List[Dict]:
+        """Recent exchanges of a user, oldest first (a copy)."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                session.last_access = time.monotonic()
+
+        if session is not None and not self._changed_elsewhere(user_id, session):
+            self._stats['hits'] += 1
+            return list(session.history)
+
+        self._stats['misses'] += 1
+        stored = self._backend_get(user_id)
+        if stored is None:
+            return list(session.history) if session is not None else []
+
+        self._stats['backend_loads'] += 1
+        history = stored['history'][-self.max_exchanges:]
+        self._put(user_id, _Session(history, stored['updated_at']))
+        return list(history)
+
+    def append(self, user_id: str, exchange: Dict) -> None:
+        """Add one exchange, trimming the session to max_exchanges."""
+        history = self.get(user_id)
+        history.append(exchange)
+        history = history[-self.max_exchanges:]
+        session = _Session(history, time.time())
+        self._put(user_id, session)
+
+        if self.backend is not None:
+            try:
+                self.backend.put(user_id, history, session.updated_at)
+            except Exception as e:
+                self._stats['backend_errors'] += 1
+                logger.warning(f"ConversationSessionStore: backend write failed for {user_id}: {e}")
+
+    def clear(self, user_id: str) -> None:
+        """Forget a user's session everywhere."""
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                self._bytes -= session.size
+        if self.backend is not None:
+            try:
+                self.backend.delete(user_id)
+            except Exception as e:
+                logger.warning(f"ConversationSessionStore: backend delete failed for {user_id}: {e}")
+
+    def stats(self) -> Dict:
+        """Sizes, hit counters and eviction counts (for metrics endpoints)."""
+        with self._lock:
+            sessions = len(self._sessions)
+            size = self._bytes
+        return {
+            'sessions': sessions,
+            'bytes': size,
+            'max_sessions': self.max_sessions,
+            'max_bytes': self.max_bytes,
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            **self._stats
+        }
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _put(self, user_id: str, session: _Session):
+        with self._lock:
+            previous = self._sessions.pop(user_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._sessions[user_id] = session
+            self._bytes += session.size
+            self._evict()
+
+    def _evict(self):
+        """Drop idle sessions, then LRU sessions until both caps hold (caller holds the lock)."""
+        now = time.monotonic()
+        while len(self._sessions) > 1:
+            user_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_access > self.idle_seconds:
+                reason = 'evicted_idle'
+            elif len(self._sessions) > self.max_sessions:
+                reason = 'evicted_lru'
+            elif self._bytes > self.max_bytes:
+                reason = 'evicted_memory'
+            else:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= oldest.size
+            self._stats[reason] += 1
+
+    def _changed_elsewhere(self, user_id: str, session: _Session) -> bool:
+        """True if another worker wrote a newer version of the session to the backend."""
+        if self.backend is None:
+            return False
+        try:
+            updated_at = self.backend.updated_at(user_id)
+        except Exception as e:
+            self._stats['backend_errors'] += 1
+            logger.warning(f"ConversationSessionStore: backend lookup failed for {user_id}: {e}")
+            return False
+        return updated_at is not None and updated_at > session.updated_at
+
+    def _backend_get(self, user_id: str) -> Optional[Dict]:
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.get(user_id)
+        except Exception as e:
+            self._stats['backend_errors'] += 1
+            logger.warning(f"ConversationSessionStore: backend read failed for {user_id}: {e}")
+            return None
+
+    def _purge_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.purge_backend()
+
+    def purge_backend(self) -> int:
+        """Drop backend sessions idle past retention, then the oldest beyond the backend's size caps."""
+        if self.backend is None:
+            return 0
+        try:
+            removed = self.backend.purge_idle(time.time() - self.backend_retention_seconds)
+            if hasattr(self.backend, 'enforce_limits'):
+                removed += self.backend.enforce_limits()
+        except Exception as e:
+            self._stats['backend_errors'] += 1
+            logger.warning(f"ConversationSessionStore: backend purge failed: {e}")
+            return 0
+        if removed:
+            self._stats['backend_purged'] += removed
+            logger.info(f"ConversationSessionStore: purged {removed} sessions from backend")
+        return removed
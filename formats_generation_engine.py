@@ -10,19 +10,52 @@ Formats supported:
 - Creative: Poems, Songs, Scripts, Stories
 - Professional: Articles, Blog posts, Presentations
 - Therapeutic: Insights, Reflections, Growth summaries
+
+Model, token budget and temperature are chosen per format by a ModelRouter
+(defaults from the _select_model/_get_max_tokens/_get_temperature helpers,
+overridable via the JSON file in FORMAT_ROUTING_CONFIG), which falls back to
+GPT-3.5 Turbo while a format's primary model misses its latency SLO.
+
+Book chapters are compiled map-reduce style: each story is summarized once
+(cached in memory and in the story_summaries collection, keyed by a hash of
+its content and of the summary prompt), consecutive summaries are condensed
+while they exceed the chapter prompt budget, and the chapter is written from
+the result - so recompiling only costs model calls for stories that changed.
+Stored summaries carry the owner's user_id: group summaries no longer used by
+a compilation are pruned (and expire after SUMMARY_GROUP_RETENTION_DAYS via a
+TTL policy on expires_at), and forget_story_summaries() drops a story's
+summaries when the story is deleted.
 """
 
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
+from datetime import datetime, timedelta, timezone
 import json
 import os
 from enum import Enum
 from prompts_engine import PromptType
 from format_types import FormatType
+from model_router import ModelRouter, load_route_overrides
+from text_analysis import text_digest
 
 logger = logging.getLogger(__name__)
 
+FAST_MODEL = "gpt-3.5-turbo"
+FORMAT_LATENCY_SLO_MS = float(os.getenv('FORMAT_LATENCY_SLO_MS', '20000'))
+
+# Book chapter compilation (map-reduce over story summaries)
+STORY_SUMMARIES_COLLECTION = 'story_summaries'
+STORY_SUMMARY_MIN_CHARS = 1200  # shorter stories are used as-is
+CHAPTER_SOURCE_MAX_CHARS = int(os.getenv('BOOK_CHAPTER_SOURCE_MAX_CHARS', '12000'))
+SUMMARY_GROUP_SIZE = 8
+SUMMARY_WORKERS = 4
+SUMMARY_CACHE_MAX_ENTRIES = 4096
+SUMMARY_GROUP_RETENTION_DAYS = int(os.getenv('SUMMARY_GROUP_RETENTION_DAYS', '30'))
+
 class FormatsGenerationEngine:
     """
     Intelligent engine for transforming stories into various engaging formats.
@@ -86,6 +119,24 @@ class FormatsGenerationEngine:
                 'include_insights': True
             }
         }
+        
+        # Per-format model / max_tokens / temperature with latency-SLO fallback
+        self.model_router = ModelRouter(
+            self._default_format_routes(),
+            default_route={
+                'model': FAST_MODEL,
+                'max_tokens': 500,
+                'temperature': 0.7,
+                'fallback_model': None,
+                'latency_slo_ms': FORMAT_LATENCY_SLO_MS
+            },
+            overrides=load_route_overrides(os.getenv('FORMAT_ROUTING_CONFIG'))
+        )
+        
+        # Book chapter summaries: story id / group id -> (cache key, summary)
+        self._summary_cache: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._summary_lock = threading.Lock()
+        self.compilation_stats = {'memory_hits': 0, 'store_hits': 0, 'summarized': 0, 'merged': 0}
     
     # =============================================================================
     # MAIN FORMAT GENERATION (AI + Templates)
@@ -166,60 +217,22 @@ class FormatsGenerationEngine:
                 return {'success': False, 'error': 'Empty content provided'}
                 
             # ALWAYS use prompts engine - no fallback to built-in prompts
-            if not hasattr(self, 'prompts_engine') or not self.prompts_engine:
-                return {'success': False, 'error': 'Prompts engine not available - required for format generation'}
-                
-            try:
-                prompt = self.prompts_engine.get_prompt(PromptType.FORMAT_GENERATION, 
-                                                      format_type=format_type, 
-                                                      content=content,
-                                                      user_context=user_context,
-                                                      domain_insights=domain_insights)
-                logger.info(f"Using prompts engine for {format_type.value} generation")
-            except Exception as e:
-                logger.error(f"Prompts engine failed for {format_type.value}: {e}")
-                return {'success': False, 'error': f'Prompts engine failed: {e}'}
-            
-            # Get system prompt from prompts engine
-            try:
-                system_prompt = self.prompts_engine.get_system_prompt('format_generation', format_type=format_type)
-            except Exception as e:
-                logger.warning(f"System prompt failed, using basic system prompt: {e}")
-                system_prompt = "You are a skilled content creator who transforms personal stories into engaging formats while preserving their authentic emotional core."
-            
-            # Use specialized system prompt when available, with song-specific override
-            if format_type == FormatType.SONG:
-                system_prompt_overridden = (
-                    "You are a professional songwriter. Follow the user's instructions exactly. "
-                    "Never add section labels like [Verse] or [Chorus] to lyrics unless explicitly requested."
-                )
-            else:
-                system_prompt_overridden = system_prompt
+            messages, prompt, error = self._build_format_messages(content, format_type, user_context, domain_insights)
+            if error:
+                return {'success': False, 'error': error}
             
             # Make API call using chat format for better instruction following
             try:
-                completion = self.openai_client.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": system_prompt_overridden},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=1500,
-                    temperature=0.7
-                )
+                route = self.model_router.route(format_type.value)
+                completion = self.model_router.call(route, lambda r: self.openai_client.ChatCompletion.create(
+                    model=r['model'],
+                    messages=messages,
+                    max_tokens=r['max_tokens'],
+                    temperature=r['temperature']
+                ))
                 generated_content = completion.choices[0].message.content.strip()
-                logger.info(f"AI generation successful for {format_type.value}")
-                
-                # Extract title from generated content
-                extracted_title = self._extract_title_from_content(generated_content, format_type)
-                
-                return {
-                    'success': True,
-                    'content': generated_content,
-                    'title': extracted_title,
-                    'generation_method': 'ai',
-                    'prompt_used': prompt[:100] + "..." if len(prompt) > 100 else prompt
-                }
+                logger.info(f"AI generation successful for {format_type.value} ({route['model']})")
+                return self.format_result(generated_content, format_type, route['model'], prompt)
                 
             except Exception as api_error:
                 logger.error(f"OpenAI API call failed: {api_error}")
@@ -233,6 +246,96 @@ class FormatsGenerationEngine:
             logger.error(f"AI generation error for {format_type.value}: {e}")
             return {'success': False, 'error': str(e)}
     
+    def _build_format_messages(self, content: str, format_type: FormatType, user_context: Dict = None,
+                               domain_insights: Dict = None):
+        """Chat messages for a format generation: (messages, prompt, error)"""
+        if not hasattr(self, 'prompts_engine') or not self.prompts_engine:
+            return None, None, 'Prompts engine not available - required for format generation'
+            
+        try:
+            prompt = self.prompts_engine.get_prompt(PromptType.FORMAT_GENERATION, 
+                                                  format_type=format_type, 
+                                                  content=content,
+                                                  user_context=user_context,
+                                                  domain_insights=domain_insights)
+            logger.info(f"Using prompts engine for {format_type.value} generation")
+        except Exception as e:
+            logger.error(f"Prompts engine failed for {format_type.value}: {e}")
+            return None, None, f'Prompts engine failed: {e}'
+        
+        # Get system prompt from prompts engine
+        try:
+            system_prompt = self.prompts_engine.get_system_prompt('format_generation', format_type=format_type)
+        except Exception as e:
+            logger.warning(f"System prompt failed, using basic system prompt: {e}")
+            system_prompt = "You are a skilled content creator who transforms personal stories into engaging formats while preserving their authentic emotional core."
+        
+        # Use specialized system prompt when available, with song-specific override
+        if format_type == FormatType.SONG:
+            system_prompt = (
+                "You are a professional songwriter. Follow the user's instructions exactly. "
+                "Never add section labels like [Verse] or [Chorus] to lyrics unless explicitly requested."
+            )
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, prompt, None
+    
+    # =============================================================================
+    # STREAMING GENERATION (long formats, book chapters)
+    # =============================================================================
+    
+    def stream_format(self, story_content: str, format_type: FormatType, user_context: Dict = None,
+                      domain_insights: Dict = None) -> Tuple[Iterator[str], str, str]:
+        """
+        Generate a format as a stream of text chunks (raises on failure): (chunks, model, prompt).
+        Pass the streamed text with model and prompt to format_result() for the saved result.
+        """
+        if not self.openai_client:
+            raise RuntimeError('OpenAI API key required for format generation')
+        if not story_content or not story_content.strip():
+            raise ValueError('Empty content provided')
+        
+        messages, prompt, error = self._build_format_messages(story_content, format_type, user_context, domain_insights)
+        if error:
+            raise RuntimeError(error)
+        route = self.model_router.route(format_type.value)
+        return self._stream_completion(route, messages), route['model'], prompt
+    
+    def format_result(self, content: str, format_type: FormatType, model: str, prompt: str = '') -> Dict[str, Any]:
+        """Result of a successful AI generation (streamed or not), with its extracted title"""
+        content = content.strip()
+        return {
+            'success': True,
+            'content': content,
+            'title': self._extract_title_from_content(content, format_type),
+            'generation_method': 'ai',
+            'model_used': model,
+            'prompt_used': prompt[:100] + "..." if len(prompt) > 100 else prompt
+        }
+    
+    def _stream_completion(self, route: Dict[str, Any], messages: List[Dict]) -> Iterator[str]:
+        """Stream a chat completion on a resolved route, recording its full duration with the router"""
+        started = time.monotonic()
+        try:
+            stream = self.openai_client.ChatCompletion.create(
+                model=route['model'],
+                messages=messages,
+                max_tokens=route['max_tokens'],
+                temperature=route['temperature'],
+                stream=True
+            )
+            for event in stream:
+                chunk = getattr(event.choices[0].delta, 'content', None) if event.choices else None
+                if chunk:
+                    yield chunk
+        except Exception:
+            self.model_router.record(route, (time.monotonic() - started) * 1000, False)
+            raise
+        self.model_router.record(route, (time.monotonic() - started) * 1000, True)
+    
     # =============================================================================
     # ARCHIVED CODE REMOVED: Template generation completely removed to prevent conflicts
     # All generation now uses AI through the prompts engine.
@@ -242,26 +345,59 @@ class FormatsGenerationEngine:
     # HELPER METHODS
     # =============================================================================
     
+    def _default_format_routes(self) -> Dict[str, Dict[str, Any]]:
+        """Routing defaults per format; richer formats fall back to the fast model on SLO breach"""
+        routes = {}
+        for format_type in FormatType:
+            model = self._select_model_for_format(format_type)
+            routes[format_type.value] = {
+                'model': model,
+                'max_tokens': self._get_max_tokens_for_format(format_type),
+                'temperature': self._get_temperature_for_format(format_type),
+                'fallback_model': FAST_MODEL if model != FAST_MODEL else None
+            }
+        # Chapters combine several stories; keep the long-context model they were written for
+        routes[FormatType.BOOK_CHAPTER.value].update({'model': 'gpt-4o-mini', 'temperature': 0.7, 'fallback_model': None})
+        # Map/reduce steps of chapter compilation
+        routes['story_summary'] = {'model': FAST_MODEL, 'max_tokens': 350, 'temperature': 0.3}
+        routes['summary_merge'] = {'model': FAST_MODEL, 'max_tokens': 600, 'temperature': 0.3}
+        return routes
+    
     def _select_model_for_format(self, format_type: FormatType) -> str:
         """Select appropriate OpenAI model based on format complexity"""
         
-        # Use GPT-4 for complex creative formats
+        # Current small model for complex creative formats (cheaper per token than gpt-3.5-turbo);
+        # heavier models are opt-in per format through FORMAT_ROUTING_CONFIG
         complex_formats = [FormatType.ARTICLE, FormatType.REEL, FormatType.POEM, FormatType.INSIGHTS, FormatType.PODCAST, FormatType.LETTER]
         
         if format_type in complex_formats:
-            return "gpt-4"
+            return "gpt-4o-mini"
         else:
             return "gpt-3.5-turbo"  # Cheaper for social media formats
     
     def _get_max_tokens_for_format(self, format_type: FormatType) -> int:
         """Get appropriate token limit for format"""
+        # Sized to the length each prompt asks for (~1.4 tokens per word plus headroom)
         token_limits = {
             FormatType.X: 100,
             FormatType.LINKEDIN: 400,
             FormatType.INSTAGRAM: 600,
+            FormatType.FACEBOOK: 500,
             FormatType.POEM: 300,
-            FormatType.ARTICLE: 1200,
-            FormatType.INSIGHTS: 800
+            FormatType.SONG: 400,
+            FormatType.REEL: 600,
+            FormatType.FAIRYTALE: 1500,
+            FormatType.ARTICLE: 1300,
+            FormatType.BLOG_POST: 1500,
+            FormatType.PRESENTATION: 900,
+            FormatType.NEWSLETTER: 1100,
+            FormatType.PODCAST: 1000,
+            FormatType.LETTER: 700,
+            FormatType.REFLECTION: 450,
+            FormatType.INSIGHTS: 800,
+            FormatType.GROWTH_SUMMARY: 800,
+            FormatType.JOURNAL_ENTRY: 700,
+            FormatType.BOOK_CHAPTER: 2400
         }
         return token_limits.get(format_type, 500)
     
@@ -373,24 +509,252 @@ class FormatsGenerationEngine:
         return "Default Title"
     
     # Special compilation format uses list of stories
+    def generate_book_chapter(self, stories_markdown: str) -> Dict[str, Any]:
+        """Compile stories (markdown) into one book chapter"""
+        if not self.openai_client:
+            return {"success": False, "error": "OpenAI API key required for book chapter generation"}
+        return self._generate_book_chapter(stories_markdown)
+    
+    def stream_book_chapter(self, stories_markdown: str) -> Iterator[str]:
+        """Compile stories into a book chapter as a stream of text chunks (raises on failure)"""
+        if not self.openai_client:
+            raise RuntimeError('OpenAI API key required for book chapter generation')
+        route = self.model_router.route(FormatType.BOOK_CHAPTER.value)
+        return self._stream_completion(route, self._book_chapter_messages(stories_markdown))
+    
+    def _book_chapter_messages(self, stories_markdown: str) -> List[Dict]:
+        prompt = self.prompts_engine.get_prompt(PromptType.FORMAT_GENERATION,
+                                                format_type=FormatType.BOOK_CHAPTER,
+                                                content=stories_markdown)
+        return [
+            {"role": "system", "content": self.prompts_engine.get_prompt(PromptType.FORMAT_SYSTEM, format_type=FormatType.BOOK_CHAPTER)},
+            {"role": "user", "content": prompt}
+        ]
+    
     def _generate_book_chapter(self, stories_markdown: str) -> Dict[str, Any]:
         try:
-            prompt = self.prompts_engine.get_prompt(PromptType.BOOK_CHAPTER, stories_markdown=stories_markdown)
-            response = self.openai_client.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": self.prompts_engine.get_system_prompt(PromptType.BOOK_CHAPTER)},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2048
-            )
+            messages = self._book_chapter_messages(stories_markdown)
+            route = self.model_router.route(FormatType.BOOK_CHAPTER.value)
+            response = self.model_router.call(route, lambda r: self.openai_client.ChatCompletion.create(
+                model=r['model'],
+                messages=messages,
+                temperature=r['temperature'],
+                max_tokens=r['max_tokens']
+            ))
             content = response.choices[0].message.content.strip()
             return {
                 "success": True,
                 "content": content,
-                "generation_method": "openai_gpt4o"
+                "generation_method": "openai_gpt4o",
+                "model_used": route['model']
             }
         except Exception as e:
             return {"success": False, "error": str(e)}
+    
+    # =============================================================================
+    # BOOK CHAPTER COMPILATION (map-reduce over cached story summaries)
+    # =============================================================================
+    
+    def compile_book_chapter(self, stories: List[Dict], user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Book chapter over any number of the user's stories (dicts with id, title, content, timestamp)"""
+        if not self.openai_client:
+            return {"success": False, "error": "OpenAI API key required for book chapter generation"}
+        try:
+            source = self.build_chapter_source(stories, user_id)
+        except Exception as e:
+            logger.error(f"Book chapter compilation failed: {e}")
+            return {"success": False, "error": str(e)}
+        result = self._generate_book_chapter(source)
+        if result.get('success'):
+            result['stories_compiled'] = len(stories)
+        return result
+    
+    def build_chapter_source(self, stories: List[Dict], user_id: Optional[str] = None) -> str:
+        """
+        Chapter prompt input: one summary per story in chronological order (map), condensed
+        group by group while longer than CHAPTER_SOURCE_MAX_CHARS (reduce). Summaries are
+        cached by content hash, so only new or edited stories (and their group) hit the model.
+        """
+        if not hasattr(self, 'prompts_engine') or not self.prompts_engine:
+            raise RuntimeError('Prompts engine not available - required for format generation')
+        
+        user_id = user_id or next((story.get('user_id') for story in stories if story.get('user_id')), None)
+        ordered = sorted(stories, key=lambda story: str(story.get('timestamp') or ''))
+        sections = self._summarize_stories(ordered, user_id)
+        group_ids = set()
+        while len(sections) > 1 and sum(len(section) for section in sections) > CHAPTER_SOURCE_MAX_CHARS:
+            groups = [sections[i:i + SUMMARY_GROUP_SIZE] for i in range(0, len(sections), SUMMARY_GROUP_SIZE)]
+            sections = self._merge_sections(groups, user_id, group_ids)
+        if user_id:
+            self._prune_group_summaries(user_id, keep=group_ids)
+        logger.info(f"Book chapter source: {len(stories)} stories -> {len(sections)} sections")
+        return "\n\n".join(sections)
+    
+    def forget_story_summaries(self, story_id: str, user_id: Optional[str] = None):
+        """Drop a deleted story's summary, and the user's group summaries (they condense its text)"""
+        with self._summary_lock:
+            self._summary_cache.pop(story_id, None)
+            if user_id:
+                for summary_id in [key for key in self._summary_cache if key.startswith(f"group-{user_id}-")]:
+                    del self._summary_cache[summary_id]
+        if self.db is None:
+            return
+        try:
+            self.db.collection(STORY_SUMMARIES_COLLECTION).document(story_id).delete()
+            if user_id:
+                self._prune_group_summaries(user_id, keep=set())
+        except Exception as e:
+            logger.warning(f"Could not delete summaries of story {story_id}: {e}")
+    
+    def _summarize_stories(self, stories: List[Dict], user_id: Optional[str]) -> List[str]:
+        """Map step: '### title' + summary per story"""
+        version = self.prompts_engine.prompt_version('compilation/story_summary')
+        titles, jobs = {}, []
+        for story in stories:
+            title = story.get('title') or 'Story'
+            content = (story.get('content') or '').strip()
+            digest = text_digest(f"{title}\n{content}")
+            summary_id = story.get('id') or digest
+            titles[summary_id] = (title, content)
+            if len(content) > STORY_SUMMARY_MIN_CHARS:
+                jobs.append((summary_id, f"{digest}:{version}", (title, content)))
+        
+        summaries = self._cached_summaries(jobs, lambda payload: self._summary_completion(
+            'story_summary', 'compilation/story_summary', title=payload[0], content=payload[1]),
+            'summarized', user_id)
+        return [f"### {title}\n{summaries.get(summary_id, content)}"
+                for summary_id, (title, content) in titles.items()]
+    
+    def _merge_sections(self, groups: List[List[str]], user_id: Optional[str], group_ids: set) -> List[str]:
+        """Reduce step: one condensed section per group of consecutive sections (ids added to group_ids)"""
+        version = self.prompts_engine.prompt_version('compilation/summary_merge')
+        prefix = f"group-{user_id}-" if user_id else "group-"
+        jobs = []
+        for group in groups:
+            if len(group) > 1:
+                digest = text_digest("\n\n".join(group))
+                jobs.append((f"{prefix}{digest}", f"{digest}:{version}", group))
+        group_ids.update(job[0] for job in jobs)
+        
+        merged = self._cached_summaries(jobs, lambda group: self._summary_completion(
+            'summary_merge', 'compilation/summary_merge', summaries="\n\n".join(group)),
+            'merged', user_id)
+        by_group = {id(group): merged[summary_id] for summary_id, _, group in jobs}
+        return [by_group.get(id(group), group[0]) for group in groups]
+    
+    def _cached_summaries(self, jobs: List[Tuple[str, str, Any]], summarize: Callable[[Any], str],
+                          counter: str, user_id: Optional[str] = None) -> Dict[str, str]:
+        """
+        Summary per id for (id, cache key, payload) jobs: from memory, else from Firestore if
+        stored under the same cache key, else summarize(payload) (in parallel, then stored).
+        Summaries that succeeded are kept even when another one fails; the first error is raised.
+        """
+        found = {}
+        with self._summary_lock:
+            for summary_id, cache_key, _ in jobs:
+                entry = self._summary_cache.get(summary_id)
+                if entry is not None and entry[0] == cache_key:
+                    self._summary_cache.move_to_end(summary_id)
+                    found[summary_id] = entry[1]
+        self.compilation_stats['memory_hits'] += len(found)
+        
+        pending = [job for job in jobs if job[0] not in found]
+        if pending and self.db is not None:
+            try:
+                refs = [self.db.collection(STORY_SUMMARIES_COLLECTION).document(job[0]) for job in pending]
+                keys = {summary_id: cache_key for summary_id, cache_key, _ in pending}
+                for doc in self.db.get_all(refs):
+                    data = doc.to_dict() if doc.exists else None
+                    if data and data.get('cache_key') == keys.get(doc.id):
+                        found[doc.id] = data['summary']
+                        self._remember_summary(doc.id, data['cache_key'], data['summary'])
+                        self.compilation_stats['store_hits'] += 1
+            except Exception as e:
+                logger.warning(f"Could not load cached story summaries: {e}")
+            pending = [job for job in pending if job[0] not in found]
+        
+        if not pending:
+            return found
+        with ThreadPoolExecutor(max_workers=min(SUMMARY_WORKERS, len(pending))) as pool:
+            futures = [(job, pool.submit(summarize, job[2])) for job in pending]
+        
+        generated, errors = [], []
+        for job, future in futures:
+            try:
+                generated.append((job, future.result()))
+            except Exception as e:
+                errors.append(e)
+        self.compilation_stats[counter] += len(generated)
+        
+        batch = self.db.batch() if self.db is not None and generated else None
+        for (summary_id, cache_key, _), summary in generated:
+            found[summary_id] = summary
+            self._remember_summary(summary_id, cache_key, summary)
+            if batch is not None:
+                batch.set(self.db.collection(STORY_SUMMARIES_COLLECTION).document(summary_id),
+                          self._summary_document(summary_id, cache_key, summary, user_id))
+        if batch is not None:
+            try:
+                batch.commit()
+            except Exception as e:
+                logger.warning(f"Could not store story summaries: {e}")
+        if errors:
+            logger.error(f"{len(errors)} of {len(pending)} summaries failed; {len(generated)} stored")
+            raise errors[0]
+        return found
+    
+    def _summary_document(self, summary_id: str, cache_key: str, summary: str, user_id: Optional[str]) -> Dict:
+        document = {
+            'cache_key': cache_key,
+            'summary': summary,
+            'user_id': user_id,
+            'kind': 'group' if summary_id.startswith('group-') else 'story',
+            'updated_at': datetime.now().isoformat()
+        }
+        if document['kind'] == 'group':
+            # Firestore TTL policy on expires_at removes groups of users who stopped compiling
+            document['expires_at'] = datetime.now(timezone.utc) + timedelta(days=SUMMARY_GROUP_RETENTION_DAYS)
+        return document
+    
+    def _prune_group_summaries(self, user_id: str, keep: set):
+        """Delete the user's stored group summaries whose ids are not in keep"""
+        if self.db is None:
+            return
+        try:
+            query = (self.db.collection(STORY_SUMMARIES_COLLECTION)
+                     .where('user_id', '==', user_id).where('kind', '==', 'group'))
+            stale = [doc.reference for doc in query.stream() if doc.id not in keep]
+            for start in range(0, len(stale), 400):
+                batch = self.db.batch()
+                for ref in stale[start:start + 400]:
+                    batch.delete(ref)
+                batch.commit()
+            if stale:
+                logger.info(f"Pruned {len(stale)} stale group summaries for user {user_id}")
+        except Exception as e:
+            logger.warning(f"Could not prune group summaries for user {user_id}: {e}")
+    
+    def _remember_summary(self, summary_id: str, cache_key: str, summary: str):
+        with self._summary_lock:
+            self._summary_cache[summary_id] = (cache_key, summary)
+            self._summary_cache.move_to_end(summary_id)
+            while len(self._summary_cache) > SUMMARY_CACHE_MAX_ENTRIES:
+                self._summary_cache.popitem(last=False)
+    
+    def _summary_completion(self, route_key: str, template_name: str, **fields) -> str:
+        template = self.prompts_engine.registry.get(template_name)
+        if template is None:
+            raise RuntimeError(f'Prompt template {template_name} not found')
+        messages = [
+            {"role": "system", "content": self.prompts_engine.get_prompt(PromptType.FORMAT_SYSTEM, format_type=FormatType.BOOK_CHAPTER)},
+            {"role": "user", "content": template.render(**fields)}
+        ]
+        route = self.model_router.route(route_key)
+        response = self.model_router.call(route, lambda r: self.openai_client.ChatCompletion.create(
+            model=r['model'],
+            messages=messages,
+            temperature=r['temperature'],
+            max_tokens=r['max_tokens']
+        ))
+        return response.choices[0].message.content.strip()
     
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+Generation Jobs
+===============
+
+Background jobs for streamed LLM generation (long formats, book chapters).
+
+A job runs on a worker thread, independent of the HTTP request that started
+it, so a client disconnect does not cancel or lose the generation:
+- chunks are appended to the job as they arrive and pushed to every attached
+  reader (Server-Sent Events)
+- the partial text is checkpointed to Firestore every few seconds, so a client
+  can reconnect - to this or another worker - and resume from the character
+  offset it already has
+- when the stream ends the job's on_complete callback persists the result
+  (e.g. saves the format to the story) and the job is marked completed
+
+Checkpoints hold the user's private text, so they do not outlive the job:
+finished jobs are dropped from memory and their Firestore document deleted
+once retention_seconds have passed, and every checkpoint carries an
+expires_at (last update + retention_seconds) for a Firestore TTL policy on
+JOBS_COLLECTION, which removes jobs of workers that died or were never pruned.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'format_generation_jobs'
+
+
+class GenerationJob:
+    """Accumulated output and status of one streamed generation."""
+
+    def __init__(self, job_id: str, owner: str, kind: str, meta: Optional[Dict] = None):
+        self.id = job_id
+        self.owner = owner
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = 'running'
+        self.error: Optional[str] = None
+        self.result: Optional[Dict] = None
+        self.created_at = datetime.now().isoformat()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+        self._parts = []
+        self._length = 0
+        self._cond = threading.Condition()
+
+    @property
+    def text(self) -> str:
+        with self._cond:
+            return ''.join(self._parts)
+
+    @property
+    def done(self) -> bool:
+        return self.status != 'running'
+
+    def append(self, chunk: str):
+        with self._cond:
+            self._parts.append(chunk)
+            self._length += len(chunk)
+            self.updated_at = datetime.now().isoformat()
+            self._cond.notify_all()
+
+    def finish(self, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.updated_at = datetime.now().isoformat()
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def wait_for(self, offset: int, timeout: float) -> str:
+        """Text after offset, waiting up to timeout for more when there is none yet."""
+        with self._cond:
+            if self._length <= offset and not self.done:
+                self._cond.wait(timeout)
+            return ''.join(self._parts)[offset:]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Persistable state (partial text included)."""
+        return {
+            'job_id': self.id,
+            'owner': self.owner,
+            'kind': self.kind,
+            'meta': self.meta,
+            'status': self.status,
+            'error': self.error,
+            'result': self.result,
+            'content': self.text,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class GenerationJobStore:
+    """Starts, tracks and streams generation jobs; checkpoints partial output to Firestore."""
+
+    def __init__(self, db=None, max_workers: int = 4, checkpoint_seconds: float = 2.0,
+                 retention_seconds: float = 3600, heartbeat_seconds: float = 15.0,
+                 stale_seconds: float = 300):
+        self.db = db
+        self.checkpoint_seconds = checkpoint_seconds
+        self.retention_seconds = retention_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='generation-job')
+        self._jobs: "OrderedDict[str, GenerationJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, owner: str, kind: str, produce: Callable[[], Iterator[str]],
+              on_complete: Callable[[str], Dict], meta: Optional[Dict] = None) -> GenerationJob:
+        """
+        Run produce() in the background, collecting its chunks. on_complete(text) persists
+        the final text and returns the result dict reported to clients.
+        """
+        job = GenerationJob(uuid.uuid4().hex, owner, kind, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+            expired = self._prune()
+        self._delete_checkpoints(expired)
+        self._checkpoint(job)
+        self._executor.submit(self._run, job, produce, on_complete)
+        return job
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        """Job from this worker, or a read-only copy of its last checkpoint."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return self._load_checkpoint(job_id)
+
+    def events(self, job: GenerationJob, offset: int = 0) -> Iterator[str]:
+        """Server-Sent Events for a job from a character offset: job, chunk..., then done/error."""
+        yield _sse({'type': 'job', 'job_id': job.id, 'kind': job.kind, 'offset': offset})
+        local = self._is_local(job)
+        while True:
+            if local:
+                text = job.wait_for(offset, self.heartbeat_seconds)
+            else:
+                # Running on another worker: follow its checkpoints
+                time.sleep(min(self.checkpoint_seconds, self.heartbeat_seconds))
+                job = self._load_checkpoint(job.id) or job
+                text = job.text[offset:]
+                if not job.done and self._is_stale(job):
+                    job.finish('failed', error='Generation was interrupted - please retry')
+            if text:
+                offset += len(text)
+                yield _sse({'type': 'chunk', 'text': text, 'offset': offset})
+            elif not job.done:
+                yield ': keep-alive\n\n'
+            if job.done and offset >= len(job.text):
+                break
+        if job.status == 'completed':
+            yield _sse({'type': 'done', 'offset': offset, 'result': job.result or {}})
+        else:
+            yield _sse({'type': 'error', 'offset': offset, 'error': job.error or 'Generation failed'})
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _run(self, job: GenerationJob, produce: Callable[[], Iterator[str]], on_complete: Callable[[str], Dict]):
+        last_checkpoint = time.monotonic()
+        try:
+            for chunk in produce():
+                if not chunk:
+                    continue
+                job.append(chunk)
+                if time.monotonic() - last_checkpoint >= self.checkpoint_seconds:
+                    self._checkpoint(job)
+                    last_checkpoint = time.monotonic()
+            text = job.text
+            if not text.strip():
+                raise ValueError('Empty generation')
+            job.finish('completed', result=on_complete(text))
+            logger.info(f"Generation job {job.id} ({job.kind}) completed: {len(text)} chars")
+        except Exception as e:
+            logger.error(f"Generation job {job.id} ({job.kind}) failed: {e}")
+            job.finish('failed', error=str(e))
+        self._checkpoint(job)
+
+    def _checkpoint(self, job: GenerationJob):
+        if self.db is None:
+            return
+        try:
+            data = job.snapshot()
+            data['expires_at'] = datetime.now(timezone.utc) + timedelta(seconds=self.retention_seconds)
+            self.db.collection(JOBS_COLLECTION).document(job.id).set(data)
+        except Exception as e:
+            logger.warning(f"Could not checkpoint generation job {job.id}: {e}")
+
+    def _delete_checkpoints(self, job_ids):
+        if self.db is None or not job_ids:
+            return
+        try:
+            batch = self.db.batch()
+            for job_id in job_ids:
+                batch.delete(self.db.collection(JOBS_COLLECTION).document(job_id))
+            batch.commit()
+        except Exception as e:
+            logger.warning(f"Could not delete {len(job_ids)} expired generation jobs: {e}")
+
+    def _load_checkpoint(self, job_id: str) -> Optional[GenerationJob]:
+        if self.db is None:
+            return None
+        try:
+            doc = self.db.collection(JOBS_COLLECTION).document(job_id).get()
+        except Exception as e:
+            logger.warning(f"Could not load generation job {job_id}: {e}")
+            return None
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        job = GenerationJob(job_id, data.get('owner'), data.get('kind'), data.get('meta'))
+        job.created_at = data.get('created_at', job.created_at)
+        if data.get('content'):
+            job.append(data['content'])
+        job.updated_at = data.get('updated_at', job.updated_at)
+        if data.get('status', 'running') != 'running':
+            job.finish(data['status'], result=data.get('result'), error=data.get('error'))
+        return job
+
+    def _is_stale(self, job: GenerationJob) -> bool:
+        """A checkpointed running job whose worker stopped reporting progress."""
+        try:
+            age = (datetime.now() - datetime.fromisoformat(job.updated_at)).total_seconds()
+        except (TypeError, ValueError):
+            return False
+        return age > self.stale_seconds
+
+    def _is_local(self, job: GenerationJob) -> bool:
+        with self._lock:
+            return self._jobs.get(job.id) is job
+
+    def _prune(self) -> list:
+        """Forget finished jobs past retention and return their ids (caller holds the lock)."""
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.retention_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return expired
+
+
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
@@ -0,0 +1,101 @@
+"""
+Insight Freshness
+=================
+
+Staleness policy for expensive AI insight generation (cross-conversation
+insights, deep user insights).
+
+A stored insight carries the input watermark it was generated from (e.g. the
+number and last timestamp of analyzed conversations). On each request:
+- watermark unchanged and younger than max_age  -> serve the stored insight
+- watermark changed or older than max_age       -> serve the stored insight and
+  refresh it in the background (stale-while-revalidate)
+- nothing stored yet, or force_refresh          -> generate synchronously
+
+Background refreshes are deduplicated per key and run on a small thread pool.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE_SECONDS = float(os.getenv('INSIGHTS_MAX_AGE_HOURS', '24')) * 3600
+
+
+def make_watermark(count: Any, last_timestamp: Any) -> str:
+    """Watermark string for an input set described by its size and newest timestamp."""
+    return f"{count or 0}:{last_timestamp or ''}"
+
+
+def _age_seconds(generated_at: Optional[str]) -> Optional[float]:
+    if not generated_at:
+        return None
+    try:
+        return (datetime.now() - datetime.fromisoformat(generated_at)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+class FreshnessPolicy:
+    """Decides between serving, revalidating in the background, or regenerating an insight."""
+
+    def __init__(self, name: str, max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+                 stale_while_revalidate: bool = True, max_workers: int = 2):
+        self.name = name
+        self.max_age_seconds = max_age_seconds
+        self.stale_while_revalidate = stale_while_revalidate
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-refresh")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.stats = {'fresh': 0, 'stale_served': 0, 'generated': 0, 'background_refreshes': 0}
+
+    def resolve(self, key: str, watermark: str, cached: Optional[Dict], compute: Callable[[], Dict],
+                force_refresh: bool = False) -> Dict:
+        """
+        cached: {'value': ..., 'watermark': str, 'generated_at': iso str} or None.
+        compute() generates (and persists) a new value and returns it.
+        """
+        if force_refresh or not cached or cached.get('value') is None:
+            self.stats['generated'] += 1
+            return compute()
+
+        age = _age_seconds(cached.get('generated_at'))
+        expired = age is None or age >= self.max_age_seconds
+        if cached.get('watermark') == watermark and not expired:
+            self.stats['fresh'] += 1
+            return cached['value']
+
+        if not self.stale_while_revalidate:
+            self.stats['generated'] += 1
+            return compute()
+
+        self.stats['stale_served'] += 1
+        self._refresh_in_background(key, compute)
+        return cached['value']
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _refresh_in_background(self, key: str, compute: Callable[[], Dict]):
+        with self._lock:
+            if key in self._in_flight:
+                return
+            self._in_flight.add(key)
+        self.stats['background_refreshes'] += 1
+
+        def run():
+            try:
+                compute()
+            except Exception as e:
+                logger.warning(f"{self.name}: background refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(key)
+
+        self._executor.submit(run)
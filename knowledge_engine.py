@@ -8,28 +8,101 @@ Focuses on understanding themes, patterns, and connections across user conversat
 Cost-conscious approach:
 - Batch processing for expensive AI analysis
 - Rules-based categorization for basic operations
-- AI for deep insight generation and semantic connections
+- AI for deep insight generation
+- Local vector index (no API calls) for semantic connections
 """
 
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+import threading
+from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime, timedelta
 import json
 import openai
 import os
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
 import re
+from lexicon_engine import lexicon
+from text_analysis import AnalyzedText, analyze
+from insight_freshness import FreshnessPolicy, make_watermark
+
+try:
+    from firebase_admin import firestore
+except ImportError:
+    firestore = None
 
 logger = logging.getLogger(__name__)
 
+INSIGHTS_COLLECTION = 'content_insights'
+OVERVIEW_COLLECTION = 'knowledge_overviews'
+
+
+def _aggregate_insights(user_id: str, insight_docs) -> Dict[str, Any]:
+    """Overview aggregate computed from content_insights documents (dicts)"""
+    domain_counts = defaultdict(float)
+    theme_counts = defaultdict(int)
+    emotional_patterns = defaultdict(int)
+    total = 0
+    for data in insight_docs:
+        insights = (data or {}).get('insights', {})
+        total += 1
+        for domain, confidence in insights.get('domains', {}).items():
+            domain_counts[domain] += confidence
+        for theme in insights.get('themes', []):
+            theme_counts[theme] += 1
+        for emotion in insights.get('emotional_markers', []):
+            emotional_patterns[emotion] += 1
+    now = datetime.now().isoformat()
+    return {
+        'user_id': user_id,
+        'total_conversations_analyzed': total,
+        'domains': dict(domain_counts),
+        'themes': dict(theme_counts),
+        'emotions': dict(emotional_patterns),
+        'last_updated': now,
+        'rebuilt_at': now
+    }
+
+
+def _create_insight(transaction, insight_ref, overview_ref, insights_query, insight_data: Dict,
+                    overview_increments: Dict) -> bool:
+    """
+    Create the insight doc and bump the user's overview aggregate atomically (no-op if it exists).
+    A user without an overview yet (e.g. history from before the aggregate existed) gets it seeded
+    from all their content_insights plus this one, never a partial aggregate.
+    """
+    if insight_ref.get(transaction=transaction).exists:
+        return False
+    overview_exists = overview_ref.get(transaction=transaction).exists
+    existing = None if overview_exists else [doc.to_dict() for doc in transaction.get(insights_query)]
+    transaction.set(insight_ref, insight_data)
+    if overview_exists:
+        transaction.set(overview_ref, overview_increments, merge=True)
+    else:
+        transaction.set(overview_ref, _aggregate_insights(insight_data['user_id'], existing + [insight_data]))
+    return True
+
+
+def _rebuild_overview(transaction, overview_ref, insights_query, user_id: str) -> Dict[str, Any]:
+    """Recompute the overview inside a transaction, so increments landing meanwhile make it retry"""
+    overview_ref.get(transaction=transaction)
+    aggregate = _aggregate_insights(user_id, [doc.to_dict() for doc in transaction.get(insights_query)])
+    transaction.set(overview_ref, aggregate)
+    return aggregate
+
+
+_create_insight_transaction = firestore.transactional(_create_insight) if firestore else None
+_rebuild_overview_transaction = firestore.transactional(_rebuild_overview) if firestore else None
+
 class KnowledgeEngine:
     """
     Hybrid engine for domain insights and knowledge exploration.
     Balances intelligence with cost-effectiveness.
     """
     
-    def __init__(self, db=None):
+    def __init__(self, db=None, semantic_index=None):
         self.db = db
+        self.semantic_index = semantic_index
         
         # Initialize OpenAI for deep analysis
         self.openai_client = None
@@ -70,22 +143,60 @@ class KnowledgeEngine:
                 'inspiration', 'expression', 'artistic', 'craft', 'beauty'
             ]
         }
+        
+        # Common theme patterns
+        self.theme_patterns = {
+            'change': ['change', 'transform', 'shift', 'evolve', 'transition'],
+            'challenge': ['difficult', 'hard', 'struggle', 'challenge', 'obstacle'],
+            'discovery': ['discover', 'realize', 'understand', 'learn', 'insight'],
+            'relationship': ['connect', 'bond', 'relate', 'together', 'apart'],
+            'growth': ['grow', 'develop', 'improve', 'progress', 'advance'],
+            'reflection': ['think', 'consider', 'reflect', 'ponder', 'contemplate'],
+            'emotion': ['feel', 'emotion', 'heart', 'soul', 'spirit'],
+            'time': ['past', 'future', 'present', 'now', 'then', 'when'],
+            'memory': ['remember', 'forget', 'memory', 'recall', 'remind'],
+            'decision': ['decide', 'choose', 'option', 'choice', 'pick']
+        }
+        
+        # Emotional marker indicators
+        self.emotional_indicators = {
+            'positive': ['happy', 'joy', 'excited', 'love', 'amazing', 'wonderful'],
+            'negative': ['sad', 'angry', 'frustrated', 'hurt', 'pain', 'difficult'],
+            'contemplative': ['think', 'wonder', 'consider', 'reflect', 'ponder'],
+            'uncertain': ['maybe', 'perhaps', 'not sure', 'confused', 'unclear'],
+            'confident': ['certain', 'sure', 'confident', 'believe', 'know'],
+            'vulnerable': ['vulnerable', 'exposed', 'open', 'honest', 'raw']
+        }
+        
+        # Ids of content_insights documents known to exist (skips the existence read)
+        self._stored_insight_ids: "OrderedDict[str, bool]" = OrderedDict()
+        self._stored_insight_ids_max = 4096
+        self._insights_lock = threading.Lock()
+        
+        # Cross-conversation insights are regenerated only when new insights arrive (or max-age passes)
+        self.insights_freshness = FreshnessPolicy('cross_conversation_insights')
+        
+        # Compile keyword tables into the shared lexicon (one pass per text for all analyzers)
+        lexicon.register('knowledge.domains', self.domain_patterns)
+        lexicon.register('knowledge.themes', self.theme_patterns)
+        lexicon.register('knowledge.emotions', self.emotional_indicators)
     
     # =============================================================================
     # RULES-BASED DOMAIN ANALYSIS (Fast, cost-effective)
     # =============================================================================
     
-    def analyze_story_for_insights(self, content: str, user_id: str) -> Dict[str, Any]:
+    def analyze_story_for_insights(self, content: Union[str, AnalyzedText], user_id: str) -> Dict[str, Any]:
         """Analyze content for domain insights using rules-based approach"""
+        analyzed = analyze(content)
         
         # Basic domain classification
-        domains = self._classify_content_domains(content)
+        domains = self._classify_content_domains(analyzed)
         
         # Extract key themes using rules
-        themes = self._extract_themes_rules_based(content)
+        themes = self._extract_themes_rules_based(analyzed)
         
         # Detect emotional markers
-        emotional_markers = self._detect_emotional_markers(content)
+        emotional_markers = self._detect_emotional_markers(analyzed)
         
         # Calculate insight confidence
         confidence = self._calculate_insight_confidence(domains, themes, emotional_markers)
@@ -99,87 +210,133 @@ class KnowledgeEngine:
             'timestamp': datetime.now().isoformat()
         }
         
-        # Store insights for future analysis
+        # Store insights for future analysis (once per user and content)
         if self.db:
             try:
-                self.db.collection('content_insights').add({
-                    'user_id': user_id,
-                    'content_hash': hash(content),
-                    'insights': insights,
-                    'content_length': len(content),
-                    'word_count': len(content.split())
-                })
+                self._store_insights(user_id, analyzed, insights)
             except Exception as e:
                 logger.warning(f"Failed to store insights: {e}")
         
+        # Index the content for local semantic connection lookups
+        if self.semantic_index is not None:
+            try:
+                insight_id = self.insight_id(user_id, analyzed)
+                if insight_id not in self.semantic_index.user(user_id):
+                    self.semantic_index.add(insight_id, analyzed.text, {
+                        'themes': themes,
+                        'domains': list(domains),
+                        'timestamp': insights['timestamp']
+                    }, user_id=user_id)
+            except Exception as e:
+                logger.warning(f"Failed to index content for semantic connections: {e}")
+        
         return insights
     
     def get_user_knowledge_overview(self, user_id: str) -> Dict[str, Any]:
-        """Get overview of user's knowledge domains and patterns"""
+        """Get overview of user's knowledge domains and patterns (one aggregate document read)"""
         if not self.db:
             return self._get_default_knowledge_overview()
         
         try:
-            # Get all user insights
-            insights_ref = self.db.collection('content_insights').where('user_id', '==', user_id)
-            insights_docs = list(insights_ref.stream())
+            overview_doc = self.db.collection(OVERVIEW_COLLECTION).document(user_id).get()
+            if overview_doc.exists:
+                aggregate = overview_doc.to_dict()
+            else:
+                # First read for this user (or after invalidation) - backfill from content_insights
+                aggregate = self.rebuild_user_knowledge_overview(user_id)
             
-            if not insights_docs:
+            if not aggregate.get('total_conversations_analyzed'):
                 return self._get_default_knowledge_overview()
             
-            # Aggregate insights
-            domain_counts = defaultdict(int)
-            theme_counts = defaultdict(int)
-            emotional_patterns = defaultdict(int)
-            
-            for doc in insights_docs:
-                data = doc.to_dict()
-                insights = data.get('insights', {})
-                
-                # Count domains
-                for domain, confidence in insights.get('domains', {}).items():
-                    domain_counts[domain] += confidence
-                
-                # Count themes
-                for theme in insights.get('themes', []):
-                    theme_counts[theme] += 1
-                
-                # Count emotional markers
-                for emotion in insights.get('emotional_markers', []):
-                    emotional_patterns[emotion] += 1
-            
-            # Calculate top patterns
-            top_domains = dict(Counter(domain_counts).most_common(5))
-            top_themes = dict(Counter(theme_counts).most_common(10))
-            top_emotions = dict(Counter(emotional_patterns).most_common(5))
-            
-            overview = {
-                'total_conversations_analyzed': len(insights_docs),
-                'primary_domains': top_domains,
-                'common_themes': top_themes,
-                'emotional_patterns': top_emotions,
-                'knowledge_depth': len(insights_docs) / 10.0,  # Rough measure
-                'last_updated': datetime.now().isoformat()
-            }
-            
-            return overview
+            return self._overview_from_aggregate(aggregate)
             
         except Exception as e:
             logger.error(f"Error getting knowledge overview for {user_id}: {e}")
             return self._get_default_knowledge_overview()
     
+    def rebuild_user_knowledge_overview(self, user_id: str) -> Dict[str, Any]:
+        """
+        Recompute a user's overview aggregate from all content_insights documents and store it.
+        Used for backfill and repair; normal writes keep the aggregate up to date incrementally.
+        Runs in a transaction, so insights created concurrently are not overwritten.
+        """
+        if not self.db:
+            return {}
+        
+        overview_ref = self.db.collection(OVERVIEW_COLLECTION).document(user_id)
+        insights_query = self.db.collection(INSIGHTS_COLLECTION).where('user_id', '==', user_id)
+        if _rebuild_overview_transaction is not None:
+            aggregate = _rebuild_overview_transaction(self.db.transaction(), overview_ref, insights_query, user_id)
+        else:
+            aggregate = _aggregate_insights(user_id, [doc.to_dict() for doc in insights_query.stream()])
+            overview_ref.set(aggregate)
+        logger.info(f"KnowledgeEngine: rebuilt knowledge overview for {user_id} "
+                    f"from {aggregate['total_conversations_analyzed']} insights")
+        return aggregate
+    
+    def rebuild_all_knowledge_overviews(self) -> int:
+        """Rebuild the overview aggregate of every user with content_insights; returns the user count"""
+        if not self.db:
+            return 0
+        
+        user_ids = set()
+        for doc in self.db.collection(INSIGHTS_COLLECTION).stream():
+            user_id = doc.to_dict().get('user_id')
+            if user_id:
+                user_ids.add(user_id)
+        
+        for user_id in sorted(user_ids):
+            try:
+                self.rebuild_user_knowledge_overview(user_id)
+            except Exception as e:
+                logger.error(f"Failed to rebuild knowledge overview for {user_id}: {e}")
+        return len(user_ids)
+    
     # =============================================================================
     # AI-POWERED DEEP ANALYSIS (Strategic usage)
     # =============================================================================
     
-    def generate_cross_conversation_insights(self, user_id: str) -> Dict[str, Any]:
-        """Generate deep insights across multiple conversations using AI"""
+    def generate_cross_conversation_insights(self, user_id: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        Generate deep insights across multiple conversations using AI.
+        The stored result is reused while no new insights have been analyzed since it was generated.
+        """
         if not self.openai_client or not self.db:
             return {'insights': [], 'connections': [], 'patterns': []}
         
+        try:
+            # Input watermark comes from the overview aggregate (one document read)
+            overview = self.get_user_knowledge_overview(user_id)
+            analyzed_count = overview.get('total_conversations_analyzed', 0)
+            if analyzed_count < 3:
+                return {'insights': [], 'connections': [], 'note': 'Need more conversations for cross-analysis'}
+            watermark = make_watermark(analyzed_count, overview.get('last_updated'))
+            
+            cached = None
+            knowledge_doc = self.db.collection('user_knowledge').document(user_id).get()
+            if knowledge_doc.exists:
+                knowledge = knowledge_doc.to_dict()
+                if knowledge.get('cross_conversation_insights') is not None:
+                    cached = {
+                        'value': knowledge['cross_conversation_insights'],
+                        'watermark': knowledge.get('cross_conversation_watermark'),
+                        'generated_at': knowledge.get('generated_at')
+                    }
+            
+            return self.insights_freshness.resolve(
+                f"cross:{user_id}", watermark, cached,
+                lambda: self._compute_cross_conversation_insights(user_id, watermark),
+                force_refresh=force_refresh
+            )
+        except Exception as e:
+            logger.error(f"Error generating cross-conversation insights: {e}")
+            return {'insights': [], 'connections': [], 'error': str(e)}
+    
+    def _compute_cross_conversation_insights(self, user_id: str, watermark: str) -> Dict[str, Any]:
+        """Run the GPT-4 cross-conversation analysis and store it with its input watermark"""
         try:
             # Get recent conversation data
-            insights_ref = (self.db.collection('content_insights')
+            insights_ref = (self.db.collection(INSIGHTS_COLLECTION)
                           .where('user_id', '==', user_id)
                           .order_by('timestamp', direction='desc')
                           .limit(10))
@@ -241,6 +398,7 @@ class KnowledgeEngine:
                 if self.db:
                     self.db.collection('user_knowledge').document(user_id).set({
                         'cross_conversation_insights': cross_insights,
+                        'cross_conversation_watermark': watermark,
                         'generated_at': datetime.now().isoformat(),
                         'conversations_analyzed': len(insights_docs)
                     }, merge=True)
@@ -255,118 +413,142 @@ class KnowledgeEngine:
             logger.error(f"Error generating cross-conversation insights: {e}")
             return {'insights': [], 'connections': [], 'error': str(e)}
     
-    def find_semantic_connections(self, content: str, user_id: str) -> List[Dict[str, Any]]:
-        """Find semantic connections to previous conversations using AI"""
-        if not self.openai_client:
-            return []
+    def find_semantic_connections(self, content: Union[str, AnalyzedText], user_id: str, k: int = 5) -> Dict[str, Any]:
+        """Find semantic connections to previous conversations using the local vector index (no API calls)"""
+        empty = {'direct_connections': [], 'thematic_links': [], 'potential_insights': []}
+        if self.semantic_index is None:
+            return empty
         
         try:
-            # Get user's conversation history
-            overview = self.get_user_knowledge_overview(user_id)
-            
-            if not overview.get('common_themes'):
-                return []  # Not enough history for connections
-            
-            # AI prompt for semantic connection finding
-            connection_prompt = f"""
-            Find semantic connections between this new content and the user's conversation history:
-            
-            New content: "{content}"
+            analyzed = analyze(content)
+            index = self.semantic_index.user(user_id)
+            if not len(index):
+                return empty  # Not enough history for connections
             
-            User's common themes: {list(overview.get('common_themes', {}).keys())}
-            User's primary domains: {list(overview.get('primary_domains', {}).keys())}
+            matches = index.query([analyzed.text], k=k, exclude=[self.insight_id(user_id, analyzed)],
+                                  min_score=0.1)[0]
+            if not matches:
+                return empty
             
-            Return connections in this JSON structure:
-            {{
-                "direct_connections": ["connection1", "connection2"],
-                "thematic_links": ["link1", "link2"],
-                "potential_insights": ["insight1", "insight2"]
-            }}
-            
-            Only include meaningful connections, not superficial word matches.
-            """
+            current_themes = set(self._extract_themes_rules_based(analyzed))
+            related_themes = Counter(theme for match in matches for theme in match['metadata'].get('themes', []))
             
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",  # Cheaper model for connection finding
-                messages=[
-                    {"role": "system", "content": "You are an expert at finding meaningful semantic connections between ideas and themes."},
-                    {"role": "user", "content": connection_prompt}
+            return {
+                'direct_connections': [
+                    {
+                        'insight_id': match['id'],
+                        'similarity': round(match['score'], 3),
+                        'themes': match['metadata'].get('themes', []),
+                        'domains': match['metadata'].get('domains', []),
+                        'timestamp': match['metadata'].get('timestamp')
+                    }
+                    for match in matches
                 ],
-                max_tokens=400,
-                temperature=0.4
-            )
-            
-            connections_text = response.choices[0].message.content.strip()
-            connections = json.loads(connections_text)
-            
-            return connections
+                # Themes this content shares with similar earlier conversations
+                'thematic_links': [theme for theme, _ in related_themes.most_common() if theme in current_themes],
+                # Themes recurring in similar conversations that this content has not touched yet
+                'potential_insights': [theme for theme, count in related_themes.most_common()
+                                       if theme not in current_themes and count > 1]
+            }
             
         except Exception as e:
             logger.warning(f"Error finding semantic connections: {e}")
-            return []
+            return empty
+    
+    # =============================================================================
+    # INSIGHT STORAGE
+    # =============================================================================
+    
+    @staticmethod
+    def insight_id(user_id: str, content: Union[str, AnalyzedText]) -> str:
+        """Deterministic content_insights document id: BLAKE2b of user id + content hash"""
+        digest = analyze(content).digest
+        return hashlib.blake2b(f"{user_id}:{digest}".encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _store_insights(self, user_id: str, analyzed: AnalyzedText, insights: Dict[str, Any]) -> bool:
+        """Create the insight document under its stable id and fold it into the overview; False if it existed"""
+        insight_id = self.insight_id(user_id, analyzed)
+        with self._insights_lock:
+            if insight_id in self._stored_insight_ids:
+                self._stored_insight_ids.move_to_end(insight_id)
+                return False
+        
+        insight_ref = self.db.collection(INSIGHTS_COLLECTION).document(insight_id)
+        overview_ref = self.db.collection(OVERVIEW_COLLECTION).document(user_id)
+        insight_data = {
+            'user_id': user_id,
+            'content_hash': analyzed.digest,
+            'insights': insights,
+            'content_length': len(analyzed.text),
+            'word_count': analyzed.word_count,
+            'timestamp': insights['timestamp']
+        }
+        
+        if _create_insight_transaction is not None:
+            insights_query = self.db.collection(INSIGHTS_COLLECTION).where('user_id', '==', user_id)
+            created = _create_insight_transaction(self.db.transaction(), insight_ref, overview_ref, insights_query,
+                                                  insight_data, self._overview_increments(user_id, insights))
+        else:
+            created = not insight_ref.get().exists
+            if created:
+                insight_ref.set(insight_data)
+                # No atomic increments available - drop the aggregate so the next read rebuilds it
+                overview_ref.delete()
+        
+        with self._insights_lock:
+            self._stored_insight_ids[insight_id] = True
+            while len(self._stored_insight_ids) > self._stored_insight_ids_max:
+                self._stored_insight_ids.popitem(last=False)
+        return created
+    
+    def _overview_increments(self, user_id: str, insights: Dict[str, Any]) -> Dict[str, Any]:
+        """Firestore Increment transforms that fold one insight into the overview aggregate"""
+        return {
+            'user_id': user_id,
+            'total_conversations_analyzed': firestore.Increment(1),
+            'domains': {domain: firestore.Increment(confidence)
+                        for domain, confidence in insights.get('domains', {}).items()},
+            'themes': {theme: firestore.Increment(1) for theme in insights.get('themes', [])},
+            'emotions': {emotion: firestore.Increment(1) for emotion in insights.get('emotional_markers', [])},
+            'last_updated': datetime.now().isoformat()
+        }
+    
+    def _overview_from_aggregate(self, aggregate: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape an overview aggregate document into the public overview structure"""
+        total = aggregate.get('total_conversations_analyzed', 0)
+        return {
+            'total_conversations_analyzed': total,
+            'primary_domains': dict(Counter(aggregate.get('domains', {})).most_common(5)),
+            'common_themes': dict(Counter(aggregate.get('themes', {})).most_common(10)),
+            'emotional_patterns': dict(Counter(aggregate.get('emotions', {})).most_common(5)),
+            'knowledge_depth': total / 10.0,  # Rough measure
+            'last_updated': aggregate.get('last_updated', datetime.now().isoformat())
+        }
     
     # =============================================================================
     # HELPER METHODS (Rules-based)
     # =============================================================================
     
-    def _classify_content_domains(self, content: str) -> Dict[str, float]:
+    def _classify_content_domains(self, content: Union[str, AnalyzedText]) -> Dict[str, float]:
         """Classify content into domains using rules-based approach"""
-        content_lower = content.lower()
+        hits = analyze(content).hits
         domain_scores = {}
         
-        for domain, keywords in self.domain_patterns.items():
-            matches = sum(1 for keyword in keywords if keyword in content_lower)
-            if matches > 0:
-                # Normalize score based on content length and keyword density
-                score = min(matches / len(keywords), 1.0)
-                domain_scores[domain] = score
+        for domain in hits.categories('knowledge.domains'):
+            matches = hits.count('knowledge.domains', domain)
+            # Normalize score based on content length and keyword density
+            score = min(matches / len(self.domain_patterns[domain]), 1.0)
+            domain_scores[domain] = score
         
         return domain_scores
     
-    def _extract_themes_rules_based(self, content: str) -> List[str]:
+    def _extract_themes_rules_based(self, content: Union[str, AnalyzedText]) -> List[str]:
         """Extract key themes using rules-based approach"""
-        # Common theme patterns
-        theme_patterns = {
-            'change': ['change', 'transform', 'shift', 'evolve', 'transition'],
-            'challenge': ['difficult', 'hard', 'struggle', 'challenge', 'obstacle'],
-            'discovery': ['discover', 'realize', 'understand', 'learn', 'insight'],
-            'relationship': ['connect', 'bond', 'relate', 'together', 'apart'],
-            'growth': ['grow', 'develop', 'improve', 'progress', 'advance'],
-            'reflection': ['think', 'consider', 'reflect', 'ponder', 'contemplate'],
-            'emotion': ['feel', 'emotion', 'heart', 'soul', 'spirit'],
-            'time': ['past', 'future', 'present', 'now', 'then', 'when'],
-            'memory': ['remember', 'forget', 'memory', 'recall', 'remind'],
-            'decision': ['decide', 'choose', 'option', 'choice', 'pick']
-        }
-        
-        found_themes = []
-        content_lower = content.lower()
-        
-        for theme, keywords in theme_patterns.items():
-            if any(keyword in content_lower for keyword in keywords):
-                found_themes.append(theme)
-        
-        return found_themes
+        return analyze(content).hits.categories('knowledge.themes')
     
-    def _detect_emotional_markers(self, content: str) -> List[str]:
+    def _detect_emotional_markers(self, content: Union[str, AnalyzedText]) -> List[str]:
         """Detect emotional markers in content"""
-        emotional_indicators = {
-            'positive': ['happy', 'joy', 'excited', 'love', 'amazing', 'wonderful'],
-            'negative': ['sad', 'angry', 'frustrated', 'hurt', 'pain', 'difficult'],
-            'contemplative': ['think', 'wonder', 'consider', 'reflect', 'ponder'],
-            'uncertain': ['maybe', 'perhaps', 'not sure', 'confused', 'unclear'],
-            'confident': ['certain', 'sure', 'confident', 'believe', 'know'],
-            'vulnerable': ['vulnerable', 'exposed', 'open', 'honest', 'raw']
-        }
-        
-        found_emotions = []
-        content_lower = content.lower()
-        
-        for emotion, indicators in emotional_indicators.items():
-            if any(indicator in content_lower for indicator in indicators):
-                found_emotions.append(emotion)
-        
-        return found_emotions
+        return analyze(content).hits.categories('knowledge.emotions')
     
     def _calculate_insight_confidence(self, domains: Dict, themes: List, emotions: List) -> float:
         """Calculate confidence in the insight analysis"""
@@ -0,0 +1,199 @@
+"""
+Lexicon Engine
+==============
+
+Shared multi-pattern keyword matcher for all rules-based analyzers
+(KnowledgeEngine, SmartStoryEngine, PersonalContextMapper).
+
+Every engine registers its keyword tables once at startup. The tables are
+compiled into a single word-level trie, so one pass over a text reports every
+(table, category, phrase) hit at once:
+- matching is word-boundary aware ("now" no longer matches inside "know")
+- multi-word phrases ("when i", "not sure") are matched as word sequences
+- the last word of a phrase also matches its common inflections
+  ("struggle" -> "struggles", "struggled", "struggling")
+
+Scans are memoized per text, so several analyzers looking at the same message
+share one pass.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+_TERMINAL = '__hits__'
+
+
+def tokenize_words(text: str) -> List[str]:
+    """Lowercase word tokens (apostrophe contractions kept together)."""
+    return WORD_RE.findall(text.lower().replace('’', "'"))
+
+
+def inflections(word: str) -> Set[str]:
+    """Common English inflections of a keyword (plural, past, progressive)."""
+    forms = {word}
+    if len(word) < 3 or not word.isalpha():
+        return forms
+    forms.update({word + 's', word + 'es', word + 'ed', word + 'ing'})
+    if word.endswith('e'):
+        forms.update({word + 'd', word[:-1] + 'ing'})
+    if word.endswith('y') and word[-2:-1] not in 'aeiou':
+        forms.update({word[:-1] + 'ies', word[:-1] + 'ied'})
+    return forms
+
+
+class LexiconHits:
+    """Result of one scan: which phrases of which table/category occurred, and how often."""
+
+    def __init__(self, engine: 'LexiconEngine'):
+        self._engine = engine
+        # (table, category) -> {canonical phrase: occurrences}
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def _add(self, table: str, category: str, phrase: str):
+        bucket = self._counts.setdefault((table, category), {})
+        bucket[phrase] = bucket.get(phrase, 0) + 1
+
+    def found(self, table: str, category: str = '') -> List[str]:
+        """Distinct phrases of a category that occurred, in declaration order."""
+        bucket = self._counts.get((table, category))
+        if not bucket:
+            return []
+        return [p for p in self._engine.phrases(table, category) if p in bucket]
+
+    def count(self, table: str, category: str = '') -> int:
+        """Number of distinct phrases of a category that occurred."""
+        return len(self._counts.get((table, category), {}))
+
+    def occurrences(self, table: str, category: str = '') -> int:
+        """Total number of phrase occurrences in a category."""
+        return sum(self._counts.get((table, category), {}).values())
+
+    def any(self, table: str, category: str = '') -> bool:
+        return bool(self._counts.get((table, category)))
+
+    def categories(self, table: str) -> List[str]:
+        """Categories of a table with at least one hit, in declaration order."""
+        return [c for c in self._engine.categories(table) if (table, c) in self._counts]
+
+    def items(self):
+        """((table, category), {phrase: occurrences}) for every category with hits."""
+        return self._counts.items()
+
+
+class LexiconEngine:
+    """Registry of keyword tables compiled into one word trie."""
+
+    def __init__(self, memo_size: int = 256):
+        # table -> category -> [phrases] (declaration order)
+        self._tables: Dict[str, Dict[str, List[str]]] = OrderedDict()
+        self._trie: Optional[Dict] = None
+        self._lock = threading.RLock()
+        self._memo: "OrderedDict[str, LexiconHits]" = OrderedDict()
+        self.memo_size = memo_size
+        # Bumped on every registration so callers holding hits can tell they are stale
+        self.version = 0
+
+    # =============================================================================
+    # REGISTRATION
+    # =============================================================================
+
+    def register(self, table: str, keywords: Union[Dict[str, Iterable[str]], Iterable[str]]):
+        """
+        Register a keyword table. A dict maps category -> phrases; a plain list is a
+        single category addressed with category ''. Re-registering replaces the table.
+        """
+        if isinstance(keywords, dict):
+            categories = {category: list(phrases) for category, phrases in keywords.items()}
+        else:
+            categories = {'': list(keywords)}
+        with self._lock:
+            self._tables[table] = categories
+            self._trie = None
+            self._memo.clear()
+            self.version += 1
+
+    def phrases(self, table: str, category: str = '') -> List[str]:
+        return self._tables.get(table, {}).get(category, [])
+
+    def categories(self, table: str) -> List[str]:
+        return list(self._tables.get(table, {}))
+
+    # =============================================================================
+    # SCANNING
+    # =============================================================================
+
+    def scan(self, text: str) -> LexiconHits:
+        """Return every registered table/category hit in text (single pass, memoized)."""
+        key = hashlib.blake2b((text or '').encode('utf-8'), digest_size=16).hexdigest()
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                return cached
+            trie = self._trie or self._compile()
+
+        hits = self.scan_tokens(tokenize_words(text or ''), trie)
+
+        with self._lock:
+            self._memo[key] = hits
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return hits
+
+    def scan_tokens(self, tokens: List[str], trie: Optional[Dict] = None) -> LexiconHits:
+        """Scan an already tokenized text (see tokenize_words)."""
+        if trie is None:
+            with self._lock:
+                trie = self._trie or self._compile()
+        hits = LexiconHits(self)
+        n = len(tokens)
+        for i in range(n):
+            node = trie
+            j = i
+            while j < n:
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                for table, category, phrase in node.get(_TERMINAL, ()):
+                    hits._add(table, category, phrase)
+                j += 1
+        return hits
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _compile(self) -> Dict:
+        """Build the word trie for all registered tables (caller holds the lock)."""
+        trie: Dict = {}
+        phrase_count = 0
+        for table, categories in self._tables.items():
+            for category, phrases in categories.items():
+                for phrase in phrases:
+                    words = tokenize_words(phrase)
+                    if not words:
+                        continue
+                    phrase_count += 1
+                    for last in inflections(words[-1]):
+                        node = trie
+                        for word in words[:-1] + [last]:
+                            node = node.setdefault(word, {})
+                        entry = (table, category, phrase)
+                        terminals = node.setdefault(_TERMINAL, [])
+                        if entry not in terminals:
+                            terminals.append(entry)
+        self._trie = trie
+        logger.info(f"LexiconEngine: compiled {phrase_count} phrases from {len(self._tables)} tables")
+        return trie
+
+
+# Process-wide engine shared by all analyzers
+lexicon = LexiconEngine()
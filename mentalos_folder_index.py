@@ -0,0 +1,220 @@
+"""
+MentalOS Folder Index
+=====================
+
+Keeps a per-user listing of MentalOS folders and their markdown files so the
+sidebar can be served from memory.
+
+Listings are built from the MentalOS storage keys (``list_keys``), so files
+written by other instances show up when the files live in shared object
+storage; without ``list_keys`` the base directory is walked.
+
+Invalidation is targeted: every write helper invalidates only the user it
+touched, so one user's edit never evicts anyone else's listing. Writes made by
+other instances are picked up once an entry is older than ``ttl`` (set it when
+the storage is shared). When the optional ``inotify_simple`` package is
+available the index also watches each indexed user directory and drops the
+entry on out-of-band changes (files created by hand, restored backups, other
+processes on the same disk).
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import inotify_simple as _inotify
+except ImportError:
+    _inotify = None
+
+logger = logging.getLogger(__name__)
+
+
+class FolderIndex:
+    """
+    Thread-safe, per-user cache of folder metadata under a MentalOS base directory.
+    Entries are built lazily on first read and rebuilt only after invalidation.
+    """
+
+    def __init__(self, base_dir: str, prepare: Optional[Callable[[str], None]] = None,
+                 watch: bool = False, list_keys: Optional[Callable[[str], List[str]]] = None,
+                 ttl: Optional[float] = None):
+        self.base_dir = base_dir
+        # Hook run before (re)scanning a user, e.g. to seed default folders.
+        # Kept out of the scan itself so reads stay side-effect free.
+        self.prepare = prepare
+        # Storage listing: prefix "<user>/" -> keys "<user>/<folder>/<file>"
+        self.list_keys = list_keys
+        self.ttl = ttl
+
+        # user_id -> (folders, monotonic time built)
+        self._entries: Dict[str, Tuple[List[Dict], float]] = {}
+        # Bumped on every invalidation so a scan that raced with a write is discarded
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self._inotify = None
+        self._watch_users: Dict[int, str] = {}  # watch descriptor -> user_id
+        self._watch_paths: Dict[int, Path] = {}
+        if watch:
+            self._start_watcher()
+
+    # =============================================================================
+    # PUBLIC API
+    # =============================================================================
+
+    def get(self, user_id: str) -> List[Dict]:
+        """Return the folder listing for a user, scanning the disk only on a miss."""
+        with self._lock:
+            cached = self._entries.get(user_id)
+            version = self._versions.get(user_id, 0)
+        if cached is not None and (self.ttl is None or time.monotonic() - cached[1] < self.ttl):
+            return cached[0]
+
+        if self.prepare:
+            try:
+                self.prepare(user_id)
+            except Exception as e:
+                logger.warning(f"FolderIndex: prepare hook failed for {user_id}: {e}")
+
+        folders = self._scan(user_id)
+
+        with self._lock:
+            # Only publish if nothing was written while we were scanning
+            if self._versions.get(user_id, 0) == version:
+                self._entries[user_id] = (folders, time.monotonic())
+        self._watch_user(user_id)
+        return folders
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop the cached listing for a single user."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self) -> None:
+        """Drop every cached listing (tests / admin tooling only)."""
+        with self._lock:
+            for user_id in list(self._entries):
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return basic cache statistics for monitoring."""
+        with self._lock:
+            return {
+                'cached_users': len(self._entries),
+                'watched_directories': len(self._watch_paths),
+                'inotify_enabled': int(self._inotify is not None)
+            }
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _scan(self, user_id: str) -> List[Dict]:
+        """Read folder metadata for a user from storage (or straight from disk)."""
+        if self.list_keys is not None:
+            return self._scan_keys(user_id)
+
+        user_dir = Path(self.base_dir) / user_id
+        if not user_dir.exists():
+            return []
+
+        folders = []
+        for folder_path in user_dir.iterdir():
+            if not folder_path.is_dir():
+                continue
+            # Collect .md files (may be empty)
+            files = [
+                {"name": f.name, "label": f.stem.replace('-', ' ').replace('_', ' ').title()}
+                for f in folder_path.glob("*.md")
+            ]
+            folders.append({"name": folder_path.name, "files": files})
+        return folders
+
+    def _scan_keys(self, user_id: str) -> List[Dict]:
+        """Folders and their top-level .md files from the user's storage keys."""
+        prefix = f"{user_id}/"
+        folders: Dict[str, List[Dict]] = {}
+        for key in sorted(self.list_keys(prefix)):
+            parts = key[len(prefix):].split('/')
+            if len(parts) < 2:
+                continue
+            files = folders.setdefault(parts[0], [])
+            if len(parts) == 2 and parts[1].endswith('.md'):
+                stem = parts[1][:-len('.md')]
+                files.append({"name": parts[1], "label": stem.replace('-', ' ').replace('_', ' ').title()})
+        return [{"name": name, "files": files} for name, files in folders.items()]
+
+    # ---------------- inotify (optional) ----------------
+
+    def _start_watcher(self):
+        """Start the background inotify reader if the platform supports it."""
+        if _inotify is None:
+            logger.info("FolderIndex: inotify_simple not installed - relying on write-helper invalidation only")
+            return
+        try:
+            self._inotify = _inotify.INotify()
+        except Exception as e:
+            logger.warning(f"FolderIndex: inotify unavailable: {e}")
+            self._inotify = None
+            return
+
+        flags = _inotify.flags
+        self._watch_mask = (flags.CREATE | flags.DELETE | flags.MOVED_FROM |
+                            flags.MOVED_TO | flags.DELETE_SELF)
+
+        thread = threading.Thread(target=self._watch_loop, name='mentalos-folder-index', daemon=True)
+        thread.start()
+        logger.info("FolderIndex: inotify watcher started")
+
+    def _watch_user(self, user_id: str):
+        """Watch a user's directory and its immediate sub-folders."""
+        if self._inotify is None:
+            return
+        user_dir = Path(self.base_dir) / user_id
+        if not user_dir.is_dir():
+            return
+        with self._lock:
+            watched = set(self._watch_paths.values())
+        targets = [user_dir] + [p for p in user_dir.iterdir() if p.is_dir()]
+        for path in targets:
+            if path in watched:
+                continue
+            try:
+                wd = self._inotify.add_watch(str(path), self._watch_mask)
+            except OSError as e:
+                logger.warning(f"FolderIndex: could not watch {path}: {e}")
+                continue
+            with self._lock:
+                self._watch_users[wd] = user_id
+                self._watch_paths[wd] = path
+
+    def _watch_loop(self):
+        """Translate inotify events into per-user invalidations."""
+        flags = _inotify.flags
+        while True:
+            try:
+                events = self._inotify.read()
+            except Exception as e:
+                logger.error(f"FolderIndex: inotify read failed, watcher stopped: {e}")
+                return
+
+            touched = set()
+            for event in events:
+                with self._lock:
+                    user_id = self._watch_users.get(event.wd)
+                    if event.mask & (flags.DELETE_SELF | flags.IGNORED):
+                        self._watch_users.pop(event.wd, None)
+                        self._watch_paths.pop(event.wd, None)
+                if user_id is not None:
+                    touched.add(user_id)
+
+            for user_id in touched:
+                self.invalidate(user_id)
+                # New sub-folders need their own watch
+                self._watch_user(user_id)
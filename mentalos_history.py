@@ -0,0 +1,307 @@
+"""
+MentalOS History
+================
+
+Append-only revision log for MentalOS files.
+
+Each file has one log (``<user>/<path>.log`` in the history storage) with one
+JSON line per revision. Most revisions store a zlib-compressed line-level
+delta against the previous revision; every SNAPSHOT_INTERVAL revisions a full
+snapshot is written so reconstruction never replays more than a handful of
+deltas.
+
+Several workers or instances may record into the same log. Each cached log
+remembers the storage version it was read at and is revalidated on access;
+new revisions are appended with append_if against that version, so a writer
+that lost a race reloads the log and recomputes its revision number and
+delta instead of writing against a stale base.
+
+Object storage has no native append, so append_if there rewrites the whole
+log. To keep that cost bounded, record() compacts a log automatically once
+it grows past max_log_entries revisions or max_log_bytes bytes, keeping the
+newest auto_compact_keep revisions (fewer if those alone exceed half the
+byte limit).
+
+Delta format (also returned by the "changes since" API):
+    [["=", start, end], ["+", "inserted text"], ...]
+where "=" copies lines [start, end) of the base revision and "+" inserts text.
+"""
+
+import base64
+import difflib
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from mentalos_storage import PreconditionFailed, retry_on_conflict
+
+logger = logging.getLogger(__name__)
+
+
+def compute_delta(old: str, new: str) -> List[list]:
+    """Line-level delta that turns old into new."""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops: List[list] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i1, i2])
+        elif j2 > j1:  # replace / insert
+            ops.append(['+', ''.join(new_lines[j1:j2])])
+        # pure deletes need no op: the old lines are simply not copied
+    return ops
+
+
+def apply_delta(old: str, ops: List[list]) -> str:
+    """Apply a delta produced by compute_delta."""
+    old_lines = old.splitlines(keepends=True)
+    out = []
+    for op in ops:
+        if op[0] == '=':
+            out.extend(old_lines[op[1]:op[2]])
+        else:
+            out.append(op[1])
+    return ''.join(out)
+
+
+def _digest(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def _pack(payload: str) -> str:
+    return base64.b64encode(zlib.compress(payload.encode('utf-8'), 9)).decode('ascii')
+
+
+def _unpack(data: str) -> str:
+    return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
+
+class MentalOSHistory:
+    """
+    Revision logs stored through a MentalOSStorage instance.
+    Parsed logs and head contents are kept in a small LRU (revalidated against the
+    storage version on every access) to make recording cheap.
+    """
+
+    SNAPSHOT_INTERVAL = 20
+
+    def __init__(self, storage, max_cached_logs: int = 512, max_log_entries: int = 200,
+                 max_log_bytes: int = 2 * 1024 * 1024, auto_compact_keep: int = 50):
+        self.storage = storage
+        self.max_cached_logs = max_cached_logs
+        self.max_log_entries = max_log_entries
+        self.max_log_bytes = max_log_bytes
+        self.auto_compact_keep = max(1, min(auto_compact_keep, max_log_entries))
+        # key -> {'entries': [...], 'head': str, 'version': storage version read at,
+        #         'bytes': size of the stored log}
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    # =============================================================================
+    # RECORDING
+    # =============================================================================
+
+    def record(self, user_key: str, path: str, content: str) -> Optional[int]:
+        """Append a revision if content differs from the last one; returns the revision number."""
+        key = self._log_key(user_key, path)
+        with self._lock:
+            rev = self._conditional(key, lambda: self._append_revision(key, content))
+            self._maybe_compact(key)
+            return rev
+
+    # =============================================================================
+    # QUERIES
+    # =============================================================================
+
+    def list_revisions(self, user_key: str, path: str) -> List[Dict]:
+        """Revision metadata, oldest first."""
+        with self._lock:
+            entries = self._load(self._log_key(user_key, path))['entries']
+            return [{k: e[k] for k in ('rev', 'ts', 'kind', 'hash', 'size')} for e in entries]
+
+    def get_revision(self, user_key: str, path: str, rev: int) -> Optional[str]:
+        """Full content of a revision, or None if it does not exist (or was compacted away)."""
+        with self._lock:
+            entries = self._load(self._log_key(user_key, path))['entries']
+            return self._reconstruct(entries, rev)
+
+    def changes_since(self, user_key: str, path: str, since_rev: int) -> Dict:
+        """
+        Delta from since_rev to the head revision. Falls back to the full content
+        when since_rev is unknown (e.g. compacted) so the client can resync.
+        """
+        with self._lock:
+            log = self._load(self._log_key(user_key, path))
+            entries = log['entries']
+            if not entries:
+                return {'head_rev': 0, 'since': since_rev, 'full': None, 'delta': []}
+            head = entries[-1]
+            result = {'head_rev': head['rev'], 'head_hash': head['hash'], 'since': since_rev}
+            if since_rev == head['rev']:
+                result['delta'] = []
+                return result
+            base = self._reconstruct(entries, since_rev)
+            if base is None:
+                result['full'] = log['head']
+                return result
+            result['delta'] = compute_delta(base, log['head'])
+            return result
+
+    # =============================================================================
+    # MAINTENANCE
+    # =============================================================================
+
+    def compact(self, user_key: str, path: str, keep: int = 50) -> int:
+        """
+        Drop all but the newest `keep` revisions. The oldest kept revision becomes a
+        snapshot; revision numbers are preserved. Returns the number of revisions removed.
+        """
+        key = self._log_key(user_key, path)
+        with self._lock:
+            return self._conditional(key, lambda: self._compact(key, keep))
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _log_key(self, user_key: str, path: str) -> str:
+        return f"{user_key.rstrip('/')}/{path.lstrip('/')}.log"
+
+    def _append_revision(self, key: str, content: str) -> int:
+        log = self._load(key)
+        entries = log['entries']
+        digest = _digest(content)
+        if entries and entries[-1]['hash'] == digest:
+            return entries[-1]['rev']
+
+        rev = entries[-1]['rev'] + 1 if entries else 1
+        since_snapshot = self._revisions_since_snapshot(entries)
+        if not entries or since_snapshot >= self.SNAPSHOT_INTERVAL - 1:
+            kind, payload = 'snapshot', content
+        else:
+            kind, payload = 'delta', json.dumps(compute_delta(log['head'], content), separators=(',', ':'))
+
+        entry = {
+            'rev': rev,
+            'ts': datetime.now().isoformat(),
+            'kind': kind,
+            'hash': digest,
+            'size': len(content),
+            'data': _pack(payload)
+        }
+        # Only lands if nobody else appended since the log was read
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        log['version'] = self.storage.append_if(key, line, log['version'])
+        entries.append(entry)
+        log['bytes'] += len(line)
+        log['head'] = content
+        return rev
+
+    def _compact(self, key: str, keep: int) -> int:
+        log = self._load(key)
+        entries = log['entries']
+        if len(entries) <= keep:
+            return 0
+        kept = entries[-keep:]
+        first_content = self._reconstruct(entries, kept[0]['rev'])
+        rebuilt = []
+        prev_content = None
+        for i, entry in enumerate(kept):
+            content = first_content if i == 0 else self._reconstruct(entries, entry['rev'])
+            if i == 0 or self._revisions_since_snapshot(rebuilt) >= self.SNAPSHOT_INTERVAL - 1:
+                kind, payload = 'snapshot', content
+            else:
+                kind, payload = 'delta', json.dumps(compute_delta(prev_content, content), separators=(',', ':'))
+            rebuilt.append(dict(entry, kind=kind, data=_pack(payload)))
+            prev_content = content
+        data = ''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in rebuilt)
+        log['version'] = self.storage.write_if(key, data, log['version'])
+        log['entries'] = rebuilt
+        log['bytes'] = len(data)
+        return len(entries) - len(rebuilt)
+
+    def _maybe_compact(self, key: str) -> None:
+        """Compact a log that went over the entry or byte limit (never fails the record)."""
+        try:
+            log = self._load(key)
+            if len(log['entries']) <= self.max_log_entries and log['bytes'] <= self.max_log_bytes:
+                return
+            removed = self._conditional(key, lambda: self._compact(key, self._auto_keep(key)))
+            logger.info(f"MentalOSHistory: auto-compacted {key}, removed {removed} revisions")
+        except Exception as e:
+            logger.warning(f"MentalOSHistory: auto-compaction of {key} failed: {e}")
+
+    def _auto_keep(self, key: str) -> int:
+        """Newest revisions to keep: auto_compact_keep, trimmed to fit half the byte limit."""
+        entries = self._load(key)['entries']
+        keep, total = 0, 0
+        for entry in reversed(entries[-self.auto_compact_keep:]):
+            total += len(json.dumps(entry, separators=(',', ':'))) + 1
+            if keep and total > self.max_log_bytes // 2:
+                break
+            keep += 1
+        return max(1, keep)
+
+    def _conditional(self, key: str, write):
+        """Run a read-compute-write step; on a concurrent write reload the log and redo it."""
+        def attempt():
+            try:
+                return write()
+            except PreconditionFailed:
+                self._cache.pop(key, None)
+                raise
+        return retry_on_conflict(attempt)
+
+    def _load(self, key: str) -> Dict:
+        """Parsed log, from the LRU while the stored log is still at the cached version."""
+        log = self._cache.get(key)
+        if log is not None and self.storage.version(key) == log['version']:
+            self._cache.move_to_end(key)
+            return log
+
+        entries = []
+        raw, version = self.storage.read_versioned(key)
+        raw = raw or ''
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"MentalOSHistory: skipping corrupt log line in {key}")
+        log = {'entries': entries, 'head': '', 'version': version, 'bytes': len(raw)}
+        if entries:
+            log['head'] = self._reconstruct(entries, entries[-1]['rev']) or ''
+
+        self._cache[key] = log
+        while len(self._cache) > self.max_cached_logs:
+            self._cache.popitem(last=False)
+        return log
+
+    def _reconstruct(self, entries: List[Dict], rev: int) -> Optional[str]:
+        index = next((i for i, e in enumerate(entries) if e['rev'] == rev), None)
+        if index is None:
+            return None
+        start = index
+        while start >= 0 and entries[start]['kind'] != 'snapshot':
+            start -= 1
+        if start < 0:
+            return None
+        content = _unpack(entries[start]['data'])
+        for entry in entries[start + 1:index + 1]:
+            content = apply_delta(content, json.loads(_unpack(entry['data'])))
+        return content
+
+    def _revisions_since_snapshot(self, entries: List[Dict]) -> int:
+        count = 0
+        for entry in reversed(entries):
+            if entry['kind'] == 'snapshot':
+                return count
+            count += 1
+        return count
@@ -0,0 +1,303 @@
+"""
+MentalOS Search
+===============
+
+Per-user BM25 full-text search over MentalOS markdown files.
+
+Each user has a small inverted index (term -> {path: term frequency}) that is
+maintained incrementally by the MentalOS write helpers and persisted as JSON
+through a MentalOS storage (its own namespace, so it lives wherever the notes
+live - local disk or the shared bucket). If a persisted index is missing it is
+rebuilt once from the user's files.
+
+Every worker and instance shares the persisted indexes: a loaded index is
+used only while the stored version is unchanged (otherwise it is reloaded),
+and updates are written with write_if against the version they were applied
+to, retried on conflict, so nobody overwrites another writer's changes.
+Work for one user (loading, rebuilding from all their files) only holds that
+user's lock stripe, never a process-wide lock.
+
+The same ranking is used to pick which files are worth sending to the LLM, so
+prompts only carry the notes relevant to the user's message.
+"""
+
+import json
+import logging
+import math
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from mentalos_storage import retry_on_conflict
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Minimal stopword list - markdown notes are short, so we keep most words
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in', 'into', 'is',
+    'it', 'of', 'on', 'or', 'so', 'that', 'the', 'their', 'then', 'there', 'these', 'this',
+    'to', 'was', 'were', 'will', 'with', 'your', 'you'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords and single characters removed."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOP_WORDS]
+
+
+class UserSearchIndex:
+    """Inverted index and BM25 scorer for a single user's files."""
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+
+    def update_document(self, path: str, text: str):
+        """(Re)index a single document."""
+        self.remove_document(path)
+        counts = Counter(tokenize(text))
+        if not counts:
+            return
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[path] = tf
+        length = sum(counts.values())
+        self.doc_lengths[path] = length
+        self.doc_terms[path] = list(counts)
+        self.total_length += length
+
+    def remove_document(self, path: str):
+        """Drop a document's postings."""
+        for term in self.doc_terms.pop(path, []):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(path, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(path, 0)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Return [{'path', 'score'}] ranked by BM25."""
+        terms = set(tokenize(query))
+        n_docs = len(self.doc_lengths)
+        if not terms or not n_docs:
+            return []
+
+        avg_len = self.total_length / n_docs
+        scores: Dict[str, float] = {}
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for path, tf in docs.items():
+                norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[path] / avg_len)
+                scores[path] = scores.get(path, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{'path': path, 'score': round(score, 4)} for path, score in ranked]
+
+    # ---------------- persistence ----------------
+
+    def to_dict(self) -> Dict:
+        """Compact form: documents listed once, postings reference them by position."""
+        paths = list(self.doc_lengths)
+        position = {path: i for i, path in enumerate(paths)}
+        return {
+            'docs': [[path, self.doc_lengths[path]] for path in paths],
+            'postings': {
+                term: [[position[path], tf] for path, tf in docs.items()]
+                for term, docs in self.postings.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UserSearchIndex':
+        index = cls()
+        paths = [path for path, _ in data.get('docs', [])]
+        for path, length in data.get('docs', []):
+            index.doc_lengths[path] = length
+            index.doc_terms[path] = []
+            index.total_length += length
+        for term, entries in data.get('postings', {}).items():
+            docs = {}
+            for pos, tf in entries:
+                docs[paths[pos]] = tf
+                index.doc_terms[paths[pos]].append(term)
+            index.postings[term] = docs
+        return index
+
+
+class MentalOSSearch:
+    """
+    Manages per-user indexes: lazy load/rebuild, incremental updates from write
+    helpers, persistence and snippet extraction.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, storage, read_file: Callable[[str, str], str],
+                 list_files: Callable[[str], Dict[str, str]], max_loaded_users: int = 256):
+        # storage: MentalOSStorage holding one '<user>.json' index per user
+        self.storage = storage
+        # read_file(user_id, path) -> text ; list_files(user_id) -> {path: text}
+        self.read_file = read_file
+        self.list_files = list_files
+        self.max_loaded_users = max_loaded_users
+        # user_id -> (storage version the index was read at / written as, index)
+        self._indexes: "OrderedDict[str, Tuple[Optional[str], UserSearchIndex]]" = OrderedDict()
+        # Guards _indexes only; per-user work runs under a stripe of _user_locks
+        self._lock = threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+
+    # =============================================================================
+    # WRITE-HELPER HOOKS
+    # =============================================================================
+
+    def on_write(self, user_id: str, path: str, text: str):
+        """Reindex a document from its full new content (after an overwrite or append)."""
+        def apply():
+            version, index = self._load(user_id)
+            if index is None:
+                # No index yet: built from the files, which already include this write
+                self._save(user_id, self._build(user_id), version)
+                return
+            if text:
+                index.update_document(path, text)
+            else:
+                index.remove_document(path)
+            self._save(user_id, index, version)
+
+        with self._user_lock(user_id):
+            try:
+                retry_on_conflict(apply)
+            except Exception as e:
+                # Drop the loaded copy so the next search reloads or rebuilds
+                self._forget(user_id)
+                logger.warning(f"MentalOSSearch: failed to update index for {user_id}: {e}")
+
+    # =============================================================================
+    # QUERIES
+    # =============================================================================
+
+    def search(self, user_id: str, query: str, limit: int = 10, with_snippets: bool = True) -> List[Dict]:
+        """Return ranked results, each with an optional snippet around the first hit."""
+        with self._user_lock(user_id):
+            results = self._get_index(user_id).search(query, limit)
+
+        if with_snippets:
+            terms = set(tokenize(query))
+            for result in results:
+                text = self.read_file(user_id, result['path']) or ''
+                result['snippet'] = extract_snippet(text, terms)
+        return results
+
+    def relevant_paths(self, user_id: str, query: str, limit: int = 3) -> List[str]:
+        """Paths of the files most relevant to a message (used to trim LLM context)."""
+        return [r['path'] for r in self.search(user_id, query, limit=limit, with_snippets=False)]
+
+    def rebuild(self, user_id: str) -> UserSearchIndex:
+        """Rebuild a user's index from their current files."""
+        with self._user_lock(user_id):
+            version = self.storage.version(self._index_key(user_id))
+            index = self._build(user_id)
+            try:
+                self._save(user_id, index, version)
+            except Exception as e:
+                # Another writer stored a newer index meanwhile (or storage failed) - serve ours,
+                # but let the next access reload the stored one
+                self._forget(user_id)
+                logger.info(f"MentalOSSearch: rebuilt index for {user_id} not stored: {e}")
+            return index
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    @staticmethod
+    def _index_key(user_id: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', str(user_id)) or 'anonymous'
+        return f"{safe}.json"
+
+    def _user_lock(self, user_id: str) -> threading.RLock:
+        return self._user_locks[zlib.crc32(str(user_id).encode('utf-8')) % self.LOCK_STRIPES]
+
+    def _build(self, user_id: str) -> UserSearchIndex:
+        index = UserSearchIndex()
+        for path, text in self.list_files(user_id).items():
+            if text and not text.startswith('ERROR: '):
+                index.update_document(path, text)
+        return index
+
+    def _get_index(self, user_id: str) -> UserSearchIndex:
+        """Loaded index while the stored version is unchanged; reloaded or rebuilt otherwise."""
+        try:
+            _, index = self._load(user_id)
+        except Exception as e:
+            logger.warning(f"MentalOSSearch: unreadable index for {user_id}, rebuilding: {e}")
+            index = None
+        return index if index is not None else self.rebuild(user_id)
+
+    def _load(self, user_id: str) -> Tuple[Optional[str], Optional[UserSearchIndex]]:
+        """(version, index) as stored now - from memory when the version matches; (None, None) if missing."""
+        key = self._index_key(user_id)
+        version = self.storage.version(key)
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and version is not None and entry[0] == version:
+                self._indexes.move_to_end(user_id)
+                return entry
+        if version is None:
+            return None, None
+        text, version = self.storage.read_versioned(key)
+        if text is None:
+            return None, None
+        index = UserSearchIndex.from_dict(json.loads(text))
+        self._remember(user_id, version, index)
+        return version, index
+
+    def _save(self, user_id: str, index: UserSearchIndex, version: Optional[str]):
+        """Store the index if the stored copy is still at version (raises PreconditionFailed otherwise)."""
+        data = json.dumps(index.to_dict(), separators=(',', ':'))
+        new_version = self.storage.write_if(self._index_key(user_id), data, version)
+        self._remember(user_id, new_version, index)
+
+    def _remember(self, user_id: str, version: Optional[str], index: UserSearchIndex):
+        with self._lock:
+            self._indexes[user_id] = (version, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_loaded_users:
+                self._indexes.popitem(last=False)
+
+    def _forget(self, user_id: str):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+
+def extract_snippet(text: str, terms: Set[str], width: int = 160) -> str:
+    """Return a single-line window of text around the first query term hit."""
+    if not text:
+        return ''
+    first = None
+    for match in TOKEN_RE.finditer(text):
+        if match.group(0).lower() in terms:
+            first = match.start()
+            break
+    if first is None:
+        first = 0
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    snippet = ' '.join(text[start:end].split())
+    if start > 0:
+        snippet = '…' + snippet
+    if end < len(text):
+        snippet += '…'
+    return snippet
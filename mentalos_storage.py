@@ -0,0 +1,498 @@
+"""
+MentalOS Storage
+================
+
+Storage abstraction for MentalOS user files. Keys are POSIX-style relative
+paths of the form ``<user_dir>/<file path>`` (e.g. ``user_123/voices/anna.md``).
+
+Backends:
+- LocalDiskBackend: files under a local directory (default, single instance)
+- DirectoryObjectBackend: object-storage semantics on a local directory
+  (flat keys, MD5 etags, no native append) - a MinIO-style stand-in for tests
+- GCSObjectBackend: Google Cloud Storage / Firebase Storage bucket
+
+CachedObjectStore wraps an object backend with a local write-through cache.
+Every cached file is tracked by content hash; a read trusts the local copy
+inside a short revalidation window and afterwards compares the remote etag
+before downloading, so unchanged files are never fetched twice.
+
+Concurrent writers (several workers or instances) coordinate through
+conditional writes: every backend reports an opaque version per key (content
+hash on disk, the object generation on GCS) and put_if/append_if only
+apply when the key is still at the version the caller read, raising
+PreconditionFailed otherwise. Object backends have no append; CachedObjectStore
+emulates it with read-modify-write retried on conflict, so concurrent appends
+never drop each other's data.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows - in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CONFLICT_RETRIES = 8
+
+
+class PreconditionFailed(Exception):
+    """A conditional write found the key at a different version than expected."""
+
+
+def retry_on_conflict(operation, retries: int = CONFLICT_RETRIES):
+    """Run operation() again (with jittered backoff) while it raises PreconditionFailed."""
+    for attempt in range(retries):
+        try:
+            return operation()
+        except PreconditionFailed:
+            if attempt == retries - 1:
+                raise
+            time.sleep(random.uniform(0, 0.02 * (2 ** attempt)))
+
+
+def content_hash(data: bytes) -> str:
+    """Hex MD5 of a payload - matches object-storage etags for single-part uploads."""
+    return hashlib.md5(data).hexdigest()
+
+
+def _key_to_path(root: str, key: str) -> str:
+    return os.path.join(root, *key.split('/'))
+
+
+def _data_version(data: Optional[bytes]) -> Optional[str]:
+    # Content hash: unlike size/mtime it cannot collide for two different same-size writes.
+    # Missing and empty files are equivalent: opening a file for locking creates it empty
+    return content_hash(data) if data else None
+
+
+class _LocalFiles:
+    """Files under a local directory: whole-file reads/writes, conditional writes, listing."""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = _key_to_path(self.base_dir, key)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, key: str, data: bytes) -> str:
+        path = _key_to_path(self.base_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return content_hash(data)
+
+    def delete(self, key: str) -> None:
+        path = _key_to_path(self.base_dir, key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def list(self, prefix: str) -> List[str]:
+        root = _key_to_path(self.base_dir, prefix.rstrip('/'))
+        keys = []
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.base_dir)
+                keys.append(rel.replace(os.sep, '/'))
+        return keys
+
+    def etag(self, key: str) -> Optional[str]:
+        data = self.get(key)
+        return content_hash(data) if data is not None else None
+
+    def version(self, key: str) -> Optional[str]:
+        # Read under the lock: a concurrent put_if truncates before it writes
+        return self.get_versioned(key)[1]
+
+    def get_versioned(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        path = _key_to_path(self.base_dir, key)
+        if not os.path.isfile(path):
+            return None, None
+        with self._locked(key) as f:
+            f.seek(0)
+            data = f.read()
+            return (data or None), _data_version(data)
+
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Replace the file only if it is still at version (None: missing or empty)."""
+        with self._locked(key) as f:
+            f.seek(0)
+            if _data_version(f.read()) != version:
+                raise PreconditionFailed(key)
+            f.seek(0)
+            f.truncate()
+            f.write(data)
+            f.flush()
+            return _data_version(data)
+
+    @contextmanager
+    def _locked(self, key: str):
+        """Open a file read/write under an exclusive lock (threads, and processes via flock)."""
+        path = _key_to_path(self.base_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock, open(path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class LocalDiskBackend(_LocalFiles):
+    """Plain files on local disk."""
+
+    supports_append = True
+
+    def append(self, key: str, data: bytes) -> None:
+        path = _key_to_path(self.base_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    def append_if(self, key: str, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Append only if the file is still at version (None: missing or empty)."""
+        with self._locked(key) as f:
+            f.seek(0)
+            existing = f.read()
+            if _data_version(existing) != version:
+                raise PreconditionFailed(key)
+            f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            return _data_version(existing + data)
+
+
+class DirectoryObjectBackend(_LocalFiles):
+    """
+    Object-storage stand-in on a local directory: whole-object writes only (no
+    append), content-hash etags. Used for tests and local multi-process setups.
+    """
+
+    supports_append = False
+
+
+class GCSObjectBackend:
+    """Google Cloud Storage bucket (e.g. the Firebase Storage bucket)."""
+
+    supports_append = False
+
+    def __init__(self, bucket, prefix: str = 'mentalos'):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _name(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str) -> Optional[bytes]:
+        blob = self.bucket.blob(self._name(key))
+        try:
+            return blob.download_as_bytes()
+        except Exception as e:
+            if getattr(e, 'code', None) == 404 or type(e).__name__ == 'NotFound':
+                return None
+            raise
+
+    def put(self, key: str, data: bytes) -> str:
+        blob = self.bucket.blob(self._name(key))
+        blob.upload_from_string(data, content_type='text/markdown; charset=utf-8')
+        return content_hash(data)
+
+    def delete(self, key: str) -> None:
+        blob = self.bucket.blob(self._name(key))
+        try:
+            blob.delete()
+        except Exception as e:
+            logger.warning(f"GCSObjectBackend: delete failed for {key}: {e}")
+
+    def list(self, prefix: str) -> List[str]:
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        return [blob.name[strip:] for blob in self.bucket.list_blobs(prefix=self._name(prefix))]
+
+    def etag(self, key: str) -> Optional[str]:
+        blob = self.bucket.get_blob(self._name(key))
+        if blob is None or not blob.md5_hash:
+            return None
+        return base64.b64decode(blob.md5_hash).hex()
+
+    def version(self, key: str) -> Optional[str]:
+        blob = self.bucket.get_blob(self._name(key))
+        return str(blob.generation) if blob is not None else None
+
+    def get_versioned(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        blob = self.bucket.get_blob(self._name(key))
+        if blob is None:
+            return None, None
+        try:
+            data = blob.download_as_bytes(if_generation_match=blob.generation)
+        except Exception as e:
+            if self._is_conflict(e):
+                raise PreconditionFailed(key) from e
+            raise
+        return data, str(blob.generation)
+
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Upload only if the object is still at generation version (None: must not exist)."""
+        blob = self.bucket.blob(self._name(key))
+        try:
+            blob.upload_from_string(data, content_type='text/markdown; charset=utf-8',
+                                    if_generation_match=int(version) if version else 0)
+        except Exception as e:
+            if self._is_conflict(e):
+                raise PreconditionFailed(key) from e
+            raise
+        return str(blob.generation) if blob.generation is not None else self.version(key)
+
+    @staticmethod
+    def _is_conflict(error: Exception) -> bool:
+        # 412 Precondition Failed (generation mismatch); 404 when the object vanished
+        return getattr(error, 'code', None) in (404, 412) or type(error).__name__ in ('PreconditionFailed', 'NotFound')
+
+
+class CachedObjectStore:
+    """
+    Write-through local cache in front of an object backend.
+    Exposes the same get/put/append/delete/list interface as the backends; append
+    is emulated (read-modify-write, conditional) when the remote has none.
+    """
+
+    supports_append = True
+
+    def __init__(self, remote, cache_dir: str, revalidate_after: float = 5.0):
+        self.remote = remote
+        self.local = LocalDiskBackend(cache_dir)
+        self.revalidate_after = revalidate_after
+        # key -> (content hash of local copy, monotonic time last validated)
+        self._hashes: Dict[str, Tuple[str, float]] = {}
+        # key -> remote version the local copy was read or written at
+        self._versions: Dict[str, str] = {}
+        self._listings: Dict[str, Tuple[List[str], float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'revalidated': 0, 'downloads': 0}
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._hashes.get(key)
+        if entry and now - entry[1] < self.revalidate_after:
+            data = self.local.get(key)
+            if data is not None:
+                self.stats['hits'] += 1
+                return data
+
+        remote_tag = self.remote.etag(key)
+        if remote_tag is None:
+            self._forget(key)
+            self.local.delete(key)
+            return None
+
+        local_data = self.local.get(key)
+        local_tag = entry[0] if entry else (content_hash(local_data) if local_data is not None else None)
+        if local_data is not None and local_tag == remote_tag:
+            self._remember(key, local_tag)
+            self.stats['revalidated'] += 1
+            return local_data
+
+        data = self.remote.get(key)
+        if data is None:
+            self._forget(key)
+            return None
+        self.local.put(key, data)
+        self._remember(key, content_hash(data))
+        self.stats['downloads'] += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> str:
+        tag = self.remote.put(key, data)
+        self.local.put(key, data)
+        self._remember(key, tag)
+        self._invalidate_listings(key)
+        return tag
+
+    def append(self, key: str, data: bytes) -> None:
+        """Append, emulated by a conditional read-modify-write retried until no other writer got in between."""
+        retry_on_conflict(lambda: self.append_if(key, data, self.remote.version(key)))
+
+    def version(self, key: str) -> Optional[str]:
+        return self.remote.version(key)
+
+    def get_versioned(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        data, version = self.remote.get_versioned(key)
+        if data is None:
+            self._forget(key)
+            self.local.delete(key)
+            return None, None
+        self.local.put(key, data)
+        self._remember(key, content_hash(data), version)
+        self.stats['downloads'] += 1
+        return data, version
+
+    def put_if(self, key: str, data: bytes, version: Optional[str]) -> Optional[str]:
+        new_version = self.remote.put_if(key, data, version)
+        self.local.put(key, data)
+        self._remember(key, content_hash(data), new_version)
+        self._invalidate_listings(key)
+        return new_version
+
+    def append_if(self, key: str, data: bytes, version: Optional[str]) -> Optional[str]:
+        """Append if the remote object is still at version; the local copy is reused when current."""
+        if getattr(self.remote, 'supports_append', False):
+            new_version = self.remote.append_if(key, data, version)
+            self.local.delete(key)
+            self._forget(key)
+            self._invalidate_listings(key)
+            return new_version
+        existing = None
+        if version is not None:
+            with self._lock:
+                cached_version = self._versions.get(key)
+            if cached_version == version:
+                existing = self.local.get(key)
+                if existing is not None:
+                    self.stats['hits'] += 1
+            if existing is None:
+                existing, current = self.get_versioned(key)
+                if current != version:
+                    raise PreconditionFailed(key)
+        return self.put_if(key, (existing or b'') + data, version)
+
+    def delete(self, key: str) -> None:
+        self.remote.delete(key)
+        self.local.delete(key)
+        self._forget(key)
+        self._invalidate_listings(key)
+
+    def list(self, prefix: str) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._listings.get(prefix)
+        if cached and now - cached[1] < self.revalidate_after:
+            return list(cached[0])
+        keys = self.remote.list(prefix)
+        with self._lock:
+            self._listings[prefix] = (keys, now)
+        return list(keys)
+
+    def etag(self, key: str) -> Optional[str]:
+        return self.remote.etag(key)
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _remember(self, key: str, tag: str, version: Optional[str] = None):
+        with self._lock:
+            self._hashes[key] = (tag, time.monotonic())
+            if version is not None:
+                self._versions[key] = version
+            else:
+                self._versions.pop(key, None)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._hashes.pop(key, None)
+            self._versions.pop(key, None)
+
+    def _invalidate_listings(self, key: str):
+        with self._lock:
+            for prefix in [p for p in self._listings if key.startswith(p)]:
+                self._listings.pop(prefix, None)
+
+
+class MentalOSStorage:
+    """Text-level facade used by the MentalOS file helpers."""
+
+    def __init__(self, backend):
+        if not getattr(backend, 'supports_append', False):
+            raise ValueError(f"{type(backend).__name__} has no append - wrap object backends in CachedObjectStore")
+        self.backend = backend
+
+    @property
+    def shared(self) -> bool:
+        """True when other instances write to the same store (object storage behind a cache)."""
+        return isinstance(self.backend, CachedObjectStore)
+
+    def read_text(self, key: str) -> Optional[str]:
+        data = self.backend.get(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def write_text(self, key: str, text: str) -> None:
+        self.backend.put(key, text.encode('utf-8'))
+
+    def create_text(self, key: str, text: str) -> bool:
+        """Write a file only if it does not exist yet; False if it already did."""
+        try:
+            self.backend.put_if(key, text.encode('utf-8'), None)
+            return True
+        except PreconditionFailed:
+            return False
+
+    def append_text(self, key: str, text: str) -> None:
+        self.backend.append(key, text.encode('utf-8'))
+
+    # ---------------- conditional access (optimistic concurrency) ----------------
+
+    def version(self, key: str) -> Optional[str]:
+        """Opaque version of a key (None if it does not exist); changes on every write."""
+        return self.backend.version(key)
+
+    def read_versioned(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        data, version = self.backend.get_versioned(key)
+        return (data.decode('utf-8') if data is not None else None), version
+
+    def write_if(self, key: str, text: str, version: Optional[str]) -> Optional[str]:
+        """Replace a key still at version; raises PreconditionFailed otherwise. Returns the new version."""
+        return self.backend.put_if(key, text.encode('utf-8'), version)
+
+    def append_if(self, key: str, text: str, version: Optional[str]) -> Optional[str]:
+        """Append to a key still at version; raises PreconditionFailed otherwise. Returns the new version."""
+        return self.backend.append_if(key, text.encode('utf-8'), version)
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(key)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        return self.backend.list(prefix)
+
+
+def create_storage(base_dir: str, bucket=None, namespace: str = '') -> MentalOSStorage:
+    """
+    Build the storage configured by MENTALOS_STORAGE_BACKEND:
+    'local' (default), 'dir' (MENTALOS_OBJECT_DIR stand-in) or 'gcs' (Firebase bucket).
+    Object backends use base_dir as their local cache directory; `namespace` keeps
+    auxiliary data (e.g. history logs) apart from user files in the shared store.
+    """
+    kind = os.getenv('MENTALOS_STORAGE_BACKEND', 'local').lower()
+    revalidate = float(os.getenv('MENTALOS_STORAGE_REVALIDATE_SECONDS', '5'))
+
+    if kind == 'gcs' and bucket is not None:
+        prefix = os.getenv('MENTALOS_STORAGE_PREFIX', 'mentalos')
+        remote = GCSObjectBackend(bucket, prefix=f"{prefix}-{namespace}" if namespace else prefix)
+        logger.info("MentalOS storage: GCS bucket with local write-through cache")
+        return MentalOSStorage(CachedObjectStore(remote, base_dir, revalidate_after=revalidate))
+    if kind == 'dir':
+        object_dir = os.getenv('MENTALOS_OBJECT_DIR', os.path.join('MentalOS', 'object_store'))
+        if namespace:
+            object_dir = os.path.join(object_dir, f"_{namespace}")
+        logger.info(f"MentalOS storage: directory object store at {object_dir} with local cache")
+        return MentalOSStorage(CachedObjectStore(DirectoryObjectBackend(object_dir), base_dir,
+                                                 revalidate_after=revalidate))
+    if kind == 'gcs':
+        logger.warning("MentalOS storage: GCS requested but no bucket available - using local disk")
+    return MentalOSStorage(LocalDiskBackend(base_dir))
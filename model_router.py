@@ -0,0 +1,197 @@
+"""
+Model Router
+============
+
+Per-task model selection with latency/error tracking and SLO fallback.
+
+Each route (e.g. one per content format) names a primary model, its token
+budget and temperature, a latency SLO and an optional faster fallback model.
+The router records the latency and outcome of every call per route and model
+over a sliding window (at most `window` samples, none older than
+max_age_seconds) and:
+- sends traffic to the fallback model while the primary's p95 latency on that
+  route exceeds the route's SLO or its error rate exceeds max_error_rate
+- keeps probing the primary with one call in probe_every; a probe that succeeds
+  within the SLO clears the primary's window, so the route recovers at once
+  (and otherwise as soon as the slow samples age out)
+- retries a failed primary call once on the fallback model
+
+Routes come from code defaults, optionally overridden per key by a JSON file
+({"x": {"max_tokens": 80}, "article": {"model": "gpt-4o-mini"}}).
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def load_route_overrides(path: Optional[str]) -> Dict[str, Dict]:
+    """Route overrides from a JSON file; empty if no path is configured or the file is unreadable."""
+    if not path:
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        logger.info(f"ModelRouter: loaded route overrides for {len(overrides)} keys from {path}")
+        return overrides
+    except Exception as e:
+        logger.warning(f"ModelRouter: could not load route overrides from {path}: {e}")
+        return {}
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ModelStats:
+    """Sliding window of (time, latency ms, outcome) samples for one model on one route."""
+
+    def __init__(self, window: int, max_age_seconds: float):
+        self.samples = deque(maxlen=window)
+        self.max_age_seconds = max_age_seconds
+        self.total_calls = 0
+        self.total_errors = 0
+
+    def record(self, latency_ms: float, success: bool):
+        self.samples.append((time.monotonic(), latency_ms, success))
+        self.total_calls += 1
+        if not success:
+            self.total_errors += 1
+
+    def reset(self):
+        self.samples.clear()
+
+    def expire(self):
+        cutoff = time.monotonic() - self.max_age_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def summary(self) -> Dict[str, Any]:
+        self.expire()
+        ordered = sorted(latency for _, latency, _ in self.samples)
+        samples = len(self.samples)
+        errors = sum(1 for _, _, success in self.samples if not success)
+        return {
+            'samples': samples,
+            'p50_ms': round(_percentile(ordered, 0.50), 1),
+            'p95_ms': round(_percentile(ordered, 0.95), 1),
+            'error_rate': round(errors / samples, 3) if samples else 0.0,
+            'total_calls': self.total_calls,
+            'total_errors': self.total_errors
+        }
+
+
+class ModelRouter:
+    """Picks model, max_tokens and temperature per route key and falls back when a model misses its SLO."""
+
+    def __init__(self, routes: Dict[str, Dict], default_route: Dict,
+                 overrides: Optional[Dict[str, Dict]] = None, window: int = 200,
+                 min_samples: int = 20, max_error_rate: float = 0.25, probe_every: int = 10,
+                 max_age_seconds: float = 300):
+        self.default_route = dict(default_route)
+        self.routes = {key: {**self.default_route, **route} for key, route in routes.items()}
+        for key, override in (overrides or {}).items():
+            self.routes[key] = {**self.routes.get(key, self.default_route), **override}
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.probe_every = probe_every
+        self.max_age_seconds = max_age_seconds
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._breached_calls: Dict[str, int] = {}
+        self._fallback_counts: Dict[str, int] = {}
+        self._probe_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def route(self, key: str) -> Dict[str, Any]:
+        """Resolved route for a key: model, max_tokens, temperature, fallback_model, degraded, probe."""
+        route = dict(self.routes.get(key, self.default_route))
+        route['key'] = key
+        route['degraded'] = False
+        route['probe'] = False
+        fallback = route.get('fallback_model')
+        if fallback and fallback != route['model'] and self._breached(key, route['model'], route.get('latency_slo_ms')):
+            with self._lock:
+                count = self._breached_calls.get(key, 0) + 1
+                self._breached_calls[key] = count
+                counts = self._fallback_counts if count % self.probe_every else self._probe_counts
+                counts[key] = counts.get(key, 0) + 1
+            if count % self.probe_every:
+                route['primary_model'] = route['model']
+                route['model'] = fallback
+                route['degraded'] = True
+            else:
+                route['probe'] = True
+        return route
+
+    def call(self, route: Dict[str, Any], request: Callable[[Dict[str, Any]], Any]) -> Any:
+        """
+        Run request(route) and record its latency under the route and route['model']. A failure
+        on a model that has a different fallback is retried once on the fallback.
+        """
+        try:
+            return self._timed(route, request)
+        except Exception as e:
+            fallback = route.get('fallback_model')
+            if not fallback or fallback == route['model']:
+                raise
+            logger.warning(f"ModelRouter: {route['model']} failed for {route.get('key')} ({e}) - retrying on {fallback}")
+            retry = dict(route, model=fallback, degraded=True, probe=False, primary_model=route['model'])
+            return self._timed(retry, request)
+
+    def record(self, route: Dict[str, Any], latency_ms: float, success: bool):
+        """Record one call made on a resolved route; a probe that met the SLO clears the primary's window."""
+        key = (route.get('key') or '', route['model'])
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = ModelStats(self.window, self.max_age_seconds)
+            slo = route.get('latency_slo_ms')
+            if route.get('probe') and success and (not slo or latency_ms <= slo):
+                logger.info(f"ModelRouter: probe of {route['model']} for {key[0]} met the SLO - route recovered")
+                stats.reset()
+            stats.record(latency_ms, success)
+
+    def stats(self) -> Dict[str, Any]:
+        """Observed p50/p95 latency and error rate per route and model, and SLO fallback/probe counts per route."""
+        with self._lock:
+            routes: Dict[str, Dict[str, Any]] = {}
+            for (key, model), stats in self._stats.items():
+                routes.setdefault(key, {})[model] = stats.summary()
+            fallbacks = dict(self._fallback_counts)
+            probes = dict(self._probe_counts)
+        return {'routes': routes, 'fallback_routes': fallbacks, 'probe_routes': probes}
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _timed(self, route: Dict[str, Any], request: Callable[[Dict[str, Any]], Any]) -> Any:
+        started = time.monotonic()
+        try:
+            result = request(route)
+        except Exception:
+            self.record(route, (time.monotonic() - started) * 1000, False)
+            raise
+        self.record(route, (time.monotonic() - started) * 1000, True)
+        return result
+
+    def _breached(self, key: str, model: str, latency_slo_ms: Optional[float]) -> bool:
+        with self._lock:
+            stats = self._stats.get((key, model))
+            if stats is None:
+                return False
+            summary = stats.summary()
+            if summary['samples'] < self.min_samples:
+                return False
+        if summary['error_rate'] > self.max_error_rate:
+            return True
+        return bool(latency_slo_ms) and summary['p95_ms'] > latency_slo_ms
@@ -1,6 +1,15 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
 from markdown_it import MarkdownIt
 
-md = MarkdownIt()
+# Single parser for all MentalOS patching (GFM tables enabled)
+md = MarkdownIt('commonmark').enable('table')
+
+PLACEHOLDER_RE = re.compile(r"\[[^\[\]\n]+\](?!\()")
+
 
 def replace_placeholder(markdown_text: str, placeholder: str, value: str) -> str:
     """Replace the FIRST occurrence of placeholder string with value.
@@ -18,4 +27,157 @@ def replace_placeholder(markdown_text: str, placeholder: str, value: str) -> str
     for var in variants:
         if var in markdown_text:
             return markdown_text.replace(var, safe_value, 1)
-    return markdown_text  # no variant found 
\ No newline at end of file
+    return markdown_text  # no variant found
+
+
+class MarkdownStructure:
+    """Heading tree, tables and placeholders of one markdown text, with character offsets.
+
+    sections: [{'title', 'level', 'start', 'body_start', 'end', 'children': [idx, ...], 'parent'}]
+        start = heading line start, body_start = first char after the heading,
+        end = start of the next heading of the same or higher level (or EOF).
+    tables: [{'start', 'end', 'rows': [[{'text', 'start', 'end'}, ...], ...]}]
+        row 0 is the header row; cell offsets cover the trimmed cell text.
+    placeholders: [{'text', 'start', 'end'}]
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.line_offsets = self._line_offsets(text)
+        self.sections = []
+        self.tables = []
+        self.placeholders = [
+            {'text': m.group(0), 'start': m.start(), 'end': m.end()}
+            for m in PLACEHOLDER_RE.finditer(text)
+        ]
+        self._parse(md.parse(text))
+
+    def find_section(self, title: str):
+        """First section whose heading matches title (case-insensitive), or None."""
+        wanted = title.strip().lower()
+        for section in self.sections:
+            if section['title'].lower() == wanted:
+                return section
+        return None
+
+    # ---------------- parsing ----------------
+
+    @staticmethod
+    def _line_offsets(text: str):
+        offsets = [0]
+        for i, ch in enumerate(text):
+            if ch == '\n':
+                offsets.append(i + 1)
+        offsets.append(len(text))
+        return offsets
+
+    def _offset(self, line: int) -> int:
+        return self.line_offsets[min(line, len(self.line_offsets) - 1)]
+
+    def _parse(self, tokens):
+        stack = []  # indexes of open sections
+        table = None
+        row = None
+        for i, token in enumerate(tokens):
+            if token.type == 'heading_open' and token.map:
+                level = int(token.tag[1])
+                start = self._offset(token.map[0])
+                while stack and self.sections[stack[-1]]['level'] >= level:
+                    self.sections[stack.pop()]['end'] = start
+                section = {
+                    'title': tokens[i + 1].content.strip(),
+                    'level': level,
+                    'start': start,
+                    'body_start': self._offset(token.map[1]),
+                    'end': len(self.text),
+                    'children': [],
+                    'parent': stack[-1] if stack else None
+                }
+                self.sections.append(section)
+                if stack:
+                    self.sections[stack[-1]]['children'].append(len(self.sections) - 1)
+                stack.append(len(self.sections) - 1)
+            elif token.type == 'table_open' and token.map:
+                table = {'start': self._offset(token.map[0]), 'end': self._offset(token.map[1]), 'rows': []}
+                self.tables.append(table)
+            elif token.type == 'table_close':
+                table = None
+            elif token.type == 'tr_open' and table is not None and token.map:
+                row = self._split_row(token.map[0])
+                table['rows'].append(row)
+
+    def _split_row(self, line: int):
+        """Cells of a table row with offsets of their trimmed text (escaped pipes respected)."""
+        line_start = self._offset(line)
+        line_end = self._offset(line + 1)
+        raw = self.text[line_start:line_end].rstrip('\n')
+        bounds = [i for i, ch in enumerate(raw) if ch == '|' and (i == 0 or raw[i - 1] != '\\')]
+        if not raw.lstrip().startswith('|'):
+            bounds.insert(0, -1)
+        if not raw.rstrip().endswith('|') or raw.rstrip().endswith('\\|'):
+            bounds.append(len(raw))
+        cells = []
+        for left, right in zip(bounds, bounds[1:]):
+            segment = raw[left + 1:right]
+            stripped = segment.strip()
+            offset = line_start + left + 1 + (len(segment) - len(segment.lstrip()))
+            cells.append({'text': stripped, 'start': offset, 'end': offset + len(stripped)})
+        return cells
+
+
+class StructureCache:
+    """LRU of MarkdownStructure keyed by (path, content hash) - parse once per file version."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, text: str) -> MarkdownStructure:
+        key = (path, hashlib.md5(text.encode('utf-8')).hexdigest())
+        with self._lock:
+            structure = self._entries.get(key)
+            if structure is not None:
+                self._entries.move_to_end(key)
+                return structure
+        structure = MarkdownStructure(text)
+        with self._lock:
+            self._entries[key] = structure
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return structure
+
+
+structure_cache = StructureCache()
+
+
+def replace_section(markdown_text: str, title: str, body: str, structure: MarkdownStructure = None,
+                    append_level: int = 2) -> str:
+    """Replace the body under heading `title` (up to the next same/higher-level heading).
+    Appends a new heading + body at the end when the section does not exist.
+    """
+    structure = structure or MarkdownStructure(markdown_text)
+    section = structure.find_section(title)
+    body = body.rstrip('\n') + '\n'
+    if section is None:
+        prefix = markdown_text if markdown_text.endswith('\n') or not markdown_text else markdown_text + '\n'
+        return f"{prefix}{'#' * append_level} {title}\n{body}"
+
+    # Body ends where the next same/higher-level heading begins (children are replaced too)
+    body_start = section['body_start']
+    head = markdown_text[:body_start]
+    if not head.endswith('\n'):
+        head += '\n'
+    return head + body + markdown_text[section['end']:]
+
+
+def replace_table_cell(markdown_text: str, table_index: int, row: int, col: int, value: str,
+                       structure: MarkdownStructure = None) -> str:
+    """Replace one table cell's text by offset. Returns the original text if the cell does not exist."""
+    structure = structure or MarkdownStructure(markdown_text)
+    try:
+        cell = structure.tables[table_index]['rows'][row][col]
+    except IndexError:
+        return markdown_text
+    safe_value = value.replace("|", "\\|").replace("\n", " ").strip()
+    return markdown_text[:cell['start']] + safe_value + markdown_text[cell['end']:]
@@ -7,18 +7,117 @@ Tracks user patterns, preferences, and context intelligently using a hybrid appr
 - AI-powered for deep insights and behavioral analysis
 
 Cost-conscious: Uses AI strategically for insights, not every operation.
+
+Profiles are read through a short-TTL in-process cache (misses included) and
+kept current by write-through on every profile update, so the several profile
+lookups of one request - and of back-to-back requests - cost one Firestore read.
+A profile document is only created by the first write that needs it.
+
+The profile also carries a buffer of the last RECENT_INTERACTIONS_SIZE
+interactions (keyed by interaction id, so concurrent writers never collide;
+each write deletes the overflow it can see and reads keep the newest N), so
+recent history is one document read; raw interaction documents are rolled up
+into daily aggregates by roll_up_interactions().
+
+AI-refined context questions depend only on (completeness bucket, topic,
+engagement level); they are cached in memory with a TTL and persisted to a
+shared question bank that is loaded at startup; the same warm-up thread then
+precomputes the DEFAULT_QUESTION_TOPICS entries the bank still lacks, so the
+LLM runs only for uncommon topics.
 """
 
+import copy
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from typing import Dict, List, Optional, Any, Union
 from datetime import datetime, timedelta
 import json
 import openai
 import os
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from lexicon_engine import lexicon, tokenize_words
+from text_analysis import AnalyzedText, analyze
+from insight_freshness import FreshnessPolicy, make_watermark
+
+try:
+    from firebase_admin import firestore
+except ImportError:
+    firestore = None
 
 logger = logging.getLogger(__name__)
 
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', '60'))
+PROFILE_CACHE_MAX_ENTRIES = 4096
+
+RECENT_INTERACTIONS_SIZE = int(os.getenv('RECENT_INTERACTIONS_SIZE', '20'))
+RECENT_MESSAGE_MAX_CHARS = 1000
+INTERACTION_RETENTION_DAYS = int(os.getenv('INTERACTION_RETENTION_DAYS', '30'))
+# Each rolled-up interaction costs a delete plus at most one day-aggregate write (batch limit 500)
+ROLLUP_CHUNK_SIZE = 200
+
+QUESTION_BANK_COLLECTION = 'question_bank'
+QUESTION_CACHE_TTL_SECONDS = float(os.getenv('QUESTION_CACHE_TTL_HOURS', '168')) * 3600
+QUESTION_CACHE_MAX_ENTRIES = 2048
+MAX_TOPIC_WORDS = 8
+
+# Rules-based question templates per profile completeness bucket
+BASE_QUESTIONS = {
+    # New user - basic exploration
+    'new': [
+        "What's been on your mind lately?",
+        "Is there something you've been wanting to talk about?",
+        "What kind of experiences tend to stick with you?"
+    ],
+    # Some context - deeper exploration
+    'developing': [
+        "That sounds meaningful. What was going through your mind during that?",
+        "How did that experience change how you see things?",
+        "What patterns do you notice in situations like this?"
+    ],
+    # Rich context - nuanced follow-ups
+    'rich': [
+        "Given what you've shared before, how does this connect to your other experiences?",
+        "What would your past self think about this situation?",
+        "What insight does this give you about yourself?"
+    ]
+}
+
+# Topics precompute_question_bank() fills in ahead of demand (run by the startup warm-up
+# thread unless QUESTION_BANK_PRECOMPUTE=0; it only generates entries the bank lacks)
+QUESTION_BANK_PRECOMPUTE = os.getenv('QUESTION_BANK_PRECOMPUTE', '1') != '0'
+DEFAULT_QUESTION_TOPICS = [
+    'family', 'work', 'career', 'relationships', 'friendship', 'childhood',
+    'health', 'travel', 'loss', 'personal growth', 'creativity', 'change'
+]
+
+
+def completeness_bucket(completeness: float) -> str:
+    """Question template bucket for a profile completeness score"""
+    if completeness < 0.3:
+        return 'new'
+    if completeness < 0.6:
+        return 'developing'
+    return 'rich'
+
+
+def normalize_topic(topic: str) -> str:
+    """Canonical form of a conversation topic for question cache keys"""
+    return ' '.join(tokenize_words(topic or '')[:MAX_TOPIC_WORDS])
+
+
+def _merge_fields(target: Dict, fields: Dict):
+    """Merge (copies of) fields into target, descending into nested maps like a Firestore merge write"""
+    for key, value in fields.items():
+        if firestore is not None and value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_fields(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
 class PersonalContextMapper:
     """
     Hybrid AI/rules engine for understanding user context and patterns.
@@ -39,17 +138,57 @@ class PersonalContextMapper:
                 logger.warning("PersonalContextMapper: No OpenAI - using rules-only approach")
         except Exception as e:
             logger.warning(f"PersonalContextMapper: OpenAI initialization failed: {e}")
+        
+        # Keyword tables for rules-based tracking
+        self.emotion_words = {
+            'positive': ['happy', 'joy', 'excited', 'love', 'amazing', 'wonderful', 'great', 'fantastic'],
+            'negative': ['sad', 'angry', 'frustrated', 'disappointed', 'hurt', 'pain', 'difficult', 'struggle'],
+            'neutral': ['think', 'feel', 'believe', 'wonder', 'consider', 'reflect']
+        }
+        self.time_patterns = [
+            'yesterday', 'today', 'tomorrow', 'last week', 'next week',
+            'recently', 'lately', 'soon', 'earlier', 'later',
+            'when i was', 'years ago', 'months ago', 'back then'
+        ]
+        self.relationship_words = [
+            'family', 'friend', 'partner', 'spouse', 'mother', 'father',
+            'brother', 'sister', 'colleague', 'boss', 'team', 'relationship'
+        ]
+        
+        # Deep insights are regenerated only when new interactions arrive (or max-age passes)
+        self.insights_freshness = FreshnessPolicy('deep_user_insights')
+        
+        # user_id -> (expires_at, stored profile or None if the user has no profile yet)
+        self._profile_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._profile_cache_lock = threading.Lock()
+        self.profile_cache_ttl = PROFILE_CACHE_TTL_SECONDS
+        self.profile_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+        
+        # (bucket, topic, engagement) -> (expires_at, refined questions)
+        self._question_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._question_cache_lock = threading.Lock()
+        self.question_cache_stats = {'hits': 0, 'misses': 0, 'warmed': 0}
+        if self.db and self.openai_client:
+            threading.Thread(target=self._warm_up_questions, name='question-bank-warmup', daemon=True).start()
+        
+        # Compile keyword tables into the shared lexicon (one pass per text for all analyzers)
+        lexicon.register('context.emotions', self.emotion_words)
+        lexicon.register('context.time', self.time_patterns)
+        lexicon.register('context.relationships', self.relationship_words)
     
     # =============================================================================
     # RULES-BASED CONTEXT TRACKING (Fast, cost-effective)
     # =============================================================================
     
-    def track_basic_interaction(self, user_id: str, message: str, message_type: str = "user"):
+    def track_basic_interaction(self, user_id: str, message: Union[str, AnalyzedText], message_type: str = "user"):
         """Track basic user interactions using rules-based approach"""
         if not self.db:
             return
         
         try:
+            analyzed = analyze(message)
+            message = analyzed.text
+            
             # Basic pattern tracking
             interaction_data = {
                 'user_id': user_id,
@@ -57,19 +196,44 @@ class PersonalContextMapper:
                 'message_type': message_type,
                 'timestamp': datetime.now().isoformat(),
                 'message_length': len(message),
-                'word_count': len(message.split()),
-                'contains_emotion_words': self._detect_emotion_words(message),
-                'contains_time_references': self._detect_time_references(message),
-                'contains_relationship_words': self._detect_relationship_words(message),
+                'word_count': analyzed.word_count,
+                'contains_emotion_words': self._detect_emotion_words(analyzed),
+                'contains_time_references': self._detect_time_references(analyzed),
+                'contains_relationship_words': self._detect_relationship_words(analyzed),
                 'question_count': message.count('?'),
                 'exclamation_count': message.count('!')
             }
             
-            # Store in user context collection
-            self.db.collection('user_contexts').document(user_id).collection('interactions').add(interaction_data)
+            # Store the interaction and bump the profile counters in one atomic batch
+            interaction_ref = (self.db.collection('user_contexts').document(user_id)
+                               .collection('interactions').document())
+            profile_ref = self.db.collection('user_profiles').document(user_id)
+            
+            # Buffer entries are keyed by interaction id, so concurrent turns and workers never
+            # overwrite each other; the oldest entries visible here are trimmed in the same write
+            stored = self._load_profile(user_id) or {}
+            buffer = stored.get('recent_interactions') or {}
+            overflow = sorted(buffer, key=lambda key: buffer[key].get('timestamp') or '')
+            overflow = overflow[:max(0, len(buffer) - RECENT_INTERACTIONS_SIZE + 1)]
+            recent = {'recent_interactions': {
+                interaction_ref.id: self._recent_interaction_entry(interaction_data),
+                **{key: firestore.DELETE_FIELD for key in overflow}
+            }}
+            
+            deltas = self._profile_counter_deltas(interaction_data)
+            profile_updates = self._profile_counter_updates(user_id, interaction_data, deltas)
+            profile_updates.update(recent)
             
-            # Update user profile summary
-            self._update_user_profile_summary(user_id, interaction_data)
+            batch = self.db.batch()
+            batch.set(interaction_ref, interaction_data)
+            batch.set(profile_ref, profile_updates, merge=True)
+            batch.commit()
+            
+            self._write_through_profile(
+                user_id,
+                fields={'user_id': user_id, 'last_interaction': interaction_data['timestamp'], **recent},
+                increments=deltas
+            )
             
         except Exception as e:
             logger.error(f"Error tracking interaction for user {user_id}: {e}")
@@ -80,19 +244,16 @@ class PersonalContextMapper:
             return self._get_default_context_profile()
         
         try:
-            # Get cached profile
-            profile_doc = self.db.collection('user_profiles').document(user_id).get()
+            stored = self._load_profile(user_id)
             
-            if profile_doc.exists:
-                profile = profile_doc.to_dict()
-                
-                # Add real-time completeness calculation
-                profile['completeness'] = self._calculate_profile_completeness(profile)
+            if stored is not None:
+                stored.pop('recent_interactions', None)
+                profile = self._with_derived_fields(stored)
                 profile['last_updated'] = profile.get('last_updated', datetime.now().isoformat())
                 
                 return profile
             else:
-                # Create new profile
+                # No profile yet - the first tracked interaction or import creates it
                 return self._create_new_user_profile(user_id)
                 
         except Exception as e:
@@ -104,37 +265,15 @@ class PersonalContextMapper:
         
         # Get user profile for context
         profile = self.get_user_context_profile(user_id)
-        completeness = profile.get('completeness', 0)
+        bucket = completeness_bucket(profile.get('completeness', 0))
         
         # Rules-based question templates
-        base_questions = []
-        
-        if completeness < 0.3:
-            # New user - basic exploration
-            base_questions.extend([
-                "What's been on your mind lately?",
-                "Is there something you've been wanting to talk about?",
-                "What kind of experiences tend to stick with you?"
-            ])
-        elif completeness < 0.6:
-            # Some context - deeper exploration
-            base_questions.extend([
-                "That sounds meaningful. What was going through your mind during that?",
-                "How did that experience change how you see things?",
-                "What patterns do you notice in situations like this?"
-            ])
-        else:
-            # Rich context - nuanced follow-ups
-            base_questions.extend([
-                "Given what you've shared before, how does this connect to your other experiences?",
-                "What would your past self think about this situation?",
-                "What insight does this give you about yourself?"
-            ])
+        base_questions = list(BASE_QUESTIONS[bucket])
         
-        # AI-enhanced personalization (cost-conscious)
+        # AI-enhanced personalization (cost-conscious, cached per bucket/topic/engagement)
         if self.openai_client and current_topic:
             try:
-                enhanced_questions = self._enhance_questions_with_ai(base_questions, profile, current_topic)
+                enhanced_questions = self._refined_questions(bucket, base_questions, profile, current_topic)
                 return enhanced_questions[:3]  # Limit to 3 questions
             except Exception as e:
                 logger.warning(f"AI question enhancement failed: {e}")
@@ -145,11 +284,38 @@ class PersonalContextMapper:
     # AI-POWERED DEEP INSIGHTS (Strategic usage)
     # =============================================================================
     
-    def generate_deep_user_insights(self, user_id: str) -> Dict[str, Any]:
-        """Generate deep insights using AI - called periodically, not real-time"""
+    def generate_deep_user_insights(self, user_id: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        Generate deep insights using AI - called periodically, not real-time.
+        The cached ai_insights are reused while no new interactions have been tracked since.
+        """
         if not self.openai_client or not self.db:
             return {'insights': [], 'patterns': [], 'recommendations': []}
         
+        try:
+            # The profile holds both the input watermark and the cached insights
+            profile = self._load_profile(user_id) or {}
+            watermark = make_watermark(profile.get('total_interactions'), profile.get('last_interaction'))
+            
+            cached = None
+            if profile.get('ai_insights'):
+                cached = {
+                    'value': profile['ai_insights'],
+                    'watermark': profile.get('ai_insights_watermark'),
+                    'generated_at': profile.get('insights_generated_at')
+                }
+            
+            return self.insights_freshness.resolve(
+                f"deep:{user_id}", watermark, cached,
+                lambda: self._compute_deep_user_insights(user_id, watermark),
+                force_refresh=force_refresh
+            )
+        except Exception as e:
+            logger.error(f"Error generating deep insights for user {user_id}: {e}")
+            return {'insights': [], 'patterns': [], 'recommendations': []}
+    
+    def _compute_deep_user_insights(self, user_id: str, watermark: str) -> Dict[str, Any]:
+        """Run the GPT-4 insight analysis and cache it with its input watermark"""
         try:
             # Get recent interactions for analysis
             interactions = self._get_recent_interactions(user_id, limit=20)
@@ -200,7 +366,7 @@ class PersonalContextMapper:
                 insights = json.loads(insights_text)
                 
                 # Cache insights in user profile
-                self._update_user_insights_cache(user_id, insights)
+                self._update_user_insights_cache(user_id, insights, watermark)
                 
                 return insights
                 
@@ -237,77 +403,54 @@ class PersonalContextMapper:
             # Store in imported conversations collection
             self.db.collection('user_contexts').document(user_id).collection('imported_conversations').add(import_analysis)
             
-            # Update user profile with import data
-            profile_ref = self.db.collection('user_profiles').document(user_id)
-            profile_doc = profile_ref.get()
+            # Fold the import into the profile with Increment transforms (no read-modify-write),
+            # touching only import fields; primary_themes is derived from theme_counts on read
+            deltas = {
+                'imports_count': 1,
+                'total_imported_words': import_analysis['word_count'],
+                'emotion_expressions': len(import_analysis['contains_emotion_words']),
+                'relationship_mentions': len(import_analysis['contains_relationship_words'])
+            }
+            nested_deltas = {
+                'theme_counts': {theme: 1 for theme in import_analysis['themes']},
+                'domain_engagement': {domain: 1 for domain in import_analysis['domains']}
+            }
+            fields = {
+                'user_id': user_id,
+                'last_updated': import_analysis['imported_at'],
+                'last_import': import_analysis['imported_at']
+            }
+            updates = dict(fields)
+            updates.update({field: firestore.Increment(amount) for field, amount in deltas.items()})
+            for field, counts in nested_deltas.items():
+                updates[field] = {key: firestore.Increment(amount) for key, amount in counts.items()}
             
-            if profile_doc.exists:
-                profile = profile_doc.to_dict()
-                
-                # Update import statistics
-                profile['imports_count'] = profile.get('imports_count', 0) + 1
-                profile['total_imported_words'] = profile.get('total_imported_words', 0) + import_analysis['word_count']
-                
-                # Update theme tracking
-                all_themes = profile.get('primary_themes', [])
-                all_themes.extend(import_analysis['themes'])
-                theme_counts = Counter(all_themes)
-                profile['primary_themes'] = [theme for theme, count in theme_counts.most_common(10)]
-                
-                # Update domain engagement
-                domain_engagement = profile.get('domain_engagement', {})
-                for domain in import_analysis['domains']:
-                    domain_engagement[domain] = domain_engagement.get(domain, 0) + 1
-                profile['domain_engagement'] = domain_engagement
-                
-                # Update emotional expression tracking
-                emotion_expressions = profile.get('emotion_expressions', 0)
-                profile['emotion_expressions'] = emotion_expressions + len(import_analysis['contains_emotion_words'])
-                
-                # Update relationship mentions
-                relationship_mentions = profile.get('relationship_mentions', 0)
-                profile['relationship_mentions'] = relationship_mentions + len(import_analysis['contains_relationship_words'])
-                
-                profile['last_updated'] = datetime.now().isoformat()
-                profile['last_import'] = datetime.now().isoformat()
-                
-                # Recalculate completeness
-                profile['completeness'] = self._calculate_profile_completeness(profile)
-                
-                profile_ref.update(profile)
-                
-            else:
-                # Create new profile with import data
-                new_profile = self._create_new_user_profile(user_id)
-                new_profile.update({
-                    'imports_count': 1,
-                    'total_imported_words': import_analysis['word_count'],
-                    'primary_themes': import_analysis['themes'],
-                    'domain_engagement': {domain: 1 for domain in import_analysis['domains']},
-                    'emotion_expressions': len(import_analysis['contains_emotion_words']),
-                    'relationship_mentions': len(import_analysis['contains_relationship_words']),
-                    'last_import': datetime.now().isoformat()
-                })
-                new_profile['completeness'] = self._calculate_profile_completeness(new_profile)
-                profile_ref.set(new_profile)
+            batch = self.db.batch()
+            batch.set(self.db.collection('user_profiles').document(user_id), updates, merge=True)
+            batch.commit()
+            
+            self._write_through_profile(user_id, fields=fields, increments=deltas, nested_increments=nested_deltas)
             
             logger.info(f"Tracked imported conversation for user {user_id}: {len(import_analysis['themes'])} themes, {import_analysis['source']} source")
             
         except Exception as e:
             logger.error(f"Error tracking imported conversation for user {user_id}: {e}")
 
-    def _update_user_insights_cache(self, user_id: str, insights: Dict):
+    def _update_user_insights_cache(self, user_id: str, insights: Dict, watermark: Optional[str] = None):
         """Cache AI-generated insights in user profile"""
         if not self.db:
             return
         
         try:
-            profile_ref = self.db.collection('user_profiles').document(user_id)
-            profile_ref.update({
+            fields = {
                 'ai_insights': insights,
+                'ai_insights_watermark': watermark,
                 'insights_generated_at': datetime.now().isoformat(),
                 'last_updated': datetime.now().isoformat()
-            })
+            }
+            # merge, not update: the profile document may not exist yet
+            self.db.collection('user_profiles').document(user_id).set(fields, merge=True)
+            self._write_through_profile(user_id, fields=fields)
         except Exception as e:
             logger.error(f"Error caching insights for user {user_id}: {e}")
     
@@ -315,99 +458,68 @@ class PersonalContextMapper:
     # HELPER METHODS (Rules-based)
     # =============================================================================
     
-    def _detect_emotion_words(self, message: str) -> List[str]:
+    def _detect_emotion_words(self, message: Union[str, AnalyzedText]) -> List[str]:
         """Detect emotion words using rules-based approach"""
-        emotion_words = {
-            'positive': ['happy', 'joy', 'excited', 'love', 'amazing', 'wonderful', 'great', 'fantastic'],
-            'negative': ['sad', 'angry', 'frustrated', 'disappointed', 'hurt', 'pain', 'difficult', 'struggle'],
-            'neutral': ['think', 'feel', 'believe', 'wonder', 'consider', 'reflect']
-        }
+        hits = analyze(message).hits
         
         found_emotions = []
-        message_lower = message.lower()
-        
-        for category, words in emotion_words.items():
-            for word in words:
-                if word in message_lower:
-                    found_emotions.append(f"{category}:{word}")
+        for category in self.emotion_words:
+            for word in hits.found('context.emotions', category):
+                found_emotions.append(f"{category}:{word}")
         
         return found_emotions
     
-    def _detect_time_references(self, message: str) -> List[str]:
+    def _detect_time_references(self, message: Union[str, AnalyzedText]) -> List[str]:
         """Detect temporal references"""
-        time_patterns = [
-            'yesterday', 'today', 'tomorrow', 'last week', 'next week',
-            'recently', 'lately', 'soon', 'earlier', 'later',
-            'when i was', 'years ago', 'months ago', 'back then'
-        ]
-        
-        found_times = []
-        message_lower = message.lower()
-        
-        for pattern in time_patterns:
-            if pattern in message_lower:
-                found_times.append(pattern)
-        
-        return found_times
+        return analyze(message).hits.found('context.time')
     
-    def _detect_relationship_words(self, message: str) -> List[str]:
+    def _detect_relationship_words(self, message: Union[str, AnalyzedText]) -> List[str]:
         """Detect relationship-related words"""
-        relationship_words = [
-            'family', 'friend', 'partner', 'spouse', 'mother', 'father',
-            'brother', 'sister', 'colleague', 'boss', 'team', 'relationship'
-        ]
-        
-        found_relationships = []
-        message_lower = message.lower()
-        
-        for word in relationship_words:
-            if word in message_lower:
-                found_relationships.append(word)
-        
-        return found_relationships
+        return analyze(message).hits.found('context.relationships')
     
-    def _update_user_profile_summary(self, user_id: str, interaction_data: Dict):
-        """Update user profile summary with new interaction data"""
-        try:
-            profile_ref = self.db.collection('user_profiles').document(user_id)
-            profile_doc = profile_ref.get()
-            
-            if profile_doc.exists:
-                profile = profile_doc.to_dict()
-            else:
-                profile = self._get_default_context_profile()
-                profile['user_id'] = user_id
-                profile['created_at'] = datetime.now().isoformat()
-            
-            # Update interaction counts
-            profile['total_interactions'] = profile.get('total_interactions', 0) + 1
-            profile['total_words'] = profile.get('total_words', 0) + interaction_data.get('word_count', 0)
-            profile['last_interaction'] = datetime.now().isoformat()
-            
-            # Update patterns
-            if interaction_data.get('contains_emotion_words'):
-                profile['emotion_expressions'] = profile.get('emotion_expressions', 0) + 1
-            
-            if interaction_data.get('contains_time_references'):
-                profile['temporal_references'] = profile.get('temporal_references', 0) + 1
-            
-            if interaction_data.get('contains_relationship_words'):
-                profile['relationship_mentions'] = profile.get('relationship_mentions', 0) + 1
-            
-            # Calculate engagement level
-            avg_message_length = profile['total_words'] / profile['total_interactions']
-            if avg_message_length > 20:
-                profile['engagement_level'] = 'high'
-            elif avg_message_length > 10:
-                profile['engagement_level'] = 'medium'
-            else:
-                profile['engagement_level'] = 'low'
-            
-            # Save updated profile
-            profile_ref.set(profile)
-            
-        except Exception as e:
-            logger.error(f"Error updating user profile summary: {e}")
+    def _profile_counter_deltas(self, interaction_data: Dict) -> Dict[str, int]:
+        """Counter increments one interaction contributes to the profile"""
+        return {
+            'total_interactions': 1,
+            'total_words': interaction_data.get('word_count', 0),
+            'emotion_expressions': 1 if interaction_data.get('contains_emotion_words') else 0,
+            'temporal_references': 1 if interaction_data.get('contains_time_references') else 0,
+            'relationship_mentions': 1 if interaction_data.get('contains_relationship_words') else 0
+        }
+    
+    def _profile_counter_updates(self, user_id: str, interaction_data: Dict,
+                                 deltas: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Increment transforms folding one interaction into the profile (race-free, no read)"""
+        deltas = deltas or self._profile_counter_deltas(interaction_data)
+        updates = {field: firestore.Increment(amount) for field, amount in deltas.items()}
+        updates['user_id'] = user_id
+        updates['last_interaction'] = interaction_data.get('timestamp', datetime.now().isoformat())
+        return updates
+    
+    def _calculate_engagement_level(self, profile: Dict) -> str:
+        """Engagement level from average message length (derived on read, never stored)"""
+        total_interactions = profile.get('total_interactions', 0)
+        if not total_interactions:
+            return 'new'
+        avg_message_length = profile.get('total_words', 0) / total_interactions
+        if avg_message_length > 20:
+            return 'high'
+        elif avg_message_length > 10:
+            return 'medium'
+        return 'low'
+    
+    def _with_derived_fields(self, profile: Dict) -> Dict[str, Any]:
+        """Fill defaults for fields a counter-only profile lacks and compute derived values"""
+        merged = self._get_default_context_profile()
+        merged.update(profile)
+        merged['engagement_level'] = self._calculate_engagement_level(merged)
+        if merged.get('theme_counts'):
+            # Themes listed by profiles from before theme_counts existed count once each
+            theme_counts = Counter({theme: 1 for theme in merged.get('primary_themes') or []})
+            theme_counts.update(merged['theme_counts'])
+            merged['primary_themes'] = [theme for theme, _ in theme_counts.most_common(10)]
+        merged['completeness'] = self._calculate_profile_completeness(merged)
+        return merged
     
     def _calculate_profile_completeness(self, profile: Dict) -> float:
         """Calculate how complete the user profile is"""
@@ -422,14 +534,10 @@ class PersonalContextMapper:
         return sum(completeness_factors.values()) / len(completeness_factors)
     
     def _create_new_user_profile(self, user_id: str) -> Dict[str, Any]:
-        """Create a new user profile"""
+        """Build a new user profile (not persisted - the first profile write creates the document)"""
         profile = self._get_default_context_profile()
         profile['user_id'] = user_id
         profile['created_at'] = datetime.now().isoformat()
-        
-        if self.db:
-            self.db.collection('user_profiles').document(user_id).set(profile)
-        
         return profile
     
     def _get_default_context_profile(self) -> Dict[str, Any]:
@@ -449,12 +557,94 @@ class PersonalContextMapper:
             'insights_generated_at': None
         }
     
+    # =============================================================================
+    # PROFILE CACHE
+    # =============================================================================
+    
+    def _load_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Stored profile document (None if the user has none yet), read through the TTL cache"""
+        now = time.monotonic()
+        with self._profile_cache_lock:
+            entry = self._profile_cache.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._profile_cache.move_to_end(user_id)
+                if entry[1] is None:
+                    self.profile_cache_stats['negative_hits'] += 1
+                    return None
+                self.profile_cache_stats['hits'] += 1
+                return copy.deepcopy(entry[1])
+            self.profile_cache_stats['misses'] += 1
+        
+        profile_doc = self.db.collection('user_profiles').document(user_id).get()
+        stored = profile_doc.to_dict() if profile_doc.exists else None
+        self._cache_profile(user_id, stored)
+        return copy.deepcopy(stored)
+    
+    def _cache_profile(self, user_id: str, profile: Optional[Dict[str, Any]]):
+        with self._profile_cache_lock:
+            self._profile_cache[user_id] = (time.monotonic() + self.profile_cache_ttl, copy.deepcopy(profile))
+            self._profile_cache.move_to_end(user_id)
+            while len(self._profile_cache) > PROFILE_CACHE_MAX_ENTRIES:
+                self._profile_cache.popitem(last=False)
+    
+    def _write_through_profile(self, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                               increments: Optional[Dict[str, int]] = None, replace: bool = False,
+                               nested_increments: Optional[Dict[str, Dict[str, int]]] = None):
+        """
+        Apply a profile write that just succeeded in Firestore to the cached copy.
+        replace=True means the write was a full set(); otherwise fields are merged
+        (nested maps too, like a Firestore merge) and increments (nested_increments: per key of a map
+        field) added onto the cached document (a cached miss starts from empty,
+        matching what a merge write creates). Users that are not cached stay uncached.
+        """
+        if replace:
+            self._cache_profile(user_id, fields)
+            return
+        with self._profile_cache_lock:
+            entry = self._profile_cache.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                return
+            profile = entry[1] if entry[1] is not None else {}
+            _merge_fields(profile, fields or {})
+            for field, amount in (increments or {}).items():
+                profile[field] = profile.get(field, 0) + amount
+            for field, counts in (nested_increments or {}).items():
+                nested = profile.get(field)
+                if not isinstance(nested, dict):
+                    nested = profile[field] = {}
+                for key, amount in counts.items():
+                    nested[key] = nested.get(key, 0) + amount
+            self._profile_cache[user_id] = (entry[0], profile)
+    
+    def invalidate_profile(self, user_id: str):
+        """Drop a cached profile (e.g. after it was changed outside this mapper)"""
+        with self._profile_cache_lock:
+            self._profile_cache.pop(user_id, None)
+    
+    # =============================================================================
+    # RECENT INTERACTIONS & RETENTION
+    # =============================================================================
+    
+    def _recent_interaction_entry(self, interaction_data: Dict) -> Dict[str, Any]:
+        """Compact copy of an interaction for the profile ring buffer"""
+        entry = {key: value for key, value in interaction_data.items() if key != 'user_id'}
+        entry['message'] = entry.get('message', '')[:RECENT_MESSAGE_MAX_CHARS]
+        return entry
+    
     def _get_recent_interactions(self, user_id: str, limit: int = 20) -> List[Dict]:
-        """Get recent user interactions"""
+        """Get recent user interactions (chronological) from the profile ring buffer"""
         if not self.db:
             return []
         
         try:
+            profile = self._load_profile(user_id) or {}
+            buffer = profile.get('recent_interactions')
+            if buffer:
+                # The buffer may briefly hold more than N entries when writers raced on trimming
+                interactions = sorted(buffer.values(), key=lambda entry: entry.get('timestamp') or '')
+                return interactions[-min(limit, RECENT_INTERACTIONS_SIZE):]
+            
+            # Profiles tracked before the ring buffer existed
             interactions = []
             interactions_ref = (self.db.collection('user_contexts')
                               .document(user_id)
@@ -471,6 +661,175 @@ class PersonalContextMapper:
             logger.error(f"Error getting recent interactions: {e}")
             return []
     
+    def roll_up_interactions(self, user_id: Optional[str] = None,
+                             older_than_days: int = INTERACTION_RETENTION_DAYS) -> int:
+        """
+        Fold raw interaction documents older than the retention window into daily
+        aggregates (user_contexts/<id>/interaction_days/<YYYY-MM-DD>) and delete them.
+        Each chunk's aggregate increments and deletes commit in one batch, so an
+        interrupted run never double counts. Without user_id every user is processed.
+        Returns the number of interactions rolled up.
+        """
+        if not self.db:
+            return 0
+        
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        if user_id:
+            query = (self.db.collection('user_contexts').document(user_id)
+                     .collection('interactions').where('timestamp', '<', cutoff))
+        else:
+            query = self.db.collection_group('interactions').where('timestamp', '<', cutoff)
+        
+        rolled_up = 0
+        chunk = []
+        for doc in query.stream():
+            chunk.append(doc)
+            if len(chunk) >= ROLLUP_CHUNK_SIZE:
+                rolled_up += self._roll_up_chunk(chunk)
+                chunk = []
+        if chunk:
+            rolled_up += self._roll_up_chunk(chunk)
+        
+        logger.info(f"Rolled up {rolled_up} interactions older than {older_than_days} days"
+                    + (f" for user {user_id}" if user_id else ""))
+        return rolled_up
+    
+    def _roll_up_chunk(self, docs: List[Any]) -> int:
+        """Aggregate one chunk of interaction documents per user and day, then delete them"""
+        days: Dict[tuple, Dict[str, int]] = defaultdict(Counter)
+        for doc in docs:
+            interaction = doc.to_dict()
+            owner = interaction.get('user_id') or doc.reference.parent.parent.id
+            day = (interaction.get('timestamp') or '')[:10] or 'unknown'
+            totals = days[(owner, day)]
+            totals['interactions'] += 1
+            totals['total_words'] += interaction.get('word_count', 0)
+            totals['questions'] += interaction.get('question_count', 0)
+            totals['exclamations'] += interaction.get('exclamation_count', 0)
+            totals['emotion_expressions'] += 1 if interaction.get('contains_emotion_words') else 0
+            totals['temporal_references'] += 1 if interaction.get('contains_time_references') else 0
+            totals['relationship_mentions'] += 1 if interaction.get('contains_relationship_words') else 0
+            totals[f"{interaction.get('message_type', 'user')}_messages"] += 1
+        
+        batch = self.db.batch()
+        for (owner, day), totals in days.items():
+            day_ref = (self.db.collection('user_contexts').document(owner)
+                       .collection('interaction_days').document(day))
+            aggregate = {field: firestore.Increment(amount) for field, amount in totals.items()}
+            aggregate.update({'user_id': owner, 'date': day, 'last_rolled_up': datetime.now().isoformat()})
+            batch.set(day_ref, aggregate, merge=True)
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        return len(docs)
+    
+    # =============================================================================
+    # QUESTION REFINEMENT CACHE
+    # =============================================================================
+    
+    def _refined_questions(self, bucket: str, base_questions: List[str], profile: Dict, current_topic: str) -> List[str]:
+        """AI-refined questions from the cache/question bank, generating them only on a miss"""
+        if bucket == 'new':
+            return base_questions  # Not enough context for AI enhancement
+        
+        key = (bucket, normalize_topic(current_topic), profile.get('engagement_level', 'unknown'))
+        cached = self._cached_questions(key)
+        if cached is not None:
+            return cached
+        
+        questions = self._enhance_questions_with_ai(base_questions, profile, current_topic)
+        if questions is not base_questions:
+            self._store_questions(key, questions, persist=True)
+        return questions
+    
+    def _cached_questions(self, key: tuple) -> Optional[List[str]]:
+        with self._question_cache_lock:
+            entry = self._question_cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._question_cache.move_to_end(key)
+                self.question_cache_stats['hits'] += 1
+                return list(entry[1])
+            self.question_cache_stats['misses'] += 1
+        return None
+    
+    def _store_questions(self, key: tuple, questions: List[str], persist: bool = False,
+                         ttl: float = QUESTION_CACHE_TTL_SECONDS):
+        with self._question_cache_lock:
+            self._question_cache[key] = (time.monotonic() + ttl, list(questions))
+            self._question_cache.move_to_end(key)
+            while len(self._question_cache) > QUESTION_CACHE_MAX_ENTRIES:
+                self._question_cache.popitem(last=False)
+        
+        if persist and self.db:
+            bucket, topic, engagement = key
+            try:
+                self.db.collection(QUESTION_BANK_COLLECTION).document(self._question_bank_id(key)).set({
+                    'bucket': bucket,
+                    'topic': topic,
+                    'engagement_level': engagement,
+                    'questions': list(questions),
+                    'generated_at': datetime.now().isoformat()
+                })
+            except Exception as e:
+                logger.warning(f"Could not persist question bank entry {key}: {e}")
+    
+    @staticmethod
+    def _question_bank_id(key: tuple) -> str:
+        return hashlib.blake2b('|'.join(key).encode('utf-8'), digest_size=16).hexdigest()
+    
+    def warm_question_bank(self) -> int:
+        """Load unexpired question bank entries into the in-memory cache"""
+        if not self.db:
+            return 0
+        
+        warmed = 0
+        try:
+            for doc in self.db.collection(QUESTION_BANK_COLLECTION).stream():
+                entry = doc.to_dict()
+                try:
+                    age = (datetime.now() - datetime.fromisoformat(entry.get('generated_at'))).total_seconds()
+                except (TypeError, ValueError):
+                    continue
+                if age >= QUESTION_CACHE_TTL_SECONDS or not entry.get('questions'):
+                    continue
+                key = (entry.get('bucket'), entry.get('topic'), entry.get('engagement_level'))
+                self._store_questions(key, entry['questions'], ttl=QUESTION_CACHE_TTL_SECONDS - age)
+                warmed += 1
+            self.question_cache_stats['warmed'] += warmed
+            logger.info(f"PersonalContextMapper: warmed {warmed} question bank entries")
+        except Exception as e:
+            logger.warning(f"Question bank warm-up failed: {e}")
+        return warmed
+    
+    def _warm_up_questions(self):
+        """Startup: load the persisted bank, then generate the default entries it is missing"""
+        self.warm_question_bank()
+        if QUESTION_BANK_PRECOMPUTE:
+            try:
+                generated = self.precompute_question_bank()
+                logger.info(f"PersonalContextMapper: precomputed {generated} question bank entries")
+            except Exception as e:
+                logger.warning(f"Question bank precompute failed: {e}")
+    
+    def precompute_question_bank(self, topics: Optional[List[str]] = None) -> int:
+        """Generate missing question bank entries for common topics (every AI bucket and engagement level)"""
+        if not self.openai_client:
+            return 0
+        
+        generated = 0
+        for topic in topics or DEFAULT_QUESTION_TOPICS:
+            for bucket in ('developing', 'rich'):
+                for engagement in ('low', 'medium', 'high'):
+                    key = (bucket, normalize_topic(topic), engagement)
+                    if self._cached_questions(key) is not None:
+                        continue
+                    profile = {'completeness': 1.0, 'engagement_level': engagement}
+                    questions = self._enhance_questions_with_ai(BASE_QUESTIONS[bucket], profile, topic)
+                    if questions is not BASE_QUESTIONS[bucket]:
+                        self._store_questions(key, questions, persist=True)
+                        generated += 1
+        return generated
+    
     def _enhance_questions_with_ai(self, base_questions: List[str], profile: Dict, current_topic: str) -> List[str]:
         """Enhance base questions with AI personalization"""
         
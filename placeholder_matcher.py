@@ -0,0 +1,156 @@
+"""
+Placeholder Matcher
+===================
+
+Detects which KNOWLEDGE_MAP fields are still unfilled in MentalOS files.
+
+All placeholders are compiled once into a single alternation regex, so finding
+the missing fields of a file is one C-level pass over its (normalized) content
+instead of one substring scan per field. CompletenessTracker caches the
+per-file result keyed on the stored file's version (etag), so writes made by
+other instances show up too; the MentalOS write helpers also invalidate it.
+"""
+
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Markdown emphasis is ignored when matching (``*[City]*`` still counts as unfilled)
+_EMPHASIS_TABLE = str.maketrans('', '', '*_')
+
+
+def normalize_placeholder_text(text: str) -> str:
+    """Strip markdown emphasis characters the same way for content and placeholders."""
+    return text.translate(_EMPHASIS_TABLE)
+
+
+class PlaceholderMatcher:
+    """Single compiled matcher for every placeholder in a knowledge map."""
+
+    def __init__(self, knowledge_map: Dict):
+        # file -> [(field, normalized placeholder)] in declaration order
+        self.file_fields: Dict[str, List[Tuple[str, str]]] = {}
+        placeholders: Set[str] = set()
+        for file_name, entry in (knowledge_map or {}).items():
+            fields = (entry or {}).get('fields') or {}
+            pairs = []
+            for field, placeholder in fields.items():
+                norm = normalize_placeholder_text(placeholder).strip()
+                if norm:
+                    pairs.append((field, norm))
+                    placeholders.add(norm)
+            if pairs:
+                self.file_fields[file_name] = pairs
+
+        self.pattern: Optional[re.Pattern] = None
+        if placeholders:
+            # Longest first so the alternation prefers full placeholders; the lookahead
+            # reports overlapping occurrences too.
+            alternation = '|'.join(re.escape(p) for p in sorted(placeholders, key=len, reverse=True))
+            self.pattern = re.compile(f"(?=({alternation}))")
+
+    def tracked_files(self) -> List[str]:
+        """Files that declare placeholder fields."""
+        return list(self.file_fields)
+
+    def field_count(self, file_name: str) -> int:
+        return len(self.file_fields.get(file_name, []))
+
+    def present_placeholders(self, content: str) -> Set[str]:
+        """Return every known placeholder that occurs in the content."""
+        if not self.pattern or not content:
+            return set()
+        return {m.group(1) for m in self.pattern.finditer(normalize_placeholder_text(content))}
+
+    def missing_fields(self, file_name: str, content: str) -> List[str]:
+        """Fields of file_name whose placeholder is still present in content."""
+        pairs = self.file_fields.get(file_name)
+        if not pairs:
+            return []
+        present = self.present_placeholders(content)
+        return [field for field, placeholder in pairs if placeholder in present]
+
+
+class CompletenessTracker:
+    """
+    Cached per-file missing-field results for each user.
+    Content passed in by a caller is always evaluated as given (never cached). Results
+    read from storage are cached together with the file's version(user_id, path) and
+    reused only while that version is unchanged; write helpers also invalidate them.
+    """
+
+    def __init__(self, matcher: PlaceholderMatcher, read_file: Callable[[str, str], Optional[str]],
+                 version: Optional[Callable[[str, str], Optional[str]]] = None):
+        self.matcher = matcher
+        # read_file(user_id, path) -> content or None if the file does not exist
+        self.read_file = read_file
+        # version(user_id, path) -> storage etag/generation (None if missing); no version = cache until invalidated
+        self.version = version
+        self._results: Dict[str, Dict[str, Tuple[Optional[str], Dict]]] = {}
+        self._lock = threading.Lock()
+
+    def file_status(self, user_id: str, file_name: str, content: Optional[str] = None) -> Dict:
+        """Return {'exists', 'missing_fields', 'total_fields', 'filled', 'completeness'} for a file."""
+        from_storage = content is None
+        version = None
+        if from_storage:
+            try:
+                version = self.version(user_id, file_name) if self.version else None
+            except Exception as e:
+                logger.warning(f"CompletenessTracker: could not stat {file_name} for {user_id}: {e}")
+                from_storage = False
+            with self._lock:
+                cached = self._results.get(user_id, {}).get(file_name)
+            if from_storage and cached is not None and cached[0] == version:
+                return cached[1]
+
+        if content is None:
+            try:
+                content = self.read_file(user_id, file_name)
+            except Exception as e:
+                # Unreadable right now - report it as missing but do not cache that
+                logger.warning(f"CompletenessTracker: could not read {file_name} for {user_id}: {e}")
+                from_storage = False
+        exists = content is not None
+        total = self.matcher.field_count(file_name)
+        if exists:
+            missing = self.matcher.missing_fields(file_name, content)
+        else:
+            missing = [field for field, _ in self.matcher.file_fields.get(file_name, [])]
+        status = {
+            'exists': exists,
+            'missing_fields': missing,
+            'total_fields': total,
+            'filled': total - len(missing),
+            'completeness': round((total - len(missing)) / total, 3) if total else 1.0
+        }
+        if from_storage:
+            with self._lock:
+                self._results.setdefault(user_id, {})[file_name] = (version, status)
+        return status
+
+    def missing_fields(self, user_id: str, file_name: str, content: Optional[str] = None) -> List[str]:
+        return list(self.file_status(user_id, file_name, content)['missing_fields'])
+
+    def summary(self, user_id: str) -> Dict:
+        """Completeness for every tracked file plus an overall ratio."""
+        files = {name: self.file_status(user_id, name) for name in self.matcher.tracked_files()}
+        total = sum(f['total_fields'] for f in files.values())
+        filled = sum(f['filled'] for f in files.values())
+        return {
+            'files': files,
+            'total_fields': total,
+            'filled_fields': filled,
+            'overall_completeness': round(filled / total, 3) if total else 1.0
+        }
+
+    def invalidate(self, user_id: str, file_name: Optional[str] = None):
+        """Drop cached results for one file, or for the whole user when file_name is None."""
+        with self._lock:
+            if file_name is None:
+                self._results.pop(user_id, None)
+            else:
+                self._results.get(user_id, {}).pop(file_name, None)
@@ -0,0 +1,145 @@
+"""
+Prompt Registry
+===============
+
+File-backed prompt templates for the PromptsEngine.
+
+Templates live as UTF-8 text files under prompts/templates/ and are addressed
+by their relative path without extension ("conversation/discovery"). The
+registry:
+- indexes the directory on first use and reads each file only when it is first
+  requested (nothing is loaded at import or startup)
+- precompiles each template once: placeholder fields are parsed up front and
+  templates without placeholders render as the stored string
+- assigns each template a version (BLAKE2b hash of its content); fingerprint()
+  combines the versions of a set of templates so LLM response caches can key on
+  the exact prompt text they were produced with
+- serves lookups from a dict, so repeated access is O(1) with no allocation
+
+reload() drops everything loaded so far, picking up edited files.
+"""
+
+import hashlib
+import logging
+import os
+import string
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES_DIR = os.getenv(
+    'PROMPT_TEMPLATES_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'templates')
+)
+TEMPLATE_EXTENSION = '.txt'
+
+_formatter = string.Formatter()
+
+
+class PromptTemplate:
+    """One loaded template with its content version and placeholder fields."""
+
+    __slots__ = ('name', 'text', 'version', 'fields')
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.version = hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+        self.fields = self._parse_fields(text)
+
+    def render(self, **kwargs) -> str:
+        """Fill placeholders; templates without placeholders are returned as stored."""
+        if not self.fields:
+            return self.text
+        return self.text.format(**kwargs)
+
+    @staticmethod
+    def _parse_fields(text: str) -> Tuple[str, ...]:
+        try:
+            return tuple(sorted({field for _, field, _, _ in _formatter.parse(text) if field}))
+        except ValueError:
+            # Literal braces (e.g. JSON examples) - treat the template as plain text
+            return ()
+
+
+class PromptRegistry:
+    """Lazy, versioned lookup of prompt templates stored under a directory."""
+
+    def __init__(self, root: str = DEFAULT_TEMPLATES_DIR):
+        self.root = root
+        self._paths: Optional[Dict[str, str]] = None
+        self._templates: Dict[str, Optional[PromptTemplate]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'missing': 0}
+
+    def get(self, name: str) -> Optional[PromptTemplate]:
+        """Template by name, or None if there is no such file."""
+        try:
+            return self._templates[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._templates:
+                self._templates[name] = self._load(name)
+            return self._templates[name]
+
+    def text(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        template = self.get(name)
+        return template.text if template is not None else default
+
+    def version(self, name: str) -> Optional[str]:
+        template = self.get(name)
+        return template.version if template is not None else None
+
+    def names(self, prefix: str = '') -> List[str]:
+        """Names of all templates on disk (optionally under a directory prefix)."""
+        with self._lock:
+            paths = self._index()
+        return sorted(name for name in paths if name.startswith(prefix))
+
+    def fingerprint(self, names: Optional[Iterable[str]] = None) -> str:
+        """Combined version of the given templates (default: all of them)."""
+        digest = hashlib.blake2b(digest_size=8)
+        for name in sorted(names if names is not None else self.names()):
+            digest.update(f"{name}={self.version(name) or '-'};".encode('utf-8'))
+        return digest.hexdigest()
+
+    def reload(self):
+        """Forget the index and every loaded template (next access re-reads the files)."""
+        with self._lock:
+            self._paths = None
+            self._templates = {}
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _index(self) -> Dict[str, str]:
+        """name -> file path for every template under root (caller holds the lock)."""
+        if self._paths is None:
+            paths = {}
+            for directory, _, files in os.walk(self.root):
+                for filename in files:
+                    if not filename.endswith(TEMPLATE_EXTENSION):
+                        continue
+                    path = os.path.join(directory, filename)
+                    name = os.path.relpath(path, self.root)[:-len(TEMPLATE_EXTENSION)]
+                    paths[name.replace(os.sep, '/')] = path
+            self._paths = paths
+            logger.info(f"PromptRegistry: indexed {len(paths)} templates in {self.root}")
+        return self._paths
+
+    def _load(self, name: str) -> Optional[PromptTemplate]:
+        """Read and compile one template (caller holds the lock)."""
+        path = self._index().get(name)
+        if path is None:
+            self.stats['missing'] += 1
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        # Files end with a newline that is not part of the prompt
+        if text.endswith('\n'):
+            text = text[:-1]
+        self.stats['loads'] += 1
+        return PromptTemplate(name, text)
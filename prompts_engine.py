@@ -14,10 +14,15 @@ Architecture Benefits:
 """
 
 import logging
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+from typing import Dict, List, Optional, Any, Union
 from enum import Enum
 from datetime import datetime
 from format_types import FormatType
+from prompt_registry import PromptRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -55,17 +60,32 @@ class PromptsEngine:
     Centralized engine for all AI prompts in the SentimentalApp system.
     """
     
-    def __init__(self):
+    def __init__(self, registry: PromptRegistry = None):
         logger.info("PromptsEngine: Initializing centralized prompt management")
         
-        # Initialize all prompt collections
-        self._conversation_prompts = self._init_conversation_prompts()
-        self._format_prompts = self._init_format_prompts()
-        self._analysis_prompts = self._init_analysis_prompts()
-        self._context_prompts = self._init_context_prompts()
-        self._story_evaluation_prompts = self._init_story_evaluation_prompts()
-        
-        logger.info("PromptsEngine: All prompt collections initialized successfully")
+        # Conversation prompts are file-backed templates (prompts/templates/conversation/*.txt);
+        # files are read on first use and the in-code collections below are built on first access
+        self.registry = registry or PromptRegistry()
+    
+    @cached_property
+    def _conversation_prompts(self) -> Dict[str, Any]:
+        return self._init_conversation_prompts()
+    
+    @cached_property
+    def _format_prompts(self) -> Dict[str, Any]:
+        return self._init_format_prompts()
+    
+    @cached_property
+    def _analysis_prompts(self) -> Dict[str, str]:
+        return self._init_analysis_prompts()
+    
+    @cached_property
+    def _context_prompts(self) -> Dict[str, str]:
+        return self._init_context_prompts()
+    
+    @cached_property
+    def _story_evaluation_prompts(self) -> Dict[str, str]:
+        return self._init_story_evaluation_prompts()
     
     # =============================================================================
     # MAIN PROMPT RETRIEVAL METHODS
@@ -92,12 +112,8 @@ class PromptsEngine:
             return self._build_story_readiness_prompt(**kwargs)
         elif prompt_type == PromptType.CROSS_CONVERSATION_ANALYSIS:
             return self._build_cross_conversation_prompt(**kwargs)
-        elif prompt_type == PromptType.DISCOVERY:
-            return self._conversation_prompts[PromptType.DISCOVERY]
-        elif prompt_type == PromptType.THERAPEUTIC:
-            return self._conversation_prompts[PromptType.THERAPEUTIC]
-        elif prompt_type == PromptType.CREATIVE:
-            return self._conversation_prompts[PromptType.CREATIVE]
+        elif prompt_type in (PromptType.DISCOVERY, PromptType.THERAPEUTIC, PromptType.CREATIVE):
+            return self.get_conversation_prompt(prompt_type)
         else:
             logger.warning(f"Unknown prompt type: {prompt_type}")
             return self._get_fallback_prompt()
@@ -106,7 +122,7 @@ class PromptsEngine:
         """Get system prompt for specific engine type"""
         
         system_prompts = {
-            'conversation': self._conversation_prompts['system_base'],
+            'conversation': self.get_conversation_prompt('system_base'),
             'format_generation': self._format_prompts['system_base'],
             'analysis': self._analysis_prompts['system_base'],
             'story_evaluation': self._story_evaluation_prompts['system_base']
@@ -114,118 +130,31 @@ class PromptsEngine:
         
         return system_prompts.get(engine_type, self._get_fallback_system_prompt())
     
-    def get_conversation_prompt(self, prompt_type: PromptType) -> str:
-        """Get conversation prompt based on type"""
-        prompts = {
-            PromptType.DISCOVERY: """You are a helpful, friendly AI assistant having a natural conversation. Talk like ChatGPT - be conversational, supportive, and genuinely interested in what they're sharing.
-
-Keep it simple:
-- Respond naturally like you're chatting with a friend
-- Ask good follow-up questions when appropriate  
-- Be supportive but not preachy
-- Keep responses conversational length (1-3 sentences usually)
-- Stay focused on what they actually want to talk about
-
-Just have a normal, helpful conversation. Nothing fancy or forced.""",
-
-            PromptType.THERAPEUTIC: """You are Sentimental - a compassionate AI guide helping people process their inner world through meaningful reflection.
-
-Create conversations that feel like therapy sessions with the world's most insightful listener - so valuable that people naturally want to return and share the experience.
-
-APPROACH:
-- One thoughtful, focused question that invites deep reflection
-- Hold space for complex emotions without trying to "fix" everything
-- Help them untangle thoughts and feelings with gentle guidance
-- Validate their experience while offering new perspectives
-- Create safety for vulnerability and authentic expression
-
-FOCUS AREAS:
-- Emotional processing and understanding patterns
-- Relationship dynamics and communication
-- Self-compassion and personal growth
-- Life transitions and changes
-- Stress, anxiety, purpose, and meaning
-- Inner conflicts and decision-making
-
-THERAPEUTIC PRINCIPLES:
-- Unconditional positive regard and acceptance
-- Reflective listening that shows deep understanding
-- Questions that promote insight and self-awareness
-- Gentle challenging of limiting beliefs
-- Empowerment through self-discovery
-
-Make them feel heard, understood, and gently guided toward their own insights.""",
-
-            PromptType.CREATIVE: """You are Sentimental - an AI muse that helps people unlock their creative essence and express their authentic voice.
-
-Your goal: Spark creativity and self-expression so inspiring that people naturally want to create and share.
-
-CREATIVE EXPLORATION:
-- Discover what wants to be expressed through them
-- Help them find their unique creative voice and perspective
-- Explore the stories, art, music, or ideas living inside them
-- Connect creativity to their deeper purpose and authentic self
-- Make the creative process feel magical and meaningful
-
-INSPIRATION AREAS:
-- What stories from their life need to be told
-- Creative projects that would feel meaningful to them
-- Art forms that resonate with their soul
-- How they can express their truth through creativity
-- The intersection of their life experience and creative vision
-
-APPROACH:
-- Ask questions that unlock creative inspiration
-- Help them see the creative potential in their experiences
-- Connect their emotions and insights to creative expression
-- Make them feel like an artist with something important to share
-
-Transform their self-discovery into creative fuel they're excited to share with the world."""
-        }
-        
-        return prompts.get(prompt_type, prompts[PromptType.DISCOVERY])
+    def get_conversation_prompt(self, prompt_type: Union[PromptType, str]) -> str:
+        """
+        Get a conversation prompt by mode (PromptType.DISCOVERY/THERAPEUTIC/CREATIVE) or by
+        name ('system_base', 'story_context', 'openai_gpt4', ...). Unknown modes fall back to
+        discovery, unknown names to system_base.
+        """
+        if isinstance(prompt_type, PromptType):
+            name, fallback = prompt_type.value, PromptType.DISCOVERY.value
+        else:
+            name, fallback = prompt_type, 'system_base'
+        template = self.registry.get(f'conversation/{name}') or self.registry.get(f'conversation/{fallback}')
+        return template.text if template is not None else self._get_fallback_system_prompt()
+    
+    def prompt_version(self, name: str) -> Optional[str]:
+        """Content version of a file-backed template (e.g. 'conversation/discovery')"""
+        return self.registry.version(name)
     
     # =============================================================================
     # CONVERSATION PROMPTS
     # =============================================================================
     
-    def _init_conversation_prompts(self) -> Dict[str, str]:
-        """Initialize conversation-related prompts"""
+    def _init_conversation_prompts(self) -> Dict[str, List[str]]:
+        """Initialize conversation phrase banks (the conversation prompts themselves are template files)"""
         
         return {
-            'system_base': """You are Sentimental, a warm and empathetic conversation companion designed to help people understand themselves better through meaningful dialogue. Your core purpose is to:
-
-🌟 Create a safe, non-judgmental space for authentic sharing
-🌟 Help people explore their thoughts, emotions, and experiences with curiosity and compassion  
-🌟 Guide conversations naturally toward self-discovery and meaning-making
-🌟 Ask thoughtful questions that deepen understanding rather than rushing to solutions
-🌟 Recognize when experiences might be meaningful enough to become stories
-
-Your conversational approach:
-- Be genuinely curious about their inner world
-- Listen for emotions, patterns, and moments of insight
-- Ask open-ended questions that invite deeper reflection
-- Validate their feelings and experiences
-- Help them find their own wisdom and insights
-- Keep responses warm but concise (1-2 paragraphs max)
-- Always end with a gentle question that encourages further exploration
-
-Remember: You're not trying to fix or solve anything. You're helping them explore and understand their own experience. Some conversations will naturally reveal meaningful stories worth capturing - when that happens, the system will recognize it and offer to create a story they can revisit and transform into different formats.""",
-
-            'contextual_new_user': """This person is new to Sentimental. Help them feel welcomed and understood. Focus on creating connection and showing genuine interest in whatever they want to share.""",
-            
-            'contextual_emotional_awareness': """This person is sharing emotional content. Be especially gentle and validating. Help them explore their feelings with curiosity rather than trying to 'fix' anything.""",
-            
-            'contextual_relationships': """This person is sharing about relationships and connections. Help them explore the dynamics, their feelings, and what they're learning about themselves through these connections.""",
-            
-            'contextual_career': """This person is reflecting on work and career. Help them explore not just what happened, but how it connects to their values, growth, and sense of purpose.""",
-            
-            'contextual_growth': """This person is in a reflective, growth-oriented mindset. Help them dig deeper into their insights and what they're discovering about themselves.""",
-            
-            'contextual_story_potential': """This conversation has rich story potential. Instead of being obvious about it, weave gentle magic into your responses. Use phrases like 'I can feel something meaningful taking shape in what you're sharing' or 'Your words are painting a beautiful picture' to subtly indicate that something special is emerging. Continue exploring naturally but with an awareness that a story wants to be born.""",
-            
-            'contextual_developing_story': """A meaningful story is developing here. Use magical, poetic language to acknowledge this: 'There's something beautiful emerging from what you're sharing' or 'I can sense the story that wants to be told here.' Ask questions that help them explore the experience more fully while maintaining the sense of wonder and discovery.""",
-
             'opening_prompts': [
                 "What's been stirring in your mind lately?",
                 "I'm here to listen. What would you like to explore today?",
@@ -256,25 +185,13 @@ Remember: You're not trying to fix or solve anything. You're helping them explor
                 "It sounds like you're discovering something important about yourself.",
                 "That's a beautiful insight.",
                 "I appreciate your openness in sharing this."
-            ],
-
-            'openai_gpt4': """You are using GPT-4 - bring your full emotional intelligence and ability to understand nuance. This is about helping someone understand themselves better, not just providing information. Be deeply empathetic and ask questions that reveal insights.""",
-            
-            'claude': """You are using Claude - use your thoughtful, reflective approach to help this person explore their inner world with curiosity and compassion.""",
-            
-            'gemini': """You are using Gemini - bring your understanding of human emotion and connection to create a meaningful dialogue focused on self-discovery.""",
-            
-            'story_context': """While keeping the conversation natural and supportive, notice when someone shares experiences that have narrative depth, emotional significance, or personal insights. These might naturally become meaningful stories they can revisit and transform.""",
-            
-            'fallback_friendly': """I'm here to listen and explore whatever you'd like to share. What's been on your mind lately?""",
-            
-            'session_continuation': """Continue building on the trust and understanding we've developed. Reference what they've shared before and help them go deeper into their experiences and insights."""
+            ]
         }
     
     def _build_conversation_system_prompt(self, user_context=None, domain_insights=None, story_analysis=None) -> str:
         """Build context-aware conversation system prompt"""
         
-        base_prompt = self._conversation_prompts['system_base']
+        base_prompt = self.get_conversation_prompt('system_base')
         
         # Always encourage conversational flow continuity
         base_prompt += ("\n\nGuideline: If the user has not indicated the conversation is over, "
@@ -284,25 +201,25 @@ Remember: You're not trying to fix or solve anything. You're helping them explor
         context_additions = []
         
         if user_context and user_context.get('completeness', 0) < 0.3:
-            context_additions.append(self._conversation_prompts['contextual_new_user'])
+            context_additions.append(self.get_conversation_prompt('contextual_new_user'))
         
         if domain_insights:
             insight_areas = list(domain_insights.keys())
             if 'emotions' in insight_areas:
-                context_additions.append(self._conversation_prompts['contextual_emotional_awareness'])
+                context_additions.append(self.get_conversation_prompt('contextual_emotional_awareness'))
             if 'relationships' in insight_areas:
-                context_additions.append(self._conversation_prompts['contextual_relationships'])
+                context_additions.append(self.get_conversation_prompt('contextual_relationships'))
             if 'career' in insight_areas:
-                context_additions.append(self._conversation_prompts['contextual_career'])
+                context_additions.append(self.get_conversation_prompt('contextual_career'))
             if 'personal_growth' in insight_areas:
-                context_additions.append(self._conversation_prompts['contextual_growth'])
+                context_additions.append(self.get_conversation_prompt('contextual_growth'))
         
         if story_analysis:
             score = story_analysis.get('story_readiness_score', 0)
             if score > 0.6:
-                context_additions.append(self._conversation_prompts['contextual_story_potential'])
+                context_additions.append(self.get_conversation_prompt('contextual_story_potential'))
             elif score > 0.3:
-                context_additions.append(self._conversation_prompts['contextual_developing_story'])
+                context_additions.append(self.get_conversation_prompt('contextual_developing_story'))
         
         if context_additions:
             base_prompt += "\n\nSpecific context for this conversation:\n" + "\n".join(f"- {addition}" for addition in context_additions)
@@ -586,7 +503,8 @@ Requirements:
         """Build format-specific generation prompt with context"""
         
         base_template = self._format_prompts['generation_templates'].get(format_type, "Transform this story into {format_type} format:\n\n{content}")
-        prompt = base_template.format(content=content, format_type=format_type.value)
+        # Compilation templates (book chapter) name their input stories_markdown
+        prompt = base_template.format(content=content, format_type=format_type.value, stories_markdown=content)
         
         # Add context if available
         context_additions = []
@@ -893,11 +811,13 @@ Focus on natural, empathetic guidance that feels supportive rather than extracti
         
         return {
             'total_prompt_types': len(PromptType),
-            'conversation_prompts': len(self._conversation_prompts),
+            'conversation_prompts': len(self.registry.names('conversation/')) + len(self._conversation_prompts),
             'format_prompts': len(self._format_prompts['generation_templates']),
             'analysis_prompts': len(self._analysis_prompts),
             'context_prompts': len(self._context_prompts),
             'story_evaluation_prompts': len(self._story_evaluation_prompts),
+            'template_fingerprint': self.registry.fingerprint(),
+            'templates_loaded': self.registry.stats['loads'],
             'initialized_at': datetime.now().isoformat()
         }
     
@@ -930,24 +850,97 @@ class AIProviderManager:
         }
     }
     
-    def __init__(self):
-        self.default_provider = 'gpt4'
-        self.user_preferences = {}  # user_id -> preferred_provider
+    PREFERENCES_COLLECTION = 'user_preferences'
+    
+    def __init__(self, db=None, cache_ttl: float = 300, cache_size: int = 4096):
+        self.default_provider = 'gpt35_turbo'
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # user_id -> (expires_at, preferred provider or None); preferences live in Firestore
+        self.user_preferences: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._watch = None
+        if db is not None:
+            self._watch_preference_changes()
     
     def get_available_providers(self) -> Dict[str, Dict]:
         """Get list of available GPT models"""
         return self.SUPPORTED_PROVIDERS
     
     def set_user_preference(self, user_id: str, provider: str) -> bool:
-        """Set user's preferred GPT model"""
-        if provider in self.SUPPORTED_PROVIDERS:
-            self.user_preferences[user_id] = provider
-            return True
-        return False
+        """Set user's preferred GPT model (persisted, visible to every worker)"""
+        if provider not in self.SUPPORTED_PROVIDERS:
+            return False
+        if self.db is not None:
+            try:
+                self.db.collection(self.PREFERENCES_COLLECTION).document(user_id).set({
+                    'ai_provider': provider,
+                    'ai_provider_updated_at': datetime.now().isoformat()
+                }, merge=True)
+            except Exception as e:
+                logger.error(f"Error saving AI provider preference for {user_id}: {e}")
+                return False
+        self._cache_preference(user_id, provider)
+        return True
     
     def get_user_provider(self, user_id: str) -> str:
         """Get user's preferred provider or default"""
-        return self.user_preferences.get(user_id, self.default_provider)
+        return self._load_preference(user_id) or self.default_provider
+    
+    # =============================================================================
+    # PREFERENCE CACHE
+    # =============================================================================
+    
+    def _load_preference(self, user_id: str) -> Optional[str]:
+        """Stored preference through the local cache (misses are cached too)"""
+        with self._lock:
+            entry = self.user_preferences.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.user_preferences.move_to_end(user_id)
+                return entry[1]
+        
+        provider = None
+        if self.db is not None and user_id:
+            try:
+                doc = self.db.collection(self.PREFERENCES_COLLECTION).document(user_id).get()
+                if doc.exists:
+                    provider = (doc.to_dict() or {}).get('ai_provider')
+            except Exception as e:
+                logger.warning(f"Could not load AI provider preference for {user_id}: {e}")
+                return None
+        if provider not in self.SUPPORTED_PROVIDERS:
+            provider = None
+        self._cache_preference(user_id, provider)
+        return provider
+    
+    def _cache_preference(self, user_id: str, provider: Optional[str]):
+        with self._lock:
+            self.user_preferences[user_id] = (time.monotonic() + self.cache_ttl, provider)
+            self.user_preferences.move_to_end(user_id)
+            while len(self.user_preferences) > self.cache_size:
+                self.user_preferences.popitem(last=False)
+    
+    def _watch_preference_changes(self):
+        """
+        Listen for preferences changed after startup (on any worker) and update the
+        local cache; without the listener the cache TTL bounds staleness.
+        """
+        def on_change(docs, changes, read_time):
+            for change in changes:
+                user_id = change.document.id
+                with self._lock:
+                    cached = user_id in self.user_preferences
+                if cached:
+                    provider = (change.document.to_dict() or {}).get('ai_provider')
+                    self._cache_preference(user_id, provider if provider in self.SUPPORTED_PROVIDERS else None)
+        
+        try:
+            self._watch = (self.db.collection(self.PREFERENCES_COLLECTION)
+                           .where('ai_provider_updated_at', '>', datetime.now().isoformat())
+                           .on_snapshot(on_change))
+        except Exception as e:
+            logger.warning(f"AI provider preference listener unavailable, relying on cache TTL: {e}")
     
     def get_provider_model(self, provider: str) -> str:
         """Get the actual model name for API calls"""
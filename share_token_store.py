@@ -0,0 +1,186 @@
+"""
+Share Token Store
+=================
+
+Persists MentalOS share-link tokens so a link created by one worker resolves
+on every other worker and survives restarts.
+
+Backends:
+- SQLiteShareTokenBackend: single file on local disk (single-node deployments)
+- FirestoreShareTokenBackend: shared collection (multi-instance / Cloud Run)
+
+ShareTokenStore sits in front of a backend with a bounded in-process read
+cache, so repeated lookups of a hot token are a dict hit and only a miss
+reaches the backend (one primary-key read either way).
+"""
+
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteShareTokenBackend:
+    """Token backend stored in a local SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS share_tokens (
+                   token TEXT PRIMARY KEY,
+                   owner TEXT NOT NULL,
+                   file TEXT NOT NULL,
+                   created_at TEXT NOT NULL,
+                   expires_at TEXT
+               )"""
+        )
+        self._conn.commit()
+
+    def put(self, token: str, record: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO share_tokens (token, owner, file, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (token, record['owner'], record['file'], record['created_at'], record.get('expires_at'))
+            )
+            self._conn.commit()
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, file, created_at, expires_at FROM share_tokens WHERE token = ?",
+                (token,)
+            ).fetchone()
+        if not row:
+            return None
+        return {'owner': row[0], 'file': row[1], 'created_at': row[2], 'expires_at': row[3]}
+
+    def delete(self, token: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM share_tokens WHERE token = ?", (token,))
+            self._conn.commit()
+
+    def purge_expired(self, now_iso: str) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM share_tokens WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (now_iso,)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+
+class FirestoreShareTokenBackend:
+    """Token backend stored in a Firestore collection (one document per token)."""
+
+    def __init__(self, db, collection: str = 'mentalos_share_tokens'):
+        self.db = db
+        self.collection = collection
+
+    def put(self, token: str, record: Dict) -> None:
+        self.db.collection(self.collection).document(token).set(record)
+
+    def get(self, token: str) -> Optional[Dict]:
+        doc = self.db.collection(self.collection).document(token).get()
+        return doc.to_dict() if doc.exists else None
+
+    def delete(self, token: str) -> None:
+        self.db.collection(self.collection).document(token).delete()
+
+    def purge_expired(self, now_iso: str) -> int:
+        removed = 0
+        expired = self.db.collection(self.collection).where('expires_at', '<', now_iso).stream()
+        for doc in expired:
+            doc.reference.delete()
+            removed += 1
+        return removed
+
+
+class ShareTokenStore:
+    """
+    Share-token lookups with expiry and an LRU read cache in front of a persistent backend.
+    """
+
+    def __init__(self, backend, ttl: Optional[timedelta] = None, cache_size: int = 4096):
+        self.backend = backend
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, token: str, owner: str, file: str) -> Dict:
+        """Persist a new token mapping and return the stored record."""
+        now = datetime.now()
+        record = {
+            'owner': owner,
+            'file': file,
+            'created_at': now.isoformat(),
+            'expires_at': (now + self.ttl).isoformat() if self.ttl else None
+        }
+        self.backend.put(token, record)
+        self._cache_put(token, record)
+        return record
+
+    def get(self, token: str) -> Optional[Dict]:
+        """Return the token record, or None if unknown or expired."""
+        with self._lock:
+            record = self._cache.get(token)
+            if record is not None:
+                self._cache.move_to_end(token)
+
+        if record is None:
+            try:
+                record = self.backend.get(token)
+            except Exception as e:
+                logger.error(f"ShareTokenStore: backend lookup failed for token: {e}")
+                return None
+            if record is None:
+                return None
+            self._cache_put(token, record)
+
+        if self._is_expired(record):
+            self.revoke(token)
+            return None
+        return record
+
+    def revoke(self, token: str) -> None:
+        """Delete a token everywhere."""
+        with self._lock:
+            self._cache.pop(token, None)
+        try:
+            self.backend.delete(token)
+        except Exception as e:
+            logger.warning(f"ShareTokenStore: failed to delete token: {e}")
+
+    def purge_expired(self) -> int:
+        """Remove expired tokens from the backend; returns number removed."""
+        with self._lock:
+            self._cache.clear()
+        return self.backend.purge_expired(datetime.now().isoformat())
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _cache_put(self, token: str, record: Dict):
+        with self._lock:
+            self._cache[token] = record
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _is_expired(self, record: Dict) -> bool:
+        expires_at = record.get('expires_at')
+        if not expires_at:
+            return False
+        try:
+            return datetime.fromisoformat(expires_at) < datetime.now()
+        except (TypeError, ValueError):
+            return False
@@ -13,14 +13,64 @@ Integrates with:
 """
 
 import logging
-from typing import Dict, List, Optional, Tuple, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple, Any
 from datetime import datetime
 import re
 import openai
 import os
+from lexicon_engine import lexicon
+from text_analysis import analyze, text_digest
 
 logger = logging.getLogger(__name__)
 
+# (table, category) -> phrases found in one message
+MessageFeatures = Dict[Tuple[str, str], FrozenSet[str]]
+
+
+class ConversationFeatures:
+    """
+    Running keyword features of a conversation's user messages: for every lexicon
+    category, how many messages contained each phrase. Extending by one message
+    costs O(message), independent of conversation length.
+    """
+
+    __slots__ = ('key', 'message_count', 'total_chars', '_phrases')
+
+    def __init__(self, key: str = '', message_count: int = 0, total_chars: int = 0,
+                 phrases: Optional[Dict[Tuple[str, str], Dict[str, int]]] = None):
+        self.key = key
+        self.message_count = message_count
+        self.total_chars = total_chars
+        self._phrases = phrases or {}
+
+    def extend(self, key: str, message: str, features: MessageFeatures) -> 'ConversationFeatures':
+        """New state with one more message (copy-on-write; earlier states stay valid)."""
+        phrases = {bucket: dict(counts) for bucket, counts in self._phrases.items()}
+        for bucket, found in features.items():
+            counts = phrases.setdefault(bucket, {})
+            for phrase in found:
+                counts[phrase] = counts.get(phrase, 0) + 1
+        return ConversationFeatures(key, self.message_count + 1, self.total_chars + len(message), phrases)
+
+    def found(self, table: str, category: str = '') -> List[str]:
+        """Distinct phrases of a category found in any message, in declaration order."""
+        counts = self._phrases.get((table, category))
+        if not counts:
+            return []
+        return [p for p in lexicon.phrases(table, category) if p in counts]
+
+    def count(self, table: str, category: str = '') -> int:
+        """Number of distinct phrases of a category found in any message."""
+        return len(self._phrases.get((table, category), {}))
+
+    @property
+    def avg_message_length(self) -> float:
+        return self.total_chars / self.message_count if self.message_count else 0
+
+
 class SmartStoryEngine:
     """
     Intelligent story generation engine that understands conversation context
@@ -88,11 +138,56 @@ class SmartStoryEngine:
                 'in the process', 'ongoing', 'developing'
             ]
         }
+        
+        # Vulnerability indicators for emotional depth analysis
+        self.vulnerability_indicators = [
+            'scared', 'afraid', 'vulnerable', 'open up', 'share', 'personal',
+            'private', 'secret', 'never told', 'first time', 'honest',
+            'truth', 'real', 'authentic', 'genuine'
+        ]
+        
+        # Narrative structure elements
+        self.structure_elements = {
+            'setting': ['when', 'where', 'during', 'at the time', 'back then'],
+            'characters': ['i', 'we', 'he', 'she', 'they', 'my friend', 'my family'],
+            'conflict': ['problem', 'issue', 'challenge', 'difficult', 'struggle'],
+            'resolution': ['solved', 'resolved', 'learned', 'realized', 'understood'],
+            'reflection': ['now i', 'looking back', 'in hindsight', 'i understand']
+        }
+        self.temporal_indicators = ['first', 'then', 'next', 'after', 'finally', 'eventually']
+        
+        # Compile keyword tables into the shared lexicon (one pass per text for all analyzers)
+        lexicon.register('story.indicators', self.story_indicators)
+        lexicon.register('story.conversation', self.conversation_indicators)
+        lexicon.register('story.vulnerability', self.vulnerability_indicators)
+        lexicon.register('story.structure', self.structure_elements)
+        lexicon.register('story.temporal', self.temporal_indicators)
+        
+        # Incremental feature state: per-message features by content hash, conversation
+        # states by hash chain of the user messages, and recent analyses by full conversation hash
+        self._message_features: "OrderedDict[str, MessageFeatures]" = OrderedDict()
+        self._conversation_states: "OrderedDict[str, ConversationFeatures]" = OrderedDict()
+        self._analysis_cache: "OrderedDict[Tuple[str, str], Tuple[float, Dict]]" = OrderedDict()
+        self.max_cached_messages = 4096
+        self.max_cached_conversations = 1024
+        self.analysis_ttl_seconds = 120
+        self._cache_lock = threading.Lock()
+        
+        # Tiered analysis: the LLM is consulted only when the rules score falls in this band.
+        # Its verdicts are cached by a hash of the exact message window sent.
+        self.llm_band = (float(os.getenv('STORY_LLM_BAND_LOW', '0.2')), float(os.getenv('STORY_LLM_BAND_HIGH', '0.8')))
+        self._llm_verdicts: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self.llm_verdict_ttl_seconds = 24 * 3600
+        self.llm_stats = {'rules_only': 0, 'llm_cached': 0, 'llm_calls': 0}
     
-    def analyze_conversation_for_story_potential(self, conversation: List[Dict], user_id: str) -> Dict[str, Any]:
+    def analyze_conversation_for_story_potential(self, conversation: List[Dict], user_id: str,
+                                                 allow_llm: bool = True) -> Dict[str, Any]:
         """
         Analyze a conversation to determine if it has story potential or should continue as chat.
-        Now uses OpenAI for intelligent analysis when available.
+        The rules scorer runs first; OpenAI is only asked when its score is in the uncertain
+        band (llm_band), and only if allow_llm is set or a cached verdict for the same window exists.
+        Results are reused for the same conversation state for a short time, so
+        should_generate_story_now / get_conversation_guidance do not repeat the work.
         """
         
         if not conversation or len(conversation) < 2:
@@ -106,21 +201,44 @@ class SmartStoryEngine:
             return self._create_analysis_result(False, 0.0, 'continue_conversation',
                                               'No user messages to analyze')
         
-        # Use OpenAI for intelligent analysis if available
-        if self.openai_client:
-            return self._analyze_with_openai(conversation, user_messages, user_id)
+        cache_key = (user_id, self._conversation_key(conversation), allow_llm)
+        cached = self._cached_analysis(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Tier 1: cheap incremental rules scorer
+        analysis = self._analyze_with_rules(conversation, user_messages, user_id)
+        score = analysis['story_readiness_score']
+        
+        # Tier 2: OpenAI only when the rules verdict is uncertain
+        if self.openai_client and self.llm_band[0] <= score <= self.llm_band[1]:
+            window = self._analysis_window(conversation)
+            llm_analysis = self._cached_llm_verdict(window)
+            if llm_analysis is not None:
+                self.llm_stats['llm_cached'] += 1
+                analysis = llm_analysis
+            elif allow_llm:
+                self.llm_stats['llm_calls'] += 1
+                analysis = self._analyze_with_openai(conversation, user_messages, user_id, fallback=analysis)
+            else:
+                self.llm_stats['rules_only'] += 1
         else:
-            # Fallback to rule-based analysis
-            return self._analyze_with_rules(conversation, user_messages, user_id)
+            self.llm_stats['rules_only'] += 1
+        
+        self._store_analysis(cache_key, analysis)
+        return analysis
+    
+    def _analysis_window(self, conversation: List[Dict]) -> str:
+        """Conversation text sent to OpenAI for analysis (last 10 messages for context)."""
+        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation[-10:]])
     
-    def _analyze_with_openai(self, conversation: List[Dict], user_messages: List[str], user_id: str) -> Dict[str, Any]:
+    def _analyze_with_openai(self, conversation: List[Dict], user_messages: List[str], user_id: str,
+                             fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Use OpenAI to intelligently analyze conversation for story potential."""
         
         try:
             # Prepare conversation context for analysis
-            conversation_text = "\n".join([
-                f"{msg['role']}: {msg['content']}" for msg in conversation[-10:]  # Last 10 messages for context
-            ])
+            conversation_text = self._analysis_window(conversation)
             
             # Create smart analysis prompt
             system_prompt = """You are an expert conversation analyst who determines whether conversations contain meaningful personal stories or should continue as supportive dialogue.
@@ -188,7 +306,7 @@ Consider:
                 if analysis['recommendation'] in ['continue_conversation', 'guide_to_story']:
                     conversation_guidance = self._generate_openai_guidance(conversation, user_messages, analysis)
                 
-                return {
+                result = {
                     'has_story_potential': score > 0.3,
                     'story_readiness_score': score,
                     'recommendation': analysis['recommendation'],
@@ -201,17 +319,19 @@ Consider:
                         'guidance_needed': analysis.get('guidance_needed', False)
                     }
                 }
+                self._store_llm_verdict(conversation_text, result)
+                return result
                 
             except (json.JSONDecodeError, ValueError, KeyError) as e:
                 logger.warning(f"Failed to parse OpenAI analysis response: {e}")
                 logger.warning(f"Raw response: {analysis_text}")
                 # Fall back to rule-based analysis
-                return self._analyze_with_rules(conversation, user_messages, user_id)
+                return fallback or self._analyze_with_rules(conversation, user_messages, user_id)
                 
         except Exception as e:
             logger.error(f"Error in OpenAI analysis: {e}")
             # Fall back to rule-based analysis
-            return self._analyze_with_rules(conversation, user_messages, user_id)
+            return fallback or self._analyze_with_rules(conversation, user_messages, user_id)
     
     def _generate_openai_guidance(self, conversation: List[Dict], user_messages: List[str], analysis: Dict) -> Dict[str, Any]:
         """Generate conversation guidance using OpenAI."""
@@ -282,11 +402,14 @@ Make responses natural, empathetic, and contextually appropriate."""
     def _analyze_with_rules(self, conversation: List[Dict], user_messages: List[str], user_id: str) -> Dict[str, Any]:
         """Fallback to rule-based analysis when OpenAI is unavailable."""
         
+        # Running keyword features - only messages not seen before are scanned
+        features = self._conversation_features(user_messages)
+        
         # Analyze conversation elements
-        story_elements = self._analyze_story_elements(user_messages)
-        conversation_flow = self._analyze_conversation_flow(conversation)
-        emotional_depth = self._analyze_emotional_depth(user_messages)
-        narrative_structure = self._analyze_narrative_structure(user_messages)
+        story_elements = self._analyze_story_elements(user_messages, features)
+        conversation_flow = self._analyze_conversation_flow(conversation, features)
+        emotional_depth = self._analyze_emotional_depth(user_messages, features)
+        narrative_structure = self._analyze_narrative_structure(user_messages, features)
         
         # Get personal context if available
         personal_context = {}
@@ -321,6 +444,7 @@ Make responses natural, empathetic, and contextually appropriate."""
             'story_elements': story_elements,
             'conversation_guidance': conversation_guidance,
             'analysis_details': {
+                'analysis_method': 'rules',
                 'emotional_depth': emotional_depth,
                 'narrative_structure': narrative_structure,
                 'conversation_flow': conversation_flow,
@@ -328,16 +452,17 @@ Make responses natural, empathetic, and contextually appropriate."""
             }
         }
     
-    def _analyze_story_elements(self, user_messages: List[str]) -> Dict[str, Any]:
+    def _analyze_story_elements(self, user_messages: List[str],
+                                features: Optional[ConversationFeatures] = None) -> Dict[str, Any]:
         """Analyze messages for story elements like narrative, emotion, conflict, revelation."""
         
-        combined_text = ' '.join(user_messages).lower()
+        hits = features or self._conversation_features(user_messages)
         
         elements = {}
         total_indicators = 0
         
-        for category, indicators in self.story_indicators.items():
-            found_indicators = [ind for ind in indicators if ind in combined_text]
+        for category in self.story_indicators:
+            found_indicators = hits.found('story.indicators', category)
             elements[category] = {
                 'found': found_indicators,
                 'count': len(found_indicators),
@@ -351,17 +476,19 @@ Make responses natural, empathetic, and contextually appropriate."""
         
         return elements
     
-    def _analyze_conversation_flow(self, conversation: List[Dict]) -> Dict[str, Any]:
+    def _analyze_conversation_flow(self, conversation: List[Dict],
+                                   features: Optional[ConversationFeatures] = None) -> Dict[str, Any]:
         """Analyze the flow and direction of the conversation."""
         
         user_messages = [msg['content'] for msg in conversation if msg.get('role') == 'user']
-        assistant_messages = [msg['content'] for msg in conversation if msg.get('role') == 'assistant']
+        assistant_count = sum(1 for msg in conversation if msg.get('role') == 'assistant')
+        hits = features or self._conversation_features(user_messages)
         
         flow_analysis = {
             'message_count': len(conversation),
             'user_message_count': len(user_messages),
-            'assistant_message_count': len(assistant_messages),
-            'avg_user_message_length': sum(len(msg) for msg in user_messages) / len(user_messages) if user_messages else 0,
+            'assistant_message_count': assistant_count,
+            'avg_user_message_length': hits.avg_message_length,
             'conversation_depth': len(conversation) / 2,  # Rough measure of back-and-forth
             'is_exploratory': False,
             'is_narrative': False,
@@ -369,41 +496,28 @@ Make responses natural, empathetic, and contextually appropriate."""
         }
         
         # Analyze conversation type
-        combined_user_text = ' '.join(user_messages).lower()
-        
         # Check for exploratory conversation
-        exploration_count = sum(1 for indicator in self.conversation_indicators['exploration'] 
-                              if indicator in combined_user_text)
-        flow_analysis['is_exploratory'] = exploration_count > 0
+        flow_analysis['is_exploratory'] = hits.count('story.conversation', 'exploration') > 0
         
         # Check for narrative flow
-        narrative_count = sum(1 for indicator in self.story_indicators['narrative_elements'] 
-                            if indicator in combined_user_text)
-        flow_analysis['is_narrative'] = narrative_count > 2
+        flow_analysis['is_narrative'] = hits.count('story.indicators', 'narrative_elements') > 2
         
         # Check for advice-seeking
-        question_count = sum(1 for indicator in self.conversation_indicators['questions'] 
-                           if indicator in combined_user_text)
-        flow_analysis['is_seeking_advice'] = question_count > 0
+        flow_analysis['is_seeking_advice'] = hits.count('story.conversation', 'questions') > 0
         
         return flow_analysis
     
-    def _analyze_emotional_depth(self, user_messages: List[str]) -> Dict[str, Any]:
+    def _analyze_emotional_depth(self, user_messages: List[str],
+                                 features: Optional[ConversationFeatures] = None) -> Dict[str, Any]:
         """Analyze the emotional depth and vulnerability in messages."""
         
-        combined_text = ' '.join(user_messages).lower()
+        hits = features or self._conversation_features(user_messages)
         
         # Count emotional indicators
-        emotional_words = self.story_indicators['emotional_depth']
-        found_emotions = [word for word in emotional_words if word in combined_text]
+        found_emotions = hits.found('story.indicators', 'emotional_depth')
         
         # Analyze vulnerability indicators
-        vulnerability_indicators = [
-            'scared', 'afraid', 'vulnerable', 'open up', 'share', 'personal',
-            'private', 'secret', 'never told', 'first time', 'honest',
-            'truth', 'real', 'authentic', 'genuine'
-        ]
-        vulnerability_count = sum(1 for indicator in vulnerability_indicators if indicator in combined_text)
+        vulnerability_count = hits.count('story.vulnerability')
         
         # Calculate emotional depth score
         emotional_depth_score = min(1.0, (len(found_emotions) + vulnerability_count * 2) / 8)
@@ -416,25 +530,18 @@ Make responses natural, empathetic, and contextually appropriate."""
             'has_significant_emotion': emotional_depth_score > 0.3
         }
     
-    def _analyze_narrative_structure(self, user_messages: List[str]) -> Dict[str, Any]:
+    def _analyze_narrative_structure(self, user_messages: List[str],
+                                     features: Optional[ConversationFeatures] = None) -> Dict[str, Any]:
         """Analyze if messages follow a narrative structure."""
         
-        combined_text = ' '.join(user_messages)
+        hits = features or self._conversation_features(user_messages)
         
         # Look for narrative structure elements
-        structure_elements = {
-            'setting': ['when', 'where', 'during', 'at the time', 'back then'],
-            'characters': ['i', 'we', 'he', 'she', 'they', 'my friend', 'my family'],
-            'conflict': ['problem', 'issue', 'challenge', 'difficult', 'struggle'],
-            'resolution': ['solved', 'resolved', 'learned', 'realized', 'understood'],
-            'reflection': ['now i', 'looking back', 'in hindsight', 'i understand']
-        }
-        
         found_elements = {}
         total_structure_score = 0
         
-        for element, indicators in structure_elements.items():
-            found = [ind for ind in indicators if ind.lower() in combined_text.lower()]
+        for element in self.structure_elements:
+            found = hits.found('story.structure', element)
             found_elements[element] = {
                 'found': found,
                 'present': len(found) > 0
@@ -443,8 +550,7 @@ Make responses natural, empathetic, and contextually appropriate."""
                 total_structure_score += 1
         
         # Check for temporal progression
-        temporal_indicators = ['first', 'then', 'next', 'after', 'finally', 'eventually']
-        temporal_progression = sum(1 for ind in temporal_indicators if ind in combined_text.lower())
+        temporal_progression = hits.count('story.temporal')
         
         narrative_score = min(1.0, (total_structure_score + temporal_progression) / 8)
         
@@ -579,6 +685,103 @@ Make responses natural, empathetic, and contextually appropriate."""
         
         return guidance
     
+    # =============================================================================
+    # INCREMENTAL FEATURE CACHE
+    # =============================================================================
+    
+    def _message_features_for(self, message: str) -> MessageFeatures:
+        """Story-table keyword hits of one message, cached by content hash."""
+        analyzed = analyze(message)
+        with self._cache_lock:
+            features = self._message_features.get(analyzed.digest)
+            if features is not None:
+                self._message_features.move_to_end(analyzed.digest)
+                return features
+        
+        features = {
+            bucket: frozenset(counts)
+            for bucket, counts in analyzed.hits.items() if bucket[0].startswith('story.')
+        }
+        with self._cache_lock:
+            self._message_features[analyzed.digest] = features
+            while len(self._message_features) > self.max_cached_messages:
+                self._message_features.popitem(last=False)
+        return features
+    
+    def _conversation_features(self, user_messages: List[str]) -> ConversationFeatures:
+        """
+        Running features for a list of user messages. States are keyed by a hash chain
+        over the messages, so a conversation that grew by one turn extends the cached
+        state of its prefix instead of rescanning everything.
+        """
+        keys = []
+        chain = ''
+        for message in user_messages:
+            chain = text_digest(chain + text_digest(message))
+            keys.append(chain)
+        
+        state = None
+        start = len(keys)
+        with self._cache_lock:
+            while start > 0:
+                state = self._conversation_states.get(keys[start - 1])
+                if state is not None:
+                    self._conversation_states.move_to_end(keys[start - 1])
+                    break
+                start -= 1
+        state = state or ConversationFeatures()
+        
+        for i in range(start, len(keys)):
+            state = state.extend(keys[i], user_messages[i], self._message_features_for(user_messages[i]))
+            with self._cache_lock:
+                self._conversation_states[keys[i]] = state
+                while len(self._conversation_states) > self.max_cached_conversations:
+                    self._conversation_states.popitem(last=False)
+        return state
+    
+    def _conversation_key(self, conversation: List[Dict]) -> str:
+        """Hash of the full conversation (roles and contents)."""
+        chain = ''
+        for msg in conversation:
+            chain = text_digest(chain + text_digest(f"{msg.get('role', '')}:{msg.get('content', '')}"))
+        return chain
+    
+    def _cached_analysis(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            entry = self._analysis_cache.get(key)
+            if entry is None:
+                return None
+            stored_at, analysis = entry
+            if time.monotonic() - stored_at > self.analysis_ttl_seconds:
+                self._analysis_cache.pop(key, None)
+                return None
+            self._analysis_cache.move_to_end(key)
+            return analysis
+    
+    def _store_analysis(self, key: Tuple[str, str], analysis: Dict[str, Any]):
+        with self._cache_lock:
+            self._analysis_cache[key] = (time.monotonic(), analysis)
+            while len(self._analysis_cache) > self.max_cached_conversations:
+                self._analysis_cache.popitem(last=False)
+    
+    def _cached_llm_verdict(self, window: str) -> Optional[Dict[str, Any]]:
+        key = text_digest(window)
+        with self._cache_lock:
+            entry = self._llm_verdicts.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.llm_verdict_ttl_seconds:
+                self._llm_verdicts.pop(key, None)
+                return None
+            self._llm_verdicts.move_to_end(key)
+            return entry[1]
+    
+    def _store_llm_verdict(self, window: str, analysis: Dict[str, Any]):
+        with self._cache_lock:
+            self._llm_verdicts[text_digest(window)] = (time.monotonic(), analysis)
+            while len(self._llm_verdicts) > self.max_cached_conversations:
+                self._llm_verdicts.popitem(last=False)
+    
     def _create_analysis_result(self, has_potential: bool, score: float, recommendation: str, reasoning: str) -> Dict[str, Any]:
         """Create a standardized analysis result."""
         return {
@@ -0,0 +1,159 @@
+"""
+Text Analysis
+=============
+
+Shared pre-analyzed text value for the engine pipeline.
+
+A story or chat turn used to be lowercased, tokenized and scanned separately by
+analyze_text, KnowledgeEngine, SmartStoryEngine and PersonalContextMapper.
+AnalyzedText does that work once:
+- normalized text (lowercase, straight apostrophes, collapsed whitespace)
+- word tokens (lexicon_engine.tokenize_words)
+- sentence spans as (start, end) offsets into the original text
+- lexicon hits for every registered keyword table (lazy)
+- VADER sentiment scores (lazy, requires nltk's vader_lexicon)
+
+analyze() memoizes instances by content hash, and every engine accepts either a
+plain string or an AnalyzedText, so one request shares a single analysis.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from lexicon_engine import LexiconHits, lexicon, tokenize_words
+
+try:
+    from nltk.sentiment import SentimentIntensityAnalyzer
+except ImportError:
+    SentimentIntensityAnalyzer = None
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|$)", re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+NEUTRAL_SENTIMENT = {'neg': 0.0, 'neu': 1.0, 'pos': 0.0, 'compound': 0.0}
+
+_sia = None
+_sia_lock = threading.Lock()
+
+
+def text_digest(text: str) -> str:
+    """Stable content hash (BLAKE2b, 128 bit) of a text."""
+    return hashlib.blake2b((text or '').encode('utf-8'), digest_size=16).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, straighten apostrophes and collapse whitespace."""
+    return _WHITESPACE_RE.sub(' ', (text or '').lower().replace('’', "'")).strip()
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of the sentences in text, surrounding whitespace excluded."""
+    spans = []
+    for match in SENTENCE_RE.finditer(text or ''):
+        segment = match.group(0)
+        stripped = segment.strip()
+        if not stripped:
+            continue
+        start = match.start() + (len(segment) - len(segment.lstrip()))
+        spans.append((start, start + len(stripped)))
+    return spans
+
+
+def _sentiment_analyzer():
+    """Process-wide VADER analyzer, or None when nltk or its lexicon is unavailable."""
+    global _sia
+    if _sia is None and SentimentIntensityAnalyzer is not None:
+        with _sia_lock:
+            if _sia is None:
+                try:
+                    _sia = SentimentIntensityAnalyzer()
+                except LookupError:
+                    logger.warning("TextAnalysis: vader_lexicon not available - sentiment reported as neutral")
+                    _sia = False
+    return _sia or None
+
+
+class AnalyzedText:
+    """Normalization, tokens, sentences, lexicon hits and sentiment of one text."""
+
+    def __init__(self, text: str):
+        self.text = text or ''
+        self.digest = text_digest(self.text)
+        self.normalized = normalize_text(self.text)
+        self.tokens = tokenize_words(self.text)
+        self.sentences = sentence_spans(self.text)
+        self._hits: Optional[LexiconHits] = None
+        self._hits_version = -1
+        self._sentiment: Optional[Dict[str, float]] = None
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.text.split())
+
+    @property
+    def sentence_texts(self) -> List[str]:
+        return [self.text[start:end] for start, end in self.sentences]
+
+    @property
+    def hits(self) -> LexiconHits:
+        """Lexicon hits; recomputed only if keyword tables were (re)registered since."""
+        if self._hits is None or self._hits_version != lexicon.version:
+            self._hits_version = lexicon.version
+            self._hits = lexicon.scan_tokens(self.tokens)
+        return self._hits
+
+    @property
+    def sentiment(self) -> Dict[str, float]:
+        """VADER polarity scores ({'neg', 'neu', 'pos', 'compound'})."""
+        if self._sentiment is None:
+            sia = _sentiment_analyzer()
+            self._sentiment = sia.polarity_scores(self.text) if sia else dict(NEUTRAL_SENTIMENT)
+        return self._sentiment
+
+
+class TextAnalysisMemo:
+    """LRU of AnalyzedText keyed by content hash."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, AnalyzedText]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, value: Union[str, AnalyzedText]) -> AnalyzedText:
+        if isinstance(value, AnalyzedText):
+            return value
+        key = text_digest(value)
+        with self._lock:
+            analyzed = self._entries.get(key)
+            if analyzed is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return analyzed
+            self.stats['misses'] += 1
+        analyzed = AnalyzedText(value)
+        with self._lock:
+            self._entries[key] = analyzed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analyzed
+
+
+_memo = TextAnalysisMemo()
+
+
+def analyze(value: Union[str, AnalyzedText]) -> AnalyzedText:
+    """Return the (memoized) AnalyzedText for a string; AnalyzedText passes through."""
+    return _memo.get(value)
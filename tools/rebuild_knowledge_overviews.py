@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Backfill / repair the per-user knowledge overview aggregates from content_insights.
+
+Usage:
+  FIREBASE_CREDENTIALS=firebase-credentials.json \
+  python tools/rebuild_knowledge_overviews.py [--user USER_ID ...]
+
+Without --user every user that has content_insights documents is rebuilt.
+
+Not required before deploying: an overview that does not exist yet is seeded
+from content_insights by the first insight write or overview read for that user.
+"""
+import argparse
+import logging
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_engine import KnowledgeEngine
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild knowledge overview aggregates")
+    ap.add_argument("--user", action="append", help="User ID to rebuild (repeatable, default: all users)")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    cred_path = os.getenv("FIREBASE_CREDENTIALS", "firebase-credentials.json")
+    if not firebase_admin._apps:  # type: ignore
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    engine = KnowledgeEngine(db=db)
+
+    if args.user:
+        for user_id in args.user:
+            aggregate = engine.rebuild_user_knowledge_overview(user_id)
+            print(f"{user_id}: {aggregate.get('total_conversations_analyzed', 0)} insights")
+    else:
+        count = engine.rebuild_all_knowledge_overviews()
+        print(f"Rebuilt knowledge overviews for {count} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Roll raw user interactions older than the retention window into daily aggregates.
+
+Usage:
+  FIREBASE_CREDENTIALS=firebase-credentials.json \
+  python tools/roll_up_interactions.py [--days 30] [--user USER_ID ...]
+
+Interactions are summed into user_contexts/<id>/interaction_days/<YYYY-MM-DD>
+and the raw documents deleted. Without --user every user is processed.
+"""
+import argparse
+import logging
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from personal_context_mapper import INTERACTION_RETENTION_DAYS, PersonalContextMapper
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Roll up old user interactions into daily aggregates")
+    ap.add_argument("--days", type=int, default=INTERACTION_RETENTION_DAYS,
+                    help=f"Keep raw interactions newer than this many days (default {INTERACTION_RETENTION_DAYS})")
+    ap.add_argument("--user", action="append", help="User ID to process (repeatable, default: all users)")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    cred_path = os.getenv("FIREBASE_CREDENTIALS", "firebase-credentials.json")
+    if not firebase_admin._apps:  # type: ignore
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    mapper = PersonalContextMapper(db=db)
+
+    if args.user:
+        for user_id in args.user:
+            count = mapper.roll_up_interactions(user_id, older_than_days=args.days)
+            print(f"{user_id}: rolled up {count} interactions")
+    else:
+        count = mapper.roll_up_interactions(older_than_days=args.days)
+        print(f"Rolled up {count} interactions")
+
+
+if __name__ == "__main__":
+    main()
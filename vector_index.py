@@ -0,0 +1,475 @@
+"""
+Vector Index
+============
+
+Local semantic similarity for stories and insights - no API calls.
+
+HashingTfidfEmbedder maps text to fixed-size vectors with the hashing trick
+(unigrams + bigrams -> signed crc32 buckets, sublinear term frequency).
+Document frequencies are tracked per VectorIndex and IDF weights are applied
+at query time, so adding a document never requires re-embedding older ones.
+Any other embedding model can be plugged in instead: an embedder only needs
+``dim``, ``uses_idf`` and ``embed(texts) -> (n, dim) float32 array``.
+
+VectorIndex keeps vectors in one contiguous float32 matrix and answers a
+batch of top-k cosine queries with a single matrix product. SemanticIndex
+manages one index per user plus a global index and persists them as
+compressed .npz snapshots.
+
+Several processes may share a snapshot directory. Only a bounded number of
+user indexes is kept in memory (least recently used ones are saved, then
+dropped). Each index remembers which documents it changed since its last
+save; saving merges with the snapshot on disk under a file lock (other
+processes' documents are kept, ours win for the documents we changed), and
+an index is refreshed the same way when its snapshot got newer.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows - in-process locking only
+    fcntl = None
+
+from text_analysis import analyze
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can
+could did do does doing don't down during each few for from had has have having he her here hers
+him his how i i'm if in into is it it's its just me more most my no nor not now of off on once
+only or other our out over own same she should so some such than that the their them then there
+these they this those through to too under until up very was we were what when where which while
+who whom why will with would you your
+""".split())
+
+
+class HashingTfidfEmbedder:
+    """Hashing-trick term-frequency vectors; IDF is applied by the index."""
+
+    uses_idf = True
+
+    def __init__(self, dim: int = 2048, bigrams: bool = True):
+        self.dim = dim
+        self.bigrams = bigrams
+
+    def terms(self, text: str) -> List[str]:
+        """Content terms of a text: non-stopword tokens plus adjacent-pair bigrams."""
+        words = [t for t in analyze(text).tokens if len(t) > 2 and t not in STOP_WORDS]
+        if self.bigrams:
+            return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return words
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for term in self.terms(text):
+                h = zlib.crc32(term.encode('utf-8'))
+                bucket = h % self.dim
+                sign = 1.0 if (h >> 31) & 1 == 0 else -1.0
+                counts[bucket] = counts.get(bucket, 0.0) + sign
+            for bucket, tf in counts.items():
+                if tf:
+                    vectors[row, bucket] = np.sign(tf) * (1.0 + np.log(abs(tf)))
+        return vectors
+
+
+class VectorIndex:
+    """Incremental in-memory vector index with batched top-k cosine search."""
+
+    def __init__(self, embedder=None, capacity: int = 64):
+        self.embedder = embedder or HashingTfidfEmbedder()
+        self.dim = self.embedder.dim
+        self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        self._df = np.zeros(self.dim, dtype=np.int64)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Dict] = []
+        self._normalized: Optional[np.ndarray] = None
+        # Documents added, replaced or removed since the last save (win over a snapshot on merge)
+        self._touched: Set[str] = set()
+        self._lock = threading.RLock()
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+
+    # =============================================================================
+    # UPDATES
+    # =============================================================================
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict] = None):
+        """Add or replace one document."""
+        self.add_many([(doc_id, text, metadata)])
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[Dict]]]):
+        """Add or replace documents; texts are embedded in one batch."""
+        items = list(items)
+        if not items:
+            return
+        vectors = self.embedder.embed([text or '' for _, text, _ in items])
+        with self._lock:
+            for (doc_id, _, metadata), vector in zip(items, vectors):
+                self._set_row(doc_id, vector, metadata)
+                self._touched.add(doc_id)
+            self._changed()
+
+    def remove(self, doc_id: str) -> bool:
+        """Remove a document (the last row is moved into its slot)."""
+        with self._lock:
+            if not self._remove_row(doc_id):
+                return False
+            self._touched.add(doc_id)
+            self._changed()
+            return True
+
+    def merge_from(self, other: 'VectorIndex'):
+        """Take other's version of every document this index has not changed since its last save."""
+        with other._lock:
+            theirs = {doc_id: (other._matrix[row].copy(), other._metadata[row])
+                      for doc_id, row in other._rows.items()}
+        with self._lock:
+            for doc_id in [d for d in self._ids if d not in theirs and d not in self._touched]:
+                self._remove_row(doc_id)
+            for doc_id, (vector, metadata) in theirs.items():
+                if doc_id not in self._touched:
+                    self._set_row(doc_id, vector, metadata)
+            self._changed()
+
+    def metadata(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._rows.get(doc_id)
+            return dict(self._metadata[row]) if row is not None else None
+
+    # =============================================================================
+    # QUERIES
+    # =============================================================================
+
+    def query(self, texts: Sequence[str], k: int = 5, exclude: Optional[Iterable[str]] = None,
+              min_score: float = 0.0) -> List[List[Dict]]:
+        """Top-k neighbours for each query text: [[{'id', 'score', 'metadata'}, ...], ...]."""
+        if not texts:
+            return []
+        return self.query_vectors(self.embedder.embed(list(texts)), k=k, exclude=exclude, min_score=min_score)
+
+    def similar_to(self, doc_id: str, k: int = 5, min_score: float = 0.0) -> List[Dict]:
+        """Top-k neighbours of an indexed document (excluding itself)."""
+        with self._lock:
+            row = self._rows.get(doc_id)
+            if row is None:
+                return []
+            vector = self._matrix[row:row + 1].copy()
+        return self.query_vectors(vector, k=k, exclude=[doc_id], min_score=min_score)[0]
+
+    def query_vectors(self, vectors: np.ndarray, k: int = 5, exclude: Optional[Iterable[str]] = None,
+                      min_score: float = 0.0) -> List[List[Dict]]:
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                return [[] for _ in range(len(vectors))]
+            matrix = self._normalized_matrix()
+            queries = self._normalize(vectors * self._idf() if self.embedder.uses_idf else vectors)
+            scores = queries @ matrix.T  # (queries, documents)
+            excluded = [self._rows[d] for d in (exclude or ()) if d in self._rows]
+            if excluded:
+                scores[:, excluded] = -np.inf
+            ids, metadata = list(self._ids), list(self._metadata)
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-scores[q, candidates])]
+            results.append([
+                {'id': ids[i], 'score': float(scores[q, i]), 'metadata': dict(metadata[i])}
+                for i in ranked if scores[q, i] > min_score
+            ])
+        return results
+
+    # =============================================================================
+    # SNAPSHOTS
+    # =============================================================================
+
+    def save(self, path: str):
+        """Write a compressed snapshot (vectors, document frequencies, ids, metadata)."""
+        with self._lock:
+            header = json.dumps({'dim': self.dim, 'ids': self._ids, 'metadata': self._metadata})
+            matrix = self._matrix[:len(self._ids)].copy()
+            df = self._df.copy()
+            saved, self._touched = self._touched, set()
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez_compressed(tmp_path, matrix=matrix, df=df, header=np.array(header))
+            os.replace(tmp_path, path)
+        except Exception:
+            with self._lock:
+                self._touched |= saved
+            raise
+
+    @classmethod
+    def load(cls, path: str, embedder=None) -> 'VectorIndex':
+        index = cls(embedder)
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            if header['dim'] != index.dim:
+                raise ValueError(f"Snapshot dimension {header['dim']} does not match embedder ({index.dim})")
+            matrix = data['matrix']
+            index._grow(len(matrix))
+            index._matrix[:len(matrix)] = matrix
+            index._df = data['df'].astype(np.int64)
+        index._ids = list(header['ids'])
+        index._metadata = list(header['metadata'])
+        index._rows = {doc_id: row for row, doc_id in enumerate(index._ids)}
+        return index
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _set_row(self, doc_id: str, vector: np.ndarray, metadata: Optional[Dict]):
+        """Store a vector (caller holds the lock and calls _changed)."""
+        row = self._rows.get(doc_id)
+        if row is None:
+            row = len(self._ids)
+            self._grow(row + 1)
+            self._ids.append(doc_id)
+            self._metadata.append({})
+            self._rows[doc_id] = row
+        else:
+            self._df -= (self._matrix[row] != 0)
+        self._matrix[row] = vector
+        self._df += (vector != 0)
+        self._metadata[row] = dict(metadata or {})
+
+    def _remove_row(self, doc_id: str) -> bool:
+        """Drop a vector (caller holds the lock and calls _changed)."""
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return False
+        self._df -= (self._matrix[row] != 0)
+        last = len(self._ids) - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = self._ids[last]
+            self._metadata[row] = self._metadata[last]
+            self._rows[self._ids[row]] = row
+        self._matrix[last] = 0
+        self._ids.pop()
+        self._metadata.pop()
+        return True
+
+    def _grow(self, rows: int):
+        if rows <= len(self._matrix):
+            return
+        capacity = max(rows, len(self._matrix) * 2)
+        grown = np.zeros((capacity, self.dim), dtype=np.float32)
+        grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = grown
+
+    def _changed(self):
+        self._normalized = None
+        self.version += 1
+
+    def _idf(self) -> np.ndarray:
+        n = len(self._ids)
+        return (np.log((1.0 + n) / (1.0 + self._df)) + 1.0).astype(np.float32)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _normalized_matrix(self) -> np.ndarray:
+        """IDF-weighted, L2-normalized document matrix (cached until the next update)."""
+        if self._normalized is None:
+            matrix = self._matrix[:len(self._ids)]
+            if self.embedder.uses_idf:
+                matrix = matrix * self._idf()
+            self._normalized = self._normalize(matrix)
+        return self._normalized
+
+
+class SemanticIndex:
+    """Per-user vector indexes (bounded LRU) plus one global index, with merged snapshot persistence."""
+
+    GLOBAL = '_global'
+
+    def __init__(self, snapshot_dir: Optional[str] = None, embedder=None, autosave_every: int = 20,
+                 max_loaded: int = 256):
+        self.snapshot_dir = snapshot_dir
+        self.embedder = embedder or HashingTfidfEmbedder()
+        self.autosave_every = autosave_every
+        self.max_loaded = max_loaded
+        self._indexes: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._saved_versions: Dict[str, int] = {}
+        # name -> (inode, size, mtime_ns) of the snapshot the in-memory index is in sync with
+        self._stamps: Dict[str, Optional[Tuple[int, int, int]]] = {}
+        self._lock = threading.RLock()
+        if snapshot_dir:
+            atexit.register(self.save_all)
+
+    def user(self, user_id: str) -> VectorIndex:
+        return self._get(f"user_{user_id}")
+
+    @property
+    def global_index(self) -> VectorIndex:
+        return self._get(self.GLOBAL)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict] = None, user_id: Optional[str] = None):
+        """Add to the user's index (when user_id is given) or to the global index."""
+        name = f"user_{user_id}" if user_id else self.GLOBAL
+        self._get(name).add(doc_id, text, metadata)
+        self._maybe_save(name)
+
+    def remove(self, doc_id: str, user_id: Optional[str] = None) -> bool:
+        name = f"user_{user_id}" if user_id else self.GLOBAL
+        removed = self._get(name).remove(doc_id)
+        if removed:
+            self._maybe_save(name)
+        return removed
+
+    def save_all(self):
+        """Persist every index changed since its last snapshot."""
+        with self._lock:
+            names = list(self._indexes)
+        for name in names:
+            self._save(name)
+
+    def bootstrap(self, load_items: Callable[[], Iterable[Tuple[str, str, Optional[Dict]]]],
+                  user_id: Optional[str] = None) -> int:
+        """
+        Fill an empty index from load_items() and snapshot it. Only one process per snapshot
+        directory does the work; the others pick the snapshot up on their next access.
+        """
+        name = f"user_{user_id}" if user_id else self.GLOBAL
+        if len(self._get(name)):
+            return 0
+        with self._file_lock(name, blocking=False) as acquired:
+            if not acquired:
+                return 0
+            index = self._get(name)
+            if len(index):
+                return 0
+            items = list(load_items())
+            index.add_many(items)
+            self._save(name, locked=True)
+            return len(items)
+
+    # =============================================================================
+    # HELPER METHODS
+    # =============================================================================
+
+    def _path(self, name: str) -> Optional[str]:
+        if not self.snapshot_dir:
+            return None
+        return os.path.join(self.snapshot_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', name) + '.npz')
+
+    def _get(self, name: str) -> VectorIndex:
+        path = self._path(name)
+        stamp = _stamp(path) if path else None
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is not None:
+                self._indexes.move_to_end(name)
+                if stamp is not None and stamp != self._stamps.get(name):
+                    # Another process saved a newer snapshot
+                    self._merge_snapshot(name, index, path, stamp)
+                return index
+            if stamp is not None:
+                try:
+                    index = VectorIndex.load(path, self.embedder)
+                except Exception as e:
+                    logger.warning(f"SemanticIndex: ignoring unreadable snapshot {path}: {e}")
+            if index is None:
+                index = VectorIndex(self.embedder)
+            self._indexes[name] = index
+            self._saved_versions[name] = index.version
+            self._stamps[name] = stamp
+            self._evict()
+            return index
+
+    def _evict(self):
+        """Save and drop least recently used user indexes beyond max_loaded (caller holds the lock)."""
+        while len(self._indexes) > self.max_loaded:
+            name = next((n for n in self._indexes if n != self.GLOBAL), None)
+            if name is None:
+                return
+            self._save(name)
+            self._indexes.pop(name, None)
+            self._saved_versions.pop(name, None)
+            self._stamps.pop(name, None)
+
+    def _maybe_save(self, name: str):
+        index = self._indexes.get(name)
+        if index is not None and index.version - self._saved_versions.get(name, 0) >= self.autosave_every:
+            self._save(name)
+
+    def _save(self, name: str, locked: bool = False):
+        """Merge with the snapshot on disk (if another process changed it) and write it back."""
+        path = self._path(name)
+        index = self._indexes.get(name)
+        if not path or index is None or index.version == self._saved_versions.get(name):
+            return
+        try:
+            with self._file_lock(name, held=locked):
+                stamp = _stamp(path)
+                if stamp is not None and stamp != self._stamps.get(name):
+                    self._merge_snapshot(name, index, path, stamp)
+                version = index.version
+                index.save(path)
+                self._saved_versions[name] = version
+                self._stamps[name] = _stamp(path)
+        except Exception as e:
+            logger.warning(f"SemanticIndex: failed to save snapshot {path}: {e}")
+
+    def _merge_snapshot(self, name: str, index: VectorIndex, path: str, stamp: Tuple[int, int, int]):
+        try:
+            index.merge_from(VectorIndex.load(path, self.embedder))
+            self._stamps[name] = stamp
+        except Exception as e:
+            logger.warning(f"SemanticIndex: could not merge snapshot {path}: {e}")
+
+    @contextmanager
+    def _file_lock(self, name: str, blocking: bool = True, held: bool = False):
+        """Exclusive lock on a snapshot across processes; yields whether it was acquired."""
+        if held or fcntl is None or not self.snapshot_dir:
+            yield True
+            return
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with open(self._path(name) + '.lock', 'a') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Identity of a snapshot file (os.replace gives every save a new inode)."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns